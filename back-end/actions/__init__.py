@@ -32,4 +32,9 @@ from .actions_meetings import (
 from .actions_fallback import (
     ActionHandleFallback,
     ActionResetFallbackCount,
-)
\ No newline at end of file
+)
+# Risolve l'URL di Ollama e carica i modelli e i prefissi di sistema prima del primo turno
+from .ollama_resolver import resolver
+resolver.start()
+from . import ollama_warmup
+ollama_warmup.start()
@@ -1,56 +1,82 @@
 from typing import Any, Text, Dict, List
-import requests
-from datetime import datetime
-import os, json, requests, re
+import os, json, re
+import asyncio
 
 # import per rasa
 from rasa_sdk import Action, Tracker # type: ignore
 from rasa_sdk.executor import CollectingDispatcher # type: ignore
 from rasa_sdk.events import SlotSet # type: ignore
 
-def get_ollama_url():
+from . import debug_state, ollama_warmup
+from .actions_documents import embeddings
+from .context_resolver import resolver as context_resolver
+from .context_store import context_store, extract_rules, merge_context
+from .llm_scheduler import PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from .model_registry import generate_for_task, TASK_CONTEXT_QA, TASK_CONTEXT_EXTRACTION
+from .ollama_client import OllamaError, OllamaBusy
+from .prompt_builder import build_prompt
+from .token_stream import TokenStream
+
+# Istruzioni statiche (messaggio di sistema su /api/chat, riusato da Ollama tra le chiamate)
+CONTEXT_SYSTEM_PROMPT = """Sei un assistente italiano che risponde alle domande basandosi solo sul contesto fornito (una voce per riga).
+
+Istruzioni:
+- Rispondi sempre in italiano.
+- Rispondi all'utente usando il "tu", riferendoti a lui/lei in seconda persona.
+- Non parlare in prima persona.
+- Se la risposta è chiaramente deducibile dal contesto, rispondi in una o due frasi concise.
+- Se l'utente chiede il suo umore, rispondi come: "Oggi sei felice" o "Oggi sei triste".
+- Se la risposta non è nel contesto, di' chiaramente che non hai quell'informazione.
+- Non inventare nulla.
+- Restituisci solo una frase chiara."""
+
+CONTEXT_PROMPT = """Contesto:
+{context}
+
+Domanda: "{question}"
+"""
+
+EXTRACTION_SYSTEM_PROMPT = """Sei un assistente italiano che estrae informazioni strutturate da un messaggio in formato JSON.
+
+Regole fondamentali:
+1. L'output DEVE essere solo un oggetto JSON valido, non aggiungere altro testo.
+2. Se l'utente esprime uno stato d'animo, usa la chiave "mood".
+3. Se ti chiede informazioni riguardo un documento, salva il nome del documento su cui ti ha fatto la domanda con la chiave "documents".
+4. Se una chiave non si applica, non includerla.
+
+Esempi:
+- Messaggio: "Oggi sono molto felice!" -> Risposta: {"mood": "felice"}
+- Messaggio: "Devo fissare una riunione per domani." -> Risposta: {"azione": "fissare riunione", "data": "domani"}
+- Messaggio: "Sono triste." -> Risposta: {"mood": "triste"}
+- Messaggio: "Chi deve approvare le mie ferie?" -> Risposta: {"documents": ["informazioni_aziendali.pdf"]}
+- Messaggio: "Che struttura ha la relazione?" -> Risposta: {"documents": ["linee_guida.pdf"]}"""
+
+ollama_warmup.register_prefix(TASK_CONTEXT_QA, CONTEXT_SYSTEM_PROMPT)
+ollama_warmup.register_prefix(TASK_CONTEXT_EXTRACTION, EXTRACTION_SYSTEM_PROMPT)
+
+
+async def call_ollama(prompt: str, task: str = TASK_CONTEXT_QA, on_token=None, priority: int = PRIORITY_INTERACTIVE,
+                      system: str = None):
     """
-    Recupera l'URL di Ollama attraverso Ngrok leggendo il tuo Gist.
+    Esegue una richiesta al modello Ollama usando l’URL risolto (e messo in cache) dal resolver.
+    Il modello dipende dal task (data/models.yml) e dal carico della coda.
+    Se viene passato `on_token`, la risposta viene letta in streaming e ogni token
+    viene inoltrato alla callback man mano che arriva.
+    OllamaBusy (coda oltre il budget) viene propagata per permettere il fallback all'operatore.
     """
-    GIST_URL = "https://gist.githubusercontent.com/AndreaNapoli08/0b153d525eb3a45d37cafd65b32bca8c/raw/ollama_url.txt"
-
     try:
-        res = requests.get(GIST_URL, timeout=5)
-        url = res.text.strip()
-        if url.startswith("http"):
-            return url 
-    except:
-        pass
-
-    return None
-
-def call_ollama(prompt: str, model: str = "phi3:3.8b"):
-    """
-    Esegue una richiesta al modello Ollama usando l’URL dinamico Ngrok.
-    """
-    base_url = get_ollama_url()
-    if not base_url:
+        return await generate_for_task(task, prompt, on_token=on_token, priority=priority, system=system)
+    except OllamaBusy:
+        raise
+    except OllamaError:
         return "{}"  # fallback
 
-    try:
-        response = requests.post(
-            f"{base_url}/api/generate",
-            json={
-                "model": model,
-                "prompt": prompt,
-                "stream": False,
-                "options": {"temperature": 0}
-            },
-            timeout=200
-        )
-        data = response.json()
-        return data.get("response", data.get("text", ""))
-    except Exception as e:
-        return "{}"
-
 
 # Salvataggio del contesto
 class ActionSaveContext(Action):
+    # Estrazioni LLM in corso (riferimento necessario finché il task non termina)
+    pending = set()
+
     def name(self) -> Text:
         return "action_save_context"
 
@@ -60,54 +86,54 @@ class ActionSaveContext(Action):
         if not user_message:
             return []
 
-        # Prompt GENERICO: il modello decide cosa estrarre
-        prompt = f"""
-            Sei un assistente italiano che estrae informazioni strutturate da un messaggio in formato JSON.
-            
-            Regole fondamentali:
-            1. L'output DEVE essere solo un oggetto JSON valido, non aggiungere altro testo.
-            2. Se l'utente esprime uno stato d'animo, usa la chiave "mood".
-            3. Se ti chiede informazioni riguardo un documento, salva il nome del documento su cui ti ha fatto la domanda con la chiave "documents".
-            4. Se una chiave non si applica, non includerla.
-
-            Esempi:
-            - Messaggio: "Oggi sono molto felice!" -> Risposta: {{"mood": "felice"}}
-            - Messaggio: "Devo fissare una riunione per domani." -> Risposta: {{"azione": "fissare riunione", "data": "domani"}}
-            - Messaggio: "Sono triste." -> Risposta: {{"mood": "triste"}}
-            - Messaggio: "Chi deve approvare le mie ferie?" -> Risposta: {{"documents": ["informazioni_aziendali.pdf"]}}
-            - Messaggio: "Che struttura ha la relazione?" -> Risposta: {{"documents": ["linee_guida.pdf"]}}
-
-            Messaggio dell'utente da analizzare: "{user_message}"
-        """
+        sender_id = tracker.sender_id
+
+        # Dopo un riavvio dell'action server il contesto riparte da quello nello slot
+        if not context_store.get(sender_id):
+            try:
+                prev = json.loads(tracker.get_slot("auto_context") or "{}")
+            except ValueError:
+                prev = {}
+            context_store.merge(sender_id, prev)
+
+        # Primo passaggio a regole: il turno prosegue subito con quello che è già certo
+        intent_name = tracker.latest_message.get("intent", {}).get("name")
+        extracted = extract_rules(user_message, intent_name)
+        extracted["_last_user_message"] = user_message
+        merged = context_store.merge(sender_id, extracted)
+
+        # L'estrazione con l'LLM completa il contesto in background
+        task = asyncio.create_task(self.extract_with_llm(sender_id, user_message))
+        ActionSaveContext.pending.add(task)
+        task.add_done_callback(ActionSaveContext.pending.discard)
+
+        return [SlotSet("auto_context", json.dumps(merged, ensure_ascii=False))]
+
+    @staticmethod
+    async def extract_with_llm(sender_id: str, user_message: str):
+        # Prompt GENERICO: il modello decide cosa estrarre (regole ed esempi nel messaggio di sistema)
+        prompt = f'Messaggio dell\'utente da analizzare: "{user_message}"'
 
         # 💡 Chiamata a Ollama via ngrok
-        text_output = call_ollama(prompt)
+        try:
+            text_output = await call_ollama(
+                prompt, task=TASK_CONTEXT_EXTRACTION, priority=PRIORITY_BACKGROUND, system=EXTRACTION_SYSTEM_PROMPT,
+            )
+        except OllamaBusy:
+            # Ollama occupato: resta il risultato del primo passaggio a regole
+            return
         # Estrazione JSON
         match = re.search(r"\{.*\}", text_output, re.DOTALL)
         extracted = {}
         if match:
             try:
                 extracted = json.loads(match.group(0))
-            except:
+            except ValueError:
                 extracted = {}
 
-        extracted["_last_user_message"] = user_message
-        extracted["_timestamp"] = datetime.utcnow().isoformat() + "Z"
-
-        prev_context = tracker.get_slot("auto_context")
-        try:
-            prev = json.loads(prev_context) if prev_context else {}
-        except:
-            prev = {}
-
-        merged = dict(prev)
-        for k, v in extracted.items():
-            if k in merged and isinstance(merged[k], list) and isinstance(v, list):
-                merged[k] = list(dict.fromkeys(merged[k] + v))
-            else:
-                merged[k] = v
-
-        return [SlotSet("auto_context", json.dumps(merged, ensure_ascii=False))]
+        if isinstance(extracted, dict) and extracted:
+            context_store.merge(sender_id, extracted, message=user_message)
+        debug_state.publish("context_store", context_store.stats())
 
 
 # Prelievo del contesto e risposta alle domande
@@ -120,33 +146,50 @@ class ActionQueryContext(Action):
         user_question = tracker.latest_message.get("text")
         context_json = tracker.get_slot("auto_context")
 
-        if not context_json:
+        # Lo store contiene anche quanto estratto dall'LLM dopo la fine del turno
+        try:
+            context = json.loads(context_json) if context_json else {}
+        except ValueError:
+            context = {}
+        context = merge_context(context, context_store.get(tracker.sender_id))
+
+        if not context:
             dispatcher.utter_message("Non ho ancora informazioni salvate su di te")
             return []
+        context_json = json.dumps(context, ensure_ascii=False)
 
-        # Prompt dinamico per interrogare il contesto
-        prompt = f"""
-            Sei un assistente italiano che risponde alle domande basandosi solo sul seguente contesto JSON:
-
-            {context_json}
-
-            Domanda: "{user_question}"
+        # Domande sulle chiavi note (umore, documenti, data...): risposta immediata senza LLM
+        answer = context_resolver.resolve(user_question, context)
+        debug_state.publish("context_resolver", context_resolver.stats())
+        if answer:
+            dispatcher.utter_message(text=answer)
+            return []
 
-            Istruzioni:
-            - Rispondi sempre in italiano.
-            - Rispondi all'utente usando il "tu", riferendoti a lui/lei in seconda persona.
-            - Non parlare in prima persona.
-            - Se la risposta è chiaramente deducibile dal contesto, rispondi in una o due frasi concise.
-            - Se l'utente chiede il suo umore, rispondi come: "Oggi sei felice" o "Oggi sei triste".
-            - Se la risposta non è nel contesto, di' chiaramente che non hai quell'informazione.
-            - Non inventare nulla.
-            - Restituisci solo una frase chiara.
-        """
+        # Solo le voci del contesto più vicine alla domanda, entro il budget di token
+        facts = [
+            f"{key}: {json.dumps(value, ensure_ascii=False) if not isinstance(value, str) else value}"
+            for key, value in context.items() if key != "_timestamp"
+        ] or [context_json]
+        query_embedding = await asyncio.to_thread(embeddings.embed_query, user_question)
+        prompt = await asyncio.to_thread(
+            build_prompt, CONTEXT_PROMPT, user_question, facts,
+            query_embedding, embeddings.embed_documents, separator="\n", name="context",
+            system=CONTEXT_SYSTEM_PROMPT,
+        )
 
-        # 💡 Chiamata ad Ollama via Ngrok
-        answer = call_ollama(prompt).strip()
+        # 💡 Chiamata ad Ollama via Ngrok, con i token inoltrati al frontend
+        stream = TokenStream(tracker)
+        try:
+            answer = (await call_ollama(
+                prompt, on_token=stream.push if stream.enabled else None, system=CONTEXT_SYSTEM_PROMPT,
+            )).strip()
+        except OllamaBusy:
+            await stream.close("")
+            dispatcher.utter_message(response="utter_contact_operator")
+            return []
         if not answer:
             answer = "Non ho trovato informazioni rilevanti nel contesto."
 
+        await stream.close(answer)
         dispatcher.utter_message(text=answer)
         return []
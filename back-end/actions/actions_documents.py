@@ -1,7 +1,9 @@
 import os
+import time
+import asyncio
+import logging
 from typing import Any, Text, Dict, List
-import re, requests
-from PyPDF2 import PdfReader # type: ignore
+import re
 from dotenv import load_dotenv # type: ignore
 
 # import per rasa
@@ -9,26 +11,66 @@ from rasa_sdk import Action, Tracker # type: ignore
 from rasa_sdk.executor import CollectingDispatcher # type: ignore
 from rasa_sdk.events import SlotSet, FollowupAction # type: ignore
 
-# LangChain / Chroma / Embeddings / LLMs
+# LangChain / Chroma / Embeddings
 from langchain.embeddings import HuggingFaceEmbeddings # type: ignore
 from langchain.vectorstores import Chroma # type: ignore
-from langchain.llms import Ollama # type: ignore
-from langchain.chains import RetrievalQA # type: ignore
 from langchain.prompts import PromptTemplate # type: ignore
 
+from . import debug_state, http_client, ollama_warmup
+from .cached_embeddings import CachedEmbeddings, CACHE_FILE as EMBEDDINGS_CACHE_FILE
+from .document_registry import registry
+from .model_registry import generate_for_task, TASK_RAG_ANSWER
+from .ollama_client import OllamaError, OllamaBusy
+from .collection_router import (
+    router, load_collections_config, collection_for_file, discover_collections, compute_centroid, save_centroid,
+)
+from .prompt_builder import build_prompt, extract_sentences
+from .retrieval import retrieve, collection_settings, merge_results
+from .semantic_cache import get_semantic_cache
+from .token_stream import TokenStream
+
 # === CONFIGURAZIONI ===
-PDF_DIR = os.path.join(os.path.dirname(__file__), "data/docs")
 CHROMA_DIR = "actions/data/chroma_db" 
-embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+RAG_SYSTEM_PROMPT_FILE = os.path.join(os.path.dirname(__file__), "data/prompts/rag_system.txt")
+# Tempo massimo (s) di un turno RAG: oltre si risponde con le frasi più rilevanti dei documenti
+TURN_DEADLINE = float(os.getenv("RAG_TURN_DEADLINE", "12"))
+MIN_GENERATION_WAIT = 1.0
+# Cache LRU condivisa: la stessa domanda viene embeddata una volta sola per turno
+embeddings = CachedEmbeddings(
+    HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL),
+    model_name=EMBEDDING_MODEL,
+    persist_path=EMBEDDINGS_CACHE_FILE,
+)
 
 load_dotenv()
 
+# === PROMPT OTTIMIZZATO ===
+# Istruzioni statiche inviate come messaggio di sistema (/api/chat): sempre uguali,
+# quindi Ollama ne riusa la valutazione tra una chiamata e l'altra. Nel file condiviso
+# con test/ollama_latency.py, che misura lo stesso prefisso
+with open(RAG_SYSTEM_PROMPT_FILE, encoding="utf-8") as f:
+    RAG_SYSTEM_PROMPT = f.read().strip()
+
+PROMPT_TEMPLATE = """Contesto:
+{context}
+
+Domanda:
+{question}
+
+Risposta concisa in italiano:
+"""
+RAG_PROMPT = PromptTemplate(template=PROMPT_TEMPLATE, input_variables=["context", "question"])
+ollama_warmup.register_prefix(TASK_RAG_ANSWER, RAG_SYSTEM_PROMPT)
+
+logger = logging.getLogger(__name__)
+
 # Invio di un PDF locale in risposta a una richiesta dell'utente
 class ActionSendLocalPDF(Action):
     def name(self) -> str:
         return "action_send_local_pdf"
 
-    def run(self, dispatcher, tracker, domain):
+    async def run(self, dispatcher, tracker, domain):
         user_message = tracker.latest_message.get("text").lower()
 
         # Mappa di documenti disponibili
@@ -37,54 +79,38 @@ class ActionSendLocalPDF(Action):
             "linee guida": "linee_guida.pdf",
         }
 
-        pdf_url=""
-
         # Trova il PDF più rilevante
         selected_pdf = None
         for key, filename in pdf_map.items():
             if key in user_message:
                 selected_pdf = filename
-                if filename == "linee_guida.pdf":
-                    pdf_url = "https://drive.google.com/uc?export=download&id=1UAysV_OIQB0oXODTEFmp03zNOW5HpCcs"
-                elif filename == "informazioni_aziendali.pdf":
-                    pdf_url = "https://drive.google.com/uc?export=download&id=18lvJQk7YCCr7trgco_0o1T_3RR40pgmZ"
                 break
-        
-        
+
         if not selected_pdf:
             user_events = [e for e in tracker.events if e.get("event") == "user"]
             intent_name = user_events[-2].get("parse_data", {}).get("intent", {}).get("name")
             if intent_name == "ask_information_relazione":
-                selected_pdf = "linee_guida.pdf"    
-                pdf_url = "https://drive.google.com/uc?export=download&id=1UAysV_OIQB0oXODTEFmp03zNOW5HpCcs"
+                selected_pdf = "linee_guida.pdf"
             elif intent_name == "ask_information_aziendale":
-                selected_pdf = "informazioni_aziendali.pdf" 
-                pdf_url = "https://drive.google.com/uc?export=download&id=18lvJQk7YCCr7trgco_0o1T_3RR40pgmZ"
+                selected_pdf = "informazioni_aziendali.pdf"
             else:
                 dispatcher.utter_message(text="Indicami il nome o l'argomento del documento che desideri visualizzare")
                 return []
-        
-        # path del file PDF
-        pdf_path = os.path.join(PDF_DIR, selected_pdf)
 
-        # Ottieni dimensione e numero di pagine
-        size_bytes = os.path.getsize(pdf_path)
-        size_mb = round(size_bytes / (1024 * 1024), 2)
-
-        try:
-            reader = PdfReader(pdf_path)
-            num_pages = len(reader.pages)
-        except Exception:
-            num_pages = "N/D"
+        # Dimensione, pagine e link dal registro calcolato in fase di ingestione
+        info = await asyncio.to_thread(registry.get, selected_pdf)
+        if info is None:
+            dispatcher.utter_message(text="Il documento richiesto non è al momento disponibile.")
+            return []
 
         dispatcher.utter_message(
             text="Ecco il documento che hai richiesto:",
             attachment={
                 "type": "file",
-                "url": pdf_url,
+                "url": info["download_url"] or "",
                 "name": selected_pdf,
-                "size": size_mb,
-                "pages": num_pages
+                "size": round(info["size_bytes"] / (1024 * 1024), 2),
+                "pages": info["pages"] if info["pages"] is not None else "N/D"
             }
         )
         return []
@@ -94,21 +120,22 @@ class ActionListAvailableDocuments(Action):
     def name(self) -> Text:
         return "action_list_available_documents"
 
-    def run(self,
+    async def run(self,
             dispatcher: CollectingDispatcher,
             tracker,
             domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
 
-        # Elenco dei file PDF nella cartella
-        pdf_files = [f for f in os.listdir(PDF_DIR) if f.lower().endswith(".pdf")]
         endpoint = os.getenv("DOCUMENTS_API_URL")
 
         try:
-            response = requests.get(endpoint, timeout=10)
+            response = await http_client.get(endpoint, service="documents")
             data = response.json()
         except Exception as e:
-            dispatcher.utter_message(text=f"Errore di connessione al server: {e}")
-            return []
+            # Server non raggiungibile: proponiamo i PDF presenti nel registro locale
+            data = [{"title": d["filename"], "filename": d["filename"]} for d in registry.all()]
+            if not data:
+                dispatcher.utter_message(text=f"Errore di connessione al server: {e}")
+                return []
 
         buttons = []
 
@@ -128,190 +155,212 @@ class ActionListAvailableDocuments(Action):
 # --- Recupero risposte dai documenti ---
 class ActionAnswerFromChroma(Action):
     vectordbs = {}
-    llm = None
-    qa_chains = {}
+    centroids_checked = False
+    # Generazioni che proseguono dopo la scadenza del turno (per scaldare la cache)
+    background = set()
 
     def name(self) -> Text:
         return "action_answer_from_chroma"
-    
-    def expand_query(q: str) -> str:
-        synonyms = {
-            "erogazione": ["accredito", "pagamento", "versamento"],
-            "comunicare": ["pianificare", "informare"],
-            "stipendio": ["retribuzione", "salario", "busta paga"],
-            "giorno": ["data", "scadenza", "entro quando"],
-            "ferie": ["vacanze", "congedo"],
-        }
-        for k, vals in synonyms.items():
-            if k in q.lower():
-                q += " " + " ".join(vals)
-
-        return q
 
-    def get_ollama_base_url():
-        """
-        Legge l'URL di Ngrok dal Gist GitHub.
-        Ritorna qualcosa come: https://xxxx.ngrok-free.app
-        """
-        GIST_URL = "https://gist.githubusercontent.com/AndreaNapoli08/0b153d525eb3a45d37cafd65b32bca8c/raw/ollama_url.txt"
-
-        try:
-            r = requests.get(GIST_URL, timeout=5)
-            url = r.text.strip()
-            if url.startswith("http"):
-                return url
-        except:
-            pass
-
-        return None
-
-    def run(
+    @classmethod
+    def load_vectordb(cls, collection_name):
+        # --- Inizializza il vectordb solo la prima volta ---
+        if collection_name not in cls.vectordbs:
+            cls.vectordbs[collection_name] = Chroma(
+                persist_directory=CHROMA_DIR,
+                collection_name=collection_name,
+                embedding_function=embeddings,
+            )
+        return cls.vectordbs[collection_name]
+
+    @classmethod
+    def ensure_centroids(cls):
+        # Collezioni indicizzate prima del router: il centroide si calcola una volta da Chroma
+        if cls.centroids_checked:
+            return
+        known = set(router.collections())
+        for collection_name, filenames in discover_collections().items():
+            if filenames and collection_name not in known:
+                content = cls.load_vectordb(collection_name)._collection.get(include=["embeddings"])
+                save_centroid(collection_name, compute_centroid(content["embeddings"]))
+        cls.centroids_checked = True
+
+    async def run(
         self,
         dispatcher: CollectingDispatcher,
         tracker: Tracker,
         domain: Dict[Text, Any]
     ) -> List[Dict[Text, Any]]:
-        
+        turn_started = time.perf_counter()
         file_name = next(tracker.get_latest_entity_values("file_name"), None) or tracker.get_slot("file_name")
 
-        # Recuperiamo l'intent della domanda e scegliamo la collezione dove cercare la risposta
+        # Recuperiamo l'intent della domanda: documento scelto e intent configurati
+        # (data/collections.yml) indicano già la collezione, altrimenti decide il router
         intent_name = tracker.latest_message.get("intent", {}).get("name")
+        config = load_collections_config()
 
-        if intent_name == "ask_information_relazione":
-            collection_name = "relazione_docs"
-        elif intent_name == "ask_information_aziendale":
-            collection_name = "azienda_docs"
+        if intent_name in config["intents"]:
+            collection_names = [config["intents"][intent_name]]
         elif file_name:
-            if(file_name == "linee_guida.pdf"):
-                collection_name = "relazione_docs"
-            elif(file_name == "informazioni_aziendali.pdf"):    
-                collection_name = "azienda_docs" 
-        else:
-            dispatcher.utter_message(text="Non sono sicuro di dove cercare la risposta")
-            return []
-
-        # --- Inizializza il vectordb solo la prima volta ---
-        if collection_name not in ActionAnswerFromChroma.vectordbs:
-            try:
-                vectordb = Chroma(
-                    persist_directory=CHROMA_DIR,
-                    collection_name=collection_name,
-                    embedding_function=embeddings,
-                )
-                ActionAnswerFromChroma.vectordbs[collection_name] = vectordb
-            except Exception as e:
-                dispatcher.utter_message(text=f"Errore caricando Chroma: {e}")
-                return []
-        else:
-            vectordb = ActionAnswerFromChroma.vectordbs[collection_name]
-
-        # --- Inizializza l’LLM una sola volta ---
-        ollama_base = ActionAnswerFromChroma.get_ollama_base_url()
-        if not ollama_base:
-            dispatcher.utter_message(text="Errore: impossibile contattare Ollama (URL ngrok non trovato).")
-            return []
-        
-        if ActionAnswerFromChroma.llm is None:
-            try:
-                ActionAnswerFromChroma.llm = Ollama(
-                    model="phi3:3.8b",
-                    temperature=0,
-                    base_url=f"{ollama_base}"
-                )
-            except Exception as e:
-                dispatcher.utter_message(text=f"Errore inizializzando LLM: {e}")
-                return []
-            
-        # --- Inizializza la QA chain per la collezione (una volta sola) ---
-        if collection_name not in ActionAnswerFromChroma.qa_chains:
-            semantic_retriever = vectordb.as_retriever(
-                search_type="mmr",
-                search_kwargs={"k": 2, "fetch_k": 4, "lambda_mult": 0.5}
-            )
-
-            # === PROMPT OTTIMIZZATO ===
-            PROMPT_TEMPLATE = """
-            Sei un assistente che risponde solo in italiano. 
-            Hai a disposizione delle informazioni provenienti da documenti (contesto).
-            Rispondi in modo breve, chiaro e preciso (una o due frasi), salvo si tratti di una procedura: in quel caso spiega i passaggi essenziali.
-            Se il contesto contiene riferimenti impliciti o sinonimi, deduci la risposta con ragionamento.
-            Se non c'è davvero nessun riferimento, rispondi chiaramente che non è specificato nel documento senza spiegare nient'altro.
-
-            Contesto:
-            {context}
-
-            Domanda:
-            {question}
-
-            Risposta concisa in italiano:
-            """
-            PROMPT = PromptTemplate(template=PROMPT_TEMPLATE, input_variables=["context", "question"])
-
-            qa_chain = RetrievalQA.from_chain_type(
-                llm=ActionAnswerFromChroma.llm,
-                retriever=semantic_retriever,
-                chain_type="stuff",
-                return_source_documents=True,
-                chain_type_kwargs={"prompt": PROMPT, "document_variable_name": "context"}
-            )
-            ActionAnswerFromChroma.qa_chains[collection_name] = qa_chain
+            collection_names = [collection_for_file(file_name, config)]
         else:
-            qa_chain = ActionAnswerFromChroma.qa_chains[collection_name]
+            collection_names = []
 
         # ----------- ESTRAI LA DOMANDA DALLA TRACCIA ---------
+        # I sinonimi (data/synonyms.yml) sono applicati dall'indice BM25, non alla domanda
         query = tracker.latest_message.get("text", "").strip()
-        query = ActionAnswerFromChroma.expand_query(query)
+        user_messages = [e for e in tracker.events if e.get("event") == "user"]
         if query.startswith("/choose_document"):
-            user_messages = [e for e in tracker.events if e.get("event") == "user"]
             query = user_messages[-3].get("text")
+        elif query.startswith("/choose_yes_document"):
+            # "Vuoi che cerco nei documenti?" -> sì: la domanda è quella prima del fallback
+            query = user_messages[-2].get("text")
 
         if not query:
             dispatcher.utter_message(text="Scusa, non ho capito la domanda.")
             return []
 
-        # === COSTRUISCI CATENA DI DOMANDA-RISPOSTA ===
+        # Embedding, ricerca e LLM sono bloccanti: li eseguiamo fuori dall'event loop
+        started = time.perf_counter()
+        query_embedding = await asyncio.to_thread(embeddings.embed_query, query)
+        embed_ms = round((time.perf_counter() - started) * 1000, 1)
+        debug_state.publish("embeddings", embeddings.stats())
+
+        # --- Router: collezione più vicina alla domanda, o tutte se la scelta non è netta ---
+        if not collection_names:
+            try:
+                await asyncio.to_thread(self.ensure_centroids)
+            except Exception as e:
+                logger.warning("Centroidi delle collezioni non disponibili: %s", e)
+            decision = router.route(query_embedding)
+            debug_state.publish("collection_router", {**router.stats(), "last_scores": decision.scores})
+            collection_names = decision.collections
+            if not collection_names:
+                # Nessun centroide: lasciamo scegliere il documento all'utente
+                return [FollowupAction("action_list_available_documents")]
+
         try:
-            # Verifica se ci sono contenuti rilevanti nei documenti
-            results_with_score = vectordb.similarity_search_with_score(query, k=2)
-            if not results_with_score or all(score > 1.1  for _, score in results_with_score):
-                dispatcher.utter_message(text="Nessuna risposta rilevante è stata trovata nei documenti")
-                fallback_count = tracker.get_slot("fallback_count") or 0
-                fallback_count += 1
-
-                if fallback_count >= 2:
-                    dispatcher.utter_message(response="utter_contact_operator")
-                    fallback_count = 0 
-    
-                return [SlotSet("fallback_count", fallback_count)]
-            
-            result = qa_chain.invoke({"query": query})
-            answer_text = result.get("result") if isinstance(result, dict) else str(result)
+            vectordbs = {name: self.load_vectordb(name) for name in collection_names}
         except Exception as e:
+            dispatcher.utter_message(text=f"Errore caricando Chroma: {e}")
+            return []
+
+        # --- Cache semantica: domande equivalenti già risposte non passano dall'LLM ---
+        for name in collection_names:
+            semantic_cache = get_semantic_cache(name)
+            cached = semantic_cache.lookup(query_embedding)
+            debug_state.publish(f"semantic_cache_{name}", semantic_cache.stats())
+            if cached:
+                sources_text = f"Fonte: {cached['sources'][0]}" if cached["sources"] else ""
+                dispatcher.utter_message(text=f"{cached['answer']}\n\u200B\n{sources_text}")
+                return []
+
+        # === RETRIEVAL IN UN SOLO PASSAGGIO (in parallelo sulle collezioni) ===
+        settings = {name: collection_settings(name) for name in collection_names}
+        results = await asyncio.gather(*(
+            asyncio.to_thread(
+                retrieve, vectordbs[name], query_embedding,
+                k=settings[name]["k"], fetch_k=settings[name]["fetch_k"], lambda_mult=settings[name]["lambda_mult"],
+                mode=settings[name]["mode"], query=query, collection=name,
+            )
+            for name in collection_names
+        ))
+        retrieval = results[0] if len(results) == 1 else merge_results(
+            results, k=min(s["k"] for s in settings.values())
+        )
+        retrieval.timings["embed_ms"] = embed_ms
+        collection_name = "+".join(collection_names)
+        if not retrieval.relevant:
+            dispatcher.utter_message(text="Nessuna risposta rilevante è stata trovata nei documenti")
+            fallback_count = tracker.get_slot("fallback_count") or 0
+            fallback_count += 1
+
+            if fallback_count >= 2:
+                dispatcher.utter_message(response="utter_contact_operator")
+                fallback_count = 0 
+
+            return [SlotSet("fallback_count", fallback_count)]
+
+        # === GENERAZIONE DELLA RISPOSTA ===
+        # Contesto compresso alle frasi più vicine alla domanda (budget PROMPT_MAX_TOKENS)
+        prompt = await asyncio.to_thread(
+            build_prompt, RAG_PROMPT, query, [doc.page_content for doc in retrieval.documents],
+            query_embedding, embeddings.embed_documents, system=RAG_SYSTEM_PROMPT,
+        )
+        stream = TokenStream(tracker)
+
+        # Estrazione delle fonti: il primo documento MMR è quello più simile alla domanda
+        source_docs = retrieval.documents
+        source_name = source_docs[0].metadata.get("source", "Documento sconosciuto")
+        sources_text = f"Fonte: {os.path.basename(source_name)}"
+
+        # La risposta va nella cache della collezione da cui proviene il documento principale
+        if len(collection_names) > 1:
+            collection_names = [collection_for_file(os.path.basename(source_name), config)]
+        semantic_cache = get_semantic_cache(collection_names[0])
+        sources = [os.path.basename(d.metadata.get("source", "")) for d in source_docs]
+
+        def cache_answer(text):
+            if text:
+                semantic_cache.store(query, query_embedding, re.sub(r"\s+", " ", text).strip(), sources)
+
+        # La generazione è un task a parte: se supera la scadenza del turno continua in background
+        started = time.perf_counter()
+        remaining = TURN_DEADLINE - (time.perf_counter() - turn_started)
+        # Con poco tempo residuo il registro dei modelli può scegliere un modello più leggero
+        generation = asyncio.ensure_future(generate_for_task(
+            TASK_RAG_ANSWER, prompt, on_token=stream.push if stream.enabled else None, budget=remaining,
+            system=RAG_SYSTEM_PROMPT,
+        ))
+        try:
+            answer_text = await asyncio.wait_for(asyncio.shield(generation), timeout=max(remaining, MIN_GENERATION_WAIT))
+        except asyncio.TimeoutError:
+            answer_text = None
+            ActionAnswerFromChroma.background.add(generation)
+            generation.add_done_callback(ActionAnswerFromChroma.background.discard)
+            generation.add_done_callback(
+                lambda task: cache_answer(task.result()) if not task.cancelled() and not task.exception() else None
+            )
+            retrieval.timings["generate_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            retrieval.timings["deadline_hit"] = True
+            logger.info("RAG %s timings: %s", collection_name, retrieval.timings)
+            debug_state.publish("rag_pipeline", {"collection": collection_name, **retrieval.timings})
+
+            # Risposta estrattiva: le frasi dei documenti più vicine alla domanda
+            extract = await asyncio.to_thread(
+                extract_sentences, query_embedding, [doc.page_content for doc in source_docs], embeddings.embed_documents,
+            )
+            final_message = f"{extract}\n\u200B\n{sources_text}"
+            await stream.close(final_message)
+            dispatcher.utter_message(text=final_message)
+            return []
+        except OllamaBusy as e:
+            # Coda troppo lunga: meglio indirizzare subito all'operatore che far attendere minuti
+            logger.warning("Ollama sovraccarico: %s", e)
+            await stream.close("")
+            dispatcher.utter_message(response="utter_contact_operator")
+            return []
+        except OllamaError as e:
             answer_text = None
             print("Errore nel processo QA:", e)
+        retrieval.timings["generate_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+        logger.info("RAG %s timings: %s", collection_name, retrieval.timings)
+        debug_state.publish("rag_pipeline", {"collection": collection_name, **retrieval.timings})
 
         # === FALLBACK: se LLM non risponde ===
         if not answer_text:
-            docs = semantic_retriever.get_relevant_documents(query)
-            if not docs:
-                dispatcher.utter_message(text="Non ho trovato informazioni rilevanti nei documenti.")
-                return []
+            await stream.close("")
+            dispatcher.utter_message(text="Non sono riuscito a generare una risposta dai documenti, riprova tra poco.")
+            return []
 
         # Pulizia finale
         answer_text = re.sub(r"\s+", " ", answer_text).strip()
-
-        # Estrazione delle fonti
-        source_docs = result.get("source_documents", [])
-        if source_docs:
-            best_doc = source_docs[0]  # documento con similarità più alta
-            meta = getattr(best_doc, "metadata", {})
-            source_name = meta.get("source", "Documento sconosciuto")
-            sources_text = f"Fonte: {os.path.basename(source_name)}"
-        else:
-            sources_text = ""
+        cache_answer(answer_text)
 
         # Invia la risposta completa all'utente
         final_message = f"{answer_text}\n\u200B\n{sources_text}"
+        await stream.close(final_message)
         dispatcher.utter_message(text=final_message)
 
-        return []
\ No newline at end of file
+        return []
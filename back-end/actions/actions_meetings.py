@@ -1,20 +1,26 @@
 from typing import Any, Text, Dict, List
 from pathlib import Path
-import json, re, os, requests
+import json, re, os
 
 # import per rasa
 from rasa_sdk import Action, Tracker # type: ignore
 from rasa_sdk.executor import CollectingDispatcher # type: ignore
 
+from . import http_client
+
 from dotenv import load_dotenv # type: ignore
 load_dotenv()
 
+# === CONFIGURAZIONI ===
+# Orari alternativi proposti quando la sala richiesta non è disponibile
+ALTERNATIVES_LIMIT = int(os.getenv("BOOKING_ALTERNATIVES", "4"))
+
 # --- Controllo disponibilità sala ---
 class ActionAvailabilityCheckRoom(Action):
     def name(self) -> Text:
         return "action_availability_check_room"
 
-    def run(
+    async def run(
         self,
         dispatcher: CollectingDispatcher,
         tracker: Tracker,
@@ -50,7 +56,7 @@ class ActionAvailabilityCheckRoom(Action):
         }
 
         try:
-            response = requests.post(endpoint, json=payload, timeout=100)
+            response = await http_client.post(endpoint, service="booking", json=payload)
             data = response.json()
         except Exception as e:
             dispatcher.utter_message(text=f"Errore di connessione al server prenotazioni: {e}")
@@ -77,20 +83,67 @@ class ActionAvailabilityCheckRoom(Action):
             dispatcher.utter_message(text=message)
 
         elif response.status_code == 404:
-            dispatcher.utter_message(
-                text="😞 Mi dispiace, non ci sono sale disponibili con le caratteristiche richieste in questo orario."
+            # Nello stesso turno proponiamo gli orari liberi più vicini come pulsanti
+            alternatives = await self.find_alternatives(
+                appointment_date, appointment_hour, appointment_duration, person_picker, room_features
             )
+            if alternatives:
+                buttons = []
+                for window in alternatives:
+                    rooms = ", ".join(room["name"] for room in window["sale"][:2])
+                    payload = "/provide_room_features" + json.dumps(
+                        {"appointment_date": window["data"], "appointment_hour": window["inizio"]}
+                    )
+                    buttons.append({
+                        "title": f"{window['data'][8:10]}/{window['data'][5:7]} {window['inizio']}-{window['fine']} ({rooms})",
+                        "payload": payload
+                    })
+                dispatcher.utter_message(
+                    text="😞 In questo orario non ci sono sale disponibili con le caratteristiche richieste. "
+                         "Ecco gli orari liberi più vicini:",
+                    buttons=buttons
+                )
+            else:
+                dispatcher.utter_message(
+                    text="😞 Mi dispiace, non ci sono sale disponibili con le caratteristiche richieste in questo orario."
+                )
         else:
             error = data.get("detail") or "Errore sconosciuto."
             dispatcher.utter_message(text=f"Errore durante la prenotazione: {error}")
 
         return []
+
+    @staticmethod
+    async def find_alternatives(appointment_date, appointment_hour, appointment_duration, person_picker, room_features):
+        """Finestre libere più vicine da /rooms/availability (lista vuota se il servizio non risponde)."""
+        endpoint = os.getenv("AVAILABILITY_API_URL")
+        if not endpoint:
+            booking_url = os.getenv("BOOKING_API_URL", "")
+            endpoint = booking_url.rsplit("/", 1)[0] + "/availability" if booking_url else None
+        if not endpoint:
+            return []
+
+        params = {
+            "date": appointment_date,
+            "hour": appointment_hour,
+            "duration": appointment_duration,
+            "persons": person_picker or 1,
+            "room_features": room_features or [],
+            "limit": ALTERNATIVES_LIMIT,
+        }
+        try:
+            response = await http_client.get(endpoint, service="availability", params=params)
+            if response.status_code != 200:
+                return []
+            return response.json()
+        except Exception:
+            return []
     
 class ActionGetReservation(Action):
     def name(self) -> Text:
         return "action_get_reservation"
 
-    def run(self,
+    async def run(self,
             dispatcher: CollectingDispatcher,
             tracker: Tracker,
             domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
@@ -106,7 +159,7 @@ class ActionGetReservation(Action):
         api_url = f"{endpoint}{user_email}"
 
         try:
-            response = requests.get(api_url, timeout=100)
+            response = await http_client.get(api_url, service="reservations")
             data = response.json()
         except Exception as e:
             dispatcher.utter_message(text=f"Errore di connessione al server: {e}")
@@ -131,7 +184,7 @@ class ActionDeleteReservation(Action):
     def name(self) -> Text:
         return "action_delete_reservation"
 
-    def run(self,
+    async def run(self,
             dispatcher: CollectingDispatcher,
             tracker: Tracker,
             domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
@@ -149,7 +202,7 @@ class ActionDeleteReservation(Action):
         api_url = f"{endpoint}{reservation_id}"
 
         try:
-            response = requests.delete(api_url, timeout=10)
+            response = await http_client.delete(api_url, service="reservations")
             data = response.json()
         except Exception as e:
             dispatcher.utter_message(text=f"Errore di connessione al server: {e}")
@@ -1,5 +1,5 @@
 from typing import Any, Text, Dict, List
-import os, json, requests, re
+import os, json, re
 
 # import per rasa
 from rasa_sdk import Action, Tracker # type: ignore
@@ -7,13 +7,15 @@ from rasa_sdk.executor import CollectingDispatcher # type: ignore
 from rasa_sdk.events import FollowupAction # type: ignore
 from dotenv import load_dotenv # type: ignore
 
+from . import http_client
+
 load_dotenv()
 # === Controlla il ruolo dell'utente loggato ===
 class ActionCheckUserRole(Action):
     def name(self) -> Text:
         return "action_check_user_role"
 
-    def run(self, dispatcher: CollectingDispatcher,
+    async def run(self, dispatcher: CollectingDispatcher,
             tracker: Tracker,
             domain: Dict[Text, Any]) -> list:
 
@@ -27,7 +29,7 @@ class ActionCheckUserRole(Action):
         # 2️⃣ Chiamata HTTP al server per ottenere la lista utenti
         try:
             endpoint = os.getenv("USERS_API_URL")
-            response = requests.get(endpoint) 
+            response = await http_client.get(endpoint, service="users")
             response.raise_for_status()
             users = response.json()  # lista di utenti
         except Exception as e:
@@ -57,7 +59,7 @@ class ActionChangePassword(Action):
     def name(self) -> Text:
         return "action_change_password"
 
-    def run(self, dispatcher: CollectingDispatcher,
+    async def run(self, dispatcher: CollectingDispatcher,
             tracker: Tracker,
             domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
 
@@ -80,8 +82,9 @@ class ActionChangePassword(Action):
         # Verifica la vecchia password con il backend. Abbiamo fatto un altro endpoint perché l'endpoint che restituisce gli utenti 
         # non restituisce le password per motivi di sicurezza.
         try:
-            verify_response = requests.post(
+            verify_response = await http_client.post(
                 f"{endpoint}/verify_password",
+                service="users",
                 json={"email": email, "password": old_password},
             )
             verify_response.raise_for_status()
@@ -96,8 +99,9 @@ class ActionChangePassword(Action):
 
         # Aggiorna la password con il backend
         try:
-            update_response = requests.patch(
+            update_response = await http_client.patch(
                 f"{endpoint}/update_password",
+                service="users",
                 json={"email": email, "password": new_password},
             )
             update_response.raise_for_status()
@@ -0,0 +1,192 @@
+import os
+import atexit
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+
+import numpy as np # type: ignore
+from langchain.embeddings.base import Embeddings # type: ignore
+
+# NB: questo modulo è importato anche da ingest.py (eseguito come script),
+# quindi non deve dipendere da altri moduli del package `actions`.
+
+# === CONFIGURAZIONI ===
+# Impostare EMBEDDINGS_CACHE_FILE="" per disattivare la persistenza
+CACHE_FILE = os.getenv(
+    "EMBEDDINGS_CACHE_FILE", os.path.join(os.path.dirname(__file__), "data/cache/embeddings.npz")
+) or None
+MAX_ENTRIES = int(os.getenv("EMBEDDINGS_CACHE_SIZE", "4096"))
+BATCH_WINDOW = float(os.getenv("EMBEDDINGS_BATCH_WINDOW", "0.005"))
+SAVE_EVERY = 64
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wrapper con cache LRU attorno a un modello di embedding LangChain.
+
+    - le chiavi sono il testo normalizzato (minuscolo, spazi compattati);
+    - le richieste concorrenti (da thread diversi) vengono raccolte per
+      `batch_window` secondi e calcolate con un solo forward del modello;
+    - con `persist_path` la cache viene salvata su disco e ricaricata al riavvio.
+
+    Il modello sentence-transformers usato è simmetrico (query e documenti
+    hanno lo stesso embedding), quindi le due API condividono la cache.
+    """
+
+    def __init__(self, base: Embeddings, model_name: str = "", max_entries: int = MAX_ENTRIES,
+                 persist_path: Optional[str] = None, batch_window: float = BATCH_WINDOW):
+        self.base = base
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.persist_path = persist_path
+        self.batch_window = batch_window
+
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._pending: Dict[str, Future] = {}
+        self._batch_leader = False
+        self._unsaved = 0
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+
+        if persist_path:
+            self._load()
+            atexit.register(self.save)
+
+    # ---------------------------------------------------------
+    # API Embeddings
+    # ---------------------------------------------------------
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_many([text])[0]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed_many(list(texts))
+
+    # ---------------------------------------------------------
+    # Cache e batching
+    # ---------------------------------------------------------
+    def _embed_many(self, texts: List[str]) -> List[List[float]]:
+        keys = [normalize_text(t) for t in texts]
+        results: Dict[str, List[float]] = {}
+        futures: Dict[str, Future] = {}
+        lead = False
+
+        with self._lock:
+            for key, text in zip(keys, texts):
+                if key in results or key in futures:
+                    continue
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    results[key] = self._cache[key]
+                    self.hits += 1
+                elif key in self._pending:
+                    # Già in calcolo per un'altra richiesta: aspettiamo lo stesso risultato
+                    futures[key] = self._pending[key]
+                    self.hits += 1
+                else:
+                    future = Future()
+                    future.text = text
+                    self._pending[key] = future
+                    futures[key] = future
+                    self.misses += 1
+
+            if futures and not self._batch_leader:
+                self._batch_leader = lead = True
+
+        if lead:
+            self._run_batches()
+
+        for key, future in futures.items():
+            results[key] = future.result()
+        return [results[key] for key in keys]
+
+    def _run_batches(self):
+        # Breve attesa per raccogliere le richieste che arrivano in parallelo
+        if self.batch_window:
+            time.sleep(self.batch_window)
+
+        while True:
+            with self._lock:
+                batch = {k: f for k, f in self._pending.items() if not f.running()}
+                for future in batch.values():
+                    future.set_running_or_notify_cancel()
+                if not batch:
+                    self._batch_leader = False
+                    return
+
+            keys = list(batch.keys())
+            try:
+                vectors = self.base.embed_documents([batch[k].text for k in keys])
+            except Exception as e:
+                with self._lock:
+                    for key in keys:
+                        self._pending.pop(key, None)
+                for future in batch.values():
+                    future.set_exception(e)
+                continue
+
+            with self._lock:
+                self.batches += 1
+                for key, vector in zip(keys, vectors):
+                    self._cache[key] = list(vector)
+                    self._cache.move_to_end(key)
+                    self._pending.pop(key, None)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+                self._unsaved += len(keys)
+                should_save = self.persist_path and self._unsaved >= SAVE_EVERY
+
+            for key, vector in zip(keys, vectors):
+                batch[key].set_result(list(vector))
+            if should_save:
+                self.save()
+
+    # ---------------------------------------------------------
+    # Persistenza
+    # ---------------------------------------------------------
+    def save(self) -> None:
+        if not self.persist_path:
+            return
+        with self._lock:
+            if not self._cache:
+                return
+            keys = list(self._cache.keys())
+            vectors = np.asarray([self._cache[k] for k in keys], dtype=np.float32)
+            self._unsaved = 0
+
+        os.makedirs(os.path.dirname(self.persist_path), exist_ok=True)
+        tmp_path = f"{self.persist_path}.tmp.npz"
+        np.savez(tmp_path, keys=np.asarray(keys, dtype=object), vectors=vectors,
+                 model_name=np.asarray(self.model_name))
+        os.replace(tmp_path, self.persist_path)
+
+    def _load(self) -> None:
+        try:
+            data = np.load(self.persist_path, allow_pickle=True)
+        except (OSError, ValueError):
+            return
+        # Vettori calcolati con un altro modello: non riutilizzabili
+        if str(data["model_name"]) != self.model_name:
+            return
+        for key, vector in zip(data["keys"], data["vectors"]):
+            self._cache[str(key)] = vector.tolist()
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "model": self.model_name,
+            "entries": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "batches": self.batches,
+        }
@@ -0,0 +1,167 @@
+import os
+import json
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np # type: ignore
+import yaml # type: ignore
+
+# NB: questo modulo è importato anche da ingest.py (eseguito come script),
+# quindi non deve dipendere da altri moduli del package `actions`.
+
+# === CONFIGURAZIONI ===
+DOCS_DIR = os.path.join(os.path.dirname(__file__), "data/docs")
+COLLECTIONS_FILE = os.path.join(os.path.dirname(__file__), "data/collections.yml")
+CENTROIDS_FILE = os.path.join(os.path.dirname(__file__), "data/router_centroids.json")
+# Scarto minimo di similarità tra la prima e la seconda collezione per sceglierne una sola
+ROUTER_MARGIN = float(os.getenv("ROUTER_MARGIN", "0.05"))
+# Sotto questa similarità nessuna collezione è considerata affidabile
+ROUTER_MIN_SCORE = float(os.getenv("ROUTER_MIN_SCORE", "0.2"))
+
+
+def load_collections_config(path: str = COLLECTIONS_FILE) -> dict:
+    try:
+        with open(path, encoding="utf-8") as f:
+            config = yaml.safe_load(f) or {}
+    except OSError:
+        config = {}
+    return {"files": config.get("files") or {}, "intents": config.get("intents") or {}}
+
+
+def collection_for_file(filename: str, config: Optional[dict] = None) -> str:
+    """Collezione di un PDF: quella configurata, altrimenti "<nome_file>_docs"."""
+    config = config or load_collections_config()
+    if filename in config["files"]:
+        return config["files"][filename]
+    return f"{os.path.splitext(filename)[0].lower().replace(' ', '_')}_docs"
+
+
+def discover_collections(docs_dir: str = DOCS_DIR, config: Optional[dict] = None) -> Dict[str, List[str]]:
+    """Raggruppa per collezione tutti i PDF presenti in `docs_dir`."""
+    config = config or load_collections_config()
+    collections: Dict[str, List[str]] = {name: [] for name in config["files"].values()}
+    try:
+        filenames = sorted(f for f in os.listdir(docs_dir) if f.lower().endswith(".pdf"))
+    except OSError:
+        filenames = []
+    for filename in filenames:
+        collections.setdefault(collection_for_file(filename, config), []).append(filename)
+    return collections
+
+
+def compute_centroid(embeddings) -> Optional[List[float]]:
+    """Media degli embedding normalizzati dei chunk, a sua volta normalizzata."""
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    if vectors.size == 0:
+        return None
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    centroid = vectors.mean(axis=0)
+    return (centroid / max(np.linalg.norm(centroid), 1e-12)).tolist()
+
+
+def save_centroid(collection: str, centroid: Optional[List[float]], path: str = CENTROIDS_FILE) -> None:
+    try:
+        with open(path, encoding="utf-8") as f:
+            centroids = json.load(f)
+    except (OSError, ValueError):
+        centroids = {}
+
+    if centroid is None:
+        centroids.pop(collection, None)
+    else:
+        centroids[collection] = centroid
+
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(centroids, f)
+    os.replace(f"{path}.tmp", path)
+
+
+class RouteDecision:
+    """Collezioni in cui cercare, similarità con ciascun centroide e se la scelta è netta."""
+
+    def __init__(self, collections: List[str], scores: Dict[str, float], confident: bool):
+        self.collections = collections
+        self.scores = scores
+        self.confident = confident
+
+
+class CollectionRouter:
+    """
+    Sceglie la collezione confrontando l'embedding della domanda con il centroide
+    di ogni collezione (calcolato da ingest.py). Se la migliore supera la seconda
+    di almeno `margin` si cerca solo lì, altrimenti in tutte le collezioni.
+    I centroidi vengono riletti quando ingest.py riscrive il file.
+    """
+
+    def __init__(self, path: str = CENTROIDS_FILE, margin: float = ROUTER_MARGIN, min_score: float = ROUTER_MIN_SCORE):
+        self.path = path
+        self.margin = margin
+        self.min_score = min_score
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._names: List[str] = []
+        self._matrix = None
+        self.routed = 0
+        self.fanned_out = 0
+
+    def _refresh(self) -> None:
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = 0.0
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                centroids = json.load(f)
+        except (OSError, ValueError):
+            centroids = {}
+        self._names = list(centroids)
+        self._matrix = np.asarray([centroids[n] for n in self._names], dtype=np.float32) if centroids else None
+        self._mtime = mtime
+
+    def collections(self) -> List[str]:
+        with self._lock:
+            self._refresh()
+            return list(self._names)
+
+    def route(self, query_embedding) -> RouteDecision:
+        with self._lock:
+            self._refresh()
+            names, matrix = self._names, self._matrix
+
+        if matrix is None:
+            return RouteDecision([], {}, False)
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / max(np.linalg.norm(query), 1e-12)
+        similarities = matrix @ query
+        order = np.argsort(-similarities)
+        scores = {names[i]: round(float(similarities[i]), 4) for i in order}
+
+        best = float(similarities[order[0]])
+        second = float(similarities[order[1]]) if len(order) > 1 else -1.0
+        confident = best >= self.min_score and best - second >= self.margin
+
+        with self._lock:
+            if confident:
+                self.routed += 1
+            else:
+                self.fanned_out += 1
+
+        if confident:
+            return RouteDecision([names[order[0]]], scores, True)
+        return RouteDecision([names[i] for i in order], scores, False)
+
+    def stats(self) -> dict:
+        total = self.routed + self.fanned_out
+        return {
+            "collections": len(self._names),
+            "routed": self.routed,
+            "fanned_out": self.fanned_out,
+            "routed_rate": round(self.routed / total, 3) if total else 0.0,
+            "margin": self.margin,
+        }
+
+
+router = CollectionRouter()
@@ -0,0 +1,103 @@
+import os
+import re
+from typing import Callable, List, Optional, Tuple
+
+from .context_store import MOODS
+
+# Domande sul contesto salvato che si risolvono senza LLM.
+# Ogni voce: (espressione della domanda, chiave del contesto, funzione di risposta).
+# Se la chiave non è nel contesto la domanda passa all'LLM.
+
+
+def _mood_answer(question: str, mood: str) -> str:
+    # "ricordi se ero triste?" -> conferma o correzione
+    for asked, variants in MOODS.items():
+        if any(re.search(rf"\b{re.escape(v)}\b", question) for v in variants):
+            if asked == mood:
+                return f"Sì, mi avevi detto di essere {mood}."
+            return f"No, mi avevi detto di essere {mood}."
+    return f"Oggi sei {mood}."
+
+
+def _document_name(filename: str) -> str:
+    return os.path.splitext(os.path.basename(filename))[0].replace("_", " ")
+
+
+def _documents_answer(question: str, documents) -> str:
+    if isinstance(documents, str):
+        documents = [documents]
+    names = [f'"{_document_name(d)}"' for d in documents]
+    if len(names) == 1:
+        return f"Mi hai chiesto informazioni sul documento {names[0]}."
+    return f"Mi hai chiesto informazioni sui documenti {', '.join(names[:-1])} e {names[-1]}."
+
+
+# Solo domande sulla data o sull'appuntamento dell'utente: un "quando" generico
+# ("quando uso la VPN?") non riguarda il contesto salvato
+_IMPEGNO = r"(il mio |la mia |l')(appuntamento|riunione|impegno|scadenza)"
+_DATE_QUESTION = (
+    rf"\b(quando (è|era|ho|avevo) {_IMPEGNO}"
+    rf"|(che|quale) (giorno|data) (è|era) {_IMPEGNO}"
+    r"|(che|quale) (giorno|data) (ti )?(ho|avevo) (detto|indicato|scritto)"
+    r"|(la mia|quella) data)\b"
+)
+
+RULES: List[Tuple[re.Pattern, str, Callable[[str, object], str]]] = [
+    (
+        re.compile(r"\b(umore|stato d'animo|come (mi sento|mi sentivo|sto|stavo|ero)|ero (triste|felice|stanc\w|arrabbiat\w|preoccupat\w)|mi sentivo)\b"),
+        "mood", _mood_answer,
+    ),
+    (
+        re.compile(r"\b(document\w*|pdf|file)\b"),
+        "documents", _documents_answer,
+    ),
+    (
+        re.compile(_DATE_QUESTION),
+        "data", lambda q, v: f"Mi avevi parlato di {v}.",
+    ),
+    (
+        re.compile(r"\b(cosa|che cosa) (devo|dovevo|dovrei) fare\b"),
+        "azione", lambda q, v: f"Dovevi {v}.",
+    ),
+    (
+        re.compile(r"\b(cosa|che cosa) ti (ho|avevo) (detto|scritto)\b|\bultimo messaggio\b"),
+        "_last_user_message", lambda q, v: f'L\'ultima cosa che mi hai detto è: "{v}".',
+    ),
+]
+
+
+class ContextResolver:
+    """
+    Risponde con frasi predefinite alle domande sulle chiavi del contesto
+    (umore, documenti, data, ...). Se nessuna regola riconosce la domanda, o
+    la chiave richiesta non è nel contesto, restituisce None e la risposta è
+    lasciata all'LLM.
+    """
+
+    def __init__(self, rules=RULES):
+        self.rules = rules
+        self.hits = 0
+        self.misses = 0
+
+    def resolve(self, question: str, context: dict) -> Optional[str]:
+        lowered = (question or "").lower()
+        for pattern, key, answer in self.rules:
+            if pattern.search(lowered):
+                value = context.get(key)
+                if not value:
+                    break
+                self.hits += 1
+                return answer(lowered, value)
+        self.misses += 1
+        return None
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+resolver = ContextResolver()
@@ -0,0 +1,119 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional
+
+# === CONFIGURAZIONI ===
+MAX_SENDERS = int(os.getenv("CONTEXT_STORE_SIZE", "5000"))
+
+# Stati d'animo riconosciuti dal primo passaggio a regole (forma base -> varianti),
+# cercati come parole intere. Niente parole ambigue ("male", "giù", "carica"):
+# nel dubbio decide l'estrazione con l'LLM
+MOODS = {
+    "felice": ["felice", "contento", "contenta", "allegro", "allegra", "sereno", "serena",
+               "carichissimo", "carichissima", "alla grande", "benissimo", "entusiasta"],
+    "triste": ["triste", "giù di morale", "depresso", "depressa", "deluso", "delusa", "abbattuto", "abbattuta"],
+    "stanco": ["stanco", "stanca", "stanchissimo", "stanchissima", "esausto", "esausta", "distrutto", "distrutta"],
+    "arrabbiato": ["arrabbiato", "arrabbiata", "nervoso", "nervosa", "irritato", "irritata", "furioso", "furiosa"],
+    "preoccupato": ["preoccupato", "preoccupata", "ansioso", "ansiosa", "stressato", "stressata", "agitato", "agitata"],
+}
+# Intent NLU che indicano già lo stato d'animo
+MOOD_INTENTS = {"mood_great": "felice", "mood_unhappy": "triste"}
+# Parole chiave (parole intere) -> documento a cui si riferisce la domanda
+DOCUMENT_KEYWORDS = {
+    "informazioni_aziendali.pdf": ["ferie", "permesso", "permessi", "orario di lavoro", "orari di lavoro",
+                                   "stipendio", "stipendi", "busta paga", "malattia", "smart working"],
+    "linee_guida.pdf": ["tirocinio", "bibliografia", "linee guida"],
+}
+DATE_WORDS = ["oggi", "domani", "dopodomani", "ieri", "lunedì", "martedì", "mercoledì", "giovedì", "venerdì",
+              "sabato", "domenica", "settimana prossima"]
+
+_MOOD_RE = {
+    mood: re.compile(r"\b(" + "|".join(re.escape(v) for v in variants) + r")\b", re.IGNORECASE)
+    for mood, variants in MOODS.items()
+}
+_DOCUMENT_RE = {
+    doc: re.compile(r"\b(" + "|".join(re.escape(k) for k in keywords) + r")\b", re.IGNORECASE)
+    for doc, keywords in DOCUMENT_KEYWORDS.items()
+}
+_DATE_RE = re.compile(r"\b(" + "|".join(re.escape(w) for w in DATE_WORDS) + r"|\d{1,2}/\d{1,2}(?:/\d{2,4})?)\b",
+                      re.IGNORECASE)
+
+
+def extract_rules(text: str, intent: Optional[str] = None) -> dict:
+    """
+    Primo passaggio sincrono, senza LLM: umore, documenti e data riconosciuti
+    con parole chiave ed espressioni regolari.
+    """
+    extracted = {}
+    lowered = text.lower()
+
+    for mood, pattern in _MOOD_RE.items():
+        if pattern.search(lowered):
+            extracted["mood"] = mood
+            break
+    else:
+        if intent in MOOD_INTENTS:
+            extracted["mood"] = MOOD_INTENTS[intent]
+
+    documents = [doc for doc, pattern in _DOCUMENT_RE.items() if pattern.search(lowered)]
+    if documents:
+        extracted["documents"] = documents
+
+    date = _DATE_RE.search(lowered)
+    if date:
+        extracted["data"] = date.group(1)
+    return extracted
+
+
+def merge_context(prev: dict, extracted: dict) -> dict:
+    """Le liste vengono unite senza duplicati, gli altri valori sovrascritti."""
+    merged = dict(prev)
+    for k, v in extracted.items():
+        if k in merged and isinstance(merged[k], list) and isinstance(v, list):
+            merged[k] = list(dict.fromkeys(merged[k] + v))
+        else:
+            merged[k] = v
+    return merged
+
+
+class ContextStore:
+    """
+    Contesto automatico di ogni utente (sender_id di Rasa) tenuto nell'action server.
+    Permette di aggiornare il contesto anche dopo la fine del turno, quando
+    l'estrazione con l'LLM termina in background.
+    """
+
+    def __init__(self, max_senders: int = MAX_SENDERS):
+        self.max_senders = max_senders
+        self._lock = threading.Lock()
+        self._contexts: "OrderedDict[str, dict]" = OrderedDict()
+
+    def get(self, sender_id: str) -> dict:
+        with self._lock:
+            return dict(self._contexts.get(sender_id, {}))
+
+    def merge(self, sender_id: str, extracted: dict, message: Optional[str] = None) -> dict:
+        """
+        Con `message` (estrazione in background) i valori singoli vengono applicati
+        solo se nel frattempo l'utente non ha scritto un messaggio più recente.
+        """
+        with self._lock:
+            prev = self._contexts.get(sender_id, {})
+            if message is not None and prev.get("_last_user_message") != message:
+                extracted = {k: v for k, v in extracted.items() if isinstance(v, list)}
+            merged = merge_context(prev, extracted)
+            merged["_timestamp"] = datetime.utcnow().isoformat() + "Z"
+            self._contexts[sender_id] = merged
+            self._contexts.move_to_end(sender_id)
+            while len(self._contexts) > self.max_senders:
+                self._contexts.popitem(last=False)
+            return dict(merged)
+
+    def stats(self) -> Dict[str, int]:
+        return {"senders": len(self._contexts), "max_senders": self.max_senders}
+
+
+context_store = ContextStore()
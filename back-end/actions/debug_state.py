@@ -0,0 +1,60 @@
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict
+
+import requests
+from dotenv import load_dotenv # type: ignore
+
+load_dotenv()
+
+# === CONFIGURAZIONI ===
+# Endpoint di server.py che riceve gli snapshot (es. http://localhost:8000/debug)
+DEBUG_API_URL = os.getenv("DEBUG_API_URL")
+FLUSH_INTERVAL = float(os.getenv("DEBUG_FLUSH_INTERVAL", "5"))
+
+_lock = threading.Lock()
+_snapshots: Dict[str, Dict[str, Any]] = {}
+_dirty = set()
+_flusher = None
+
+
+def publish(name: str, payload: Dict[str, Any]) -> None:
+    """
+    Registra lo stato corrente di un componente (resolver, cache, code...).
+    L'invio a server.py avviene in background, al massimo ogni FLUSH_INTERVAL secondi.
+    """
+    global _flusher
+
+    with _lock:
+        _snapshots[name] = dict(payload, updated_at=datetime.utcnow().isoformat() + "Z")
+        _dirty.add(name)
+
+        if DEBUG_API_URL and _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name="debug-state-flusher", daemon=True)
+            _flusher.start()
+
+
+def snapshot(name: str = None):
+    """Restituisce l'ultimo stato registrato (di un componente o di tutti)."""
+    with _lock:
+        if name is not None:
+            return dict(_snapshots.get(name, {}))
+        return {k: dict(v) for k, v in _snapshots.items()}
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+
+        with _lock:
+            pending = {name: dict(_snapshots[name]) for name in _dirty}
+            _dirty.clear()
+
+        for name, payload in pending.items():
+            try:
+                requests.post(f"{DEBUG_API_URL}/{name}", json=payload, timeout=5)
+            except Exception:
+                # Il debug non deve mai interferire con le azioni
+                pass
@@ -0,0 +1,125 @@
+import os
+import json
+import hashlib
+import threading
+from typing import Dict, List, Optional
+
+from PyPDF2 import PdfReader # type: ignore
+
+# NB: questo modulo è importato anche da ingest.py (eseguito come script),
+# quindi non deve dipendere da altri moduli del package `actions`.
+
+# === CONFIGURAZIONI ===
+DOCS_DIR = os.path.join(os.path.dirname(__file__), "data/docs")
+REGISTRY_FILE = os.path.join(os.path.dirname(__file__), "data/documents.json")
+
+# Link pubblici di download dei PDF
+DOWNLOAD_URLS = {
+    "informazioni_aziendali.pdf": "https://drive.google.com/uc?export=download&id=18lvJQk7YCCr7trgco_0o1T_3RR40pgmZ",
+    "linee_guida.pdf": "https://drive.google.com/uc?export=download&id=1UAysV_OIQB0oXODTEFmp03zNOW5HpCcs",
+}
+
+
+def file_hash(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def describe_pdf(path: str, sha256: Optional[str] = None) -> dict:
+    """Metadati di un PDF: dimensione, numero di pagine, hash e link di download."""
+    filename = os.path.basename(path)
+    try:
+        pages = len(PdfReader(path).pages)
+    except Exception:
+        pages = None
+    return {
+        "filename": filename,
+        "size_bytes": os.path.getsize(path),
+        "pages": pages,
+        "sha256": sha256 or file_hash(path),
+        "download_url": DOWNLOAD_URLS.get(filename),
+        "mtime": os.path.getmtime(path),
+    }
+
+
+def build_registry(filenames: List[str], hashes: Dict[str, str], previous: Optional[Dict[str, dict]] = None,
+                   docs_dir: str = DOCS_DIR) -> Dict[str, dict]:
+    """
+    Registro dei PDF indicizzati. I file con lo stesso hash del registro
+    precedente non vengono riaperti: si aggiorna solo mtime e link.
+    """
+    previous = previous or {}
+    registry = {}
+    for filename in filenames:
+        path = os.path.join(docs_dir, filename)
+        old = previous.get(filename)
+        if old and old.get("sha256") == hashes.get(filename):
+            registry[filename] = {**old, "mtime": os.path.getmtime(path), "download_url": DOWNLOAD_URLS.get(filename)}
+        else:
+            registry[filename] = describe_pdf(path, hashes.get(filename))
+    return registry
+
+
+def load_registry(path: str = REGISTRY_FILE) -> Dict[str, dict]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_registry(registry: Dict[str, dict], path: str = REGISTRY_FILE) -> None:
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(registry, f, ensure_ascii=False, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+class DocumentRegistry:
+    """
+    Lettura del registro con cache in memoria. Il file JSON viene riletto solo
+    quando ingest.py lo riscrive; una voce viene ricalcolata solo se il PDF
+    sul disco ha un mtime diverso da quello registrato (o manca dal registro).
+    """
+
+    def __init__(self, path: str = REGISTRY_FILE, docs_dir: str = DOCS_DIR):
+        self.path = path
+        self.docs_dir = docs_dir
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._entries: Dict[str, dict] = {}
+
+    def _refresh(self) -> None:
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = 0.0
+        if mtime != self._mtime:
+            self._entries = load_registry(self.path)
+            self._mtime = mtime
+
+    def get(self, filename: str) -> Optional[dict]:
+        path = os.path.join(self.docs_dir, filename)
+        try:
+            file_mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+
+        with self._lock:
+            self._refresh()
+            entry = self._entries.get(filename)
+            if entry is None or entry.get("mtime") != file_mtime:
+                # PDF non ancora indicizzato o modificato dopo l'ultima ingestione
+                entry = describe_pdf(path)
+                self._entries[filename] = entry
+            return entry
+
+    def all(self) -> List[dict]:
+        with self._lock:
+            self._refresh()
+            return list(self._entries.values())
+
+
+registry = DocumentRegistry()
@@ -0,0 +1,109 @@
+import os
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx # type: ignore
+from dotenv import load_dotenv # type: ignore
+
+load_dotenv()
+
+# === CONFIGURAZIONI ===
+MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+MAX_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", "0.3"))
+
+# Timeout (secondi) per servizio chiamato, sovrascrivibili con HTTP_TIMEOUT_<NOME>
+TIMEOUTS = {
+    "default": 10.0,
+    "booking": 100.0,
+    "reservations": 30.0,
+    "availability": 10.0,
+    "users": 10.0,
+    "documents": 10.0,
+    "ollama": 200.0,
+    "stream": 5.0,
+}
+for _name in TIMEOUTS:
+    _env = os.getenv(f"HTTP_TIMEOUT_{_name.upper()}")
+    if _env:
+        TIMEOUTS[_name] = float(_env)
+
+# Metodi che possono essere ripetuti anche se il server ha già ricevuto la richiesta
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "DELETE"}
+RETRY_STATUS = {502, 503, 504}
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Client HTTP asincrono condiviso da tutte le azioni.
+    Mantiene le connessioni aperte (keep-alive) e limita quelle contemporanee.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE),
+            timeout=TIMEOUTS["default"],
+        )
+    return _client
+
+
+def _timeout(service: str) -> httpx.Timeout:
+    seconds = TIMEOUTS.get(service, TIMEOUTS["default"])
+    # La connessione deve fallire in fretta anche quando la lettura può durare a lungo
+    return httpx.Timeout(seconds, connect=min(seconds, 5.0))
+
+
+def _can_retry(method: str, error: Exception) -> bool:
+    # Se la connessione non è mai partita la richiesta è sicuramente ripetibile
+    if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+        return True
+    return method in IDEMPOTENT_METHODS and isinstance(error, httpx.TransportError)
+
+
+async def request(method: str, url: str, service: str = "default",
+                  retries: int = MAX_RETRIES, **kwargs) -> httpx.Response:
+    """
+    Esegue una richiesta con il timeout del servizio e un numero limitato di tentativi.
+    Le POST/PATCH vengono ripetute solo se la connessione non è stata stabilita.
+    """
+    method = method.upper()
+    kwargs.setdefault("timeout", _timeout(service))
+
+    for attempt in range(retries + 1):
+        try:
+            response = await get_client().request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            if attempt >= retries or not _can_retry(method, e):
+                raise
+        else:
+            if response.status_code not in RETRY_STATUS or method not in IDEMPOTENT_METHODS or attempt >= retries:
+                return response
+        await asyncio.sleep(RETRY_BACKOFF * (2 ** attempt))
+
+
+async def get(url: str, service: str = "default", **kwargs) -> httpx.Response:
+    return await request("GET", url, service=service, **kwargs)
+
+
+async def post(url: str, service: str = "default", **kwargs) -> httpx.Response:
+    return await request("POST", url, service=service, **kwargs)
+
+
+async def patch(url: str, service: str = "default", **kwargs) -> httpx.Response:
+    return await request("PATCH", url, service=service, **kwargs)
+
+
+async def delete(url: str, service: str = "default", **kwargs) -> httpx.Response:
+    return await request("DELETE", url, service=service, **kwargs)
+
+
+@asynccontextmanager
+async def stream(method: str, url: str, service: str = "default", **kwargs):
+    """Richiesta in streaming (es. token di Ollama); nessun retry, la risposta è già iniziata."""
+    kwargs.setdefault("timeout", _timeout(service))
+    async with get_client().stream(method.upper(), url, **kwargs) as response:
+        yield response
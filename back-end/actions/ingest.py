@@ -1,56 +1,227 @@
-
 import os
-from langchain.document_loaders import DirectoryLoader, PyPDFLoader, TextLoader
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from langchain.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.embeddings import HuggingFaceEmbeddings
 from langchain.vectorstores import Chroma
 
-# === CONFIGURAZIONI ===
-DOCS_DIR = "data/docs"
-CHROMA_DIR = "data/chroma_db"
+from cached_embeddings import CachedEmbeddings, CACHE_FILE as EMBEDDINGS_CACHE_FILE
+from lexical_index import LexicalIndex
+from semantic_cache import invalidate_collection
+from document_registry import file_hash, build_registry, load_registry, save_registry
+from collection_router import discover_collections, compute_centroid, save_centroid, router
 
-# Collezioni separate
-COLLECTIONS = {
-    "informazioni_aziendali.pdf": "azienda_docs",
-    "linee_guida.pdf": "relazione_docs",
-}
+# === CONFIGURAZIONI ===
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DOCS_DIR = os.path.join(BASE_DIR, "data/docs")
+CHROMA_DIR = os.path.join(BASE_DIR, "data/chroma_db")
+MANIFEST_FILE = os.path.join(BASE_DIR, "data/ingest_manifest.json")
 
-def ingest_single_pdf(pdf_path, collection_name, embeddings):
-    print("\n Indicizzazione di: {pdf_path} → collezione '{collection_name}'")
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 150
 
-    # Carica documento
-    loader = PyPDFLoader(pdf_path)
-    docs = loader.load()
+# Le collezioni sono configurate in data/collections.yml
 
-    # Split in chunk
-    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150)
+def parse_pdf(pdf_path):
+    """
+    Carica e divide in chunk un PDF. Gira in un processo separato, quindi
+    restituisce solo dati serializzabili: (id, testo, metadati) per ogni chunk.
+    L'id dipende dal contenuto, così un chunk invariato mantiene lo stesso id.
+    """
+    docs = PyPDFLoader(pdf_path).load()
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
     chunks = splitter.split_documents(docs)
 
-    # Crea / aggiorna il database Chroma
-    vectordb = Chroma.from_documents(
-        documents=chunks,
-        embedding=embeddings,
-        persist_directory=CHROMA_DIR,
-        collection_name=collection_name
-    )
-    vectordb.persist()
-    print(f"Salvato {len(chunks)} chunk nella collezione '{collection_name}'")
+    filename = os.path.basename(pdf_path)
+    seen = {}
+    result = []
+    for chunk in chunks:
+        digest = hashlib.sha256(chunk.page_content.encode("utf-8")).hexdigest()[:32]
+        # Chunk identici nello stesso file ricevono un suffisso progressivo
+        seen[digest] = seen.get(digest, -1) + 1
+        chunk_id = f"{filename}:{digest}:{seen[digest]}"
+        result.append((chunk_id, chunk.page_content, dict(chunk.metadata)))
+    return result
 
-def main():
-    # Carica modello embeddings
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+def load_manifest():
+    try:
+        with open(MANIFEST_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-    # Cicla su ogni documento definito
-    for filename, collection_name in COLLECTIONS.items():
-        pdf_path = os.path.join(DOCS_DIR, filename)
-        if not os.path.exists(pdf_path):
-            print(f"File mancante: {pdf_path}")
+def save_manifest(manifest):
+    with open(f"{MANIFEST_FILE}.tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(f"{MANIFEST_FILE}.tmp", MANIFEST_FILE)
+
+def plan_collection(collection_name, filenames, hashes, manifest, parsed, vectordb):
+    """
+    Confronta i file attuali con il manifest e calcola cosa aggiungere e cosa eliminare.
+    `parsed` contiene i chunk dei soli file nuovi o modificati.
+    """
+    previous = manifest.get(collection_name, {}).get("files", {})
+    files = {}
+    to_add, to_delete = [], []
+    report = {"unchanged": [], "changed": [], "removed": []}
+
+    for filename in filenames:
+        digest = hashes[filename]
+        old = previous.get(filename)
+
+        if old and old["sha256"] == digest:
+            files[filename] = old
+            report["unchanged"].append(filename)
             continue
-        ingest_single_pdf(pdf_path, collection_name, embeddings)
 
+        chunks = parsed[filename]
+        new_ids = [cid for cid, _, _ in chunks]
+        old_ids = set(old["chunks"]) if old else set()
+        to_add.extend(c for c in chunks if c[0] not in old_ids)
+        to_delete.extend(old_ids - set(new_ids))
+        files[filename] = {"sha256": digest, "chunks": new_ids}
+        report["changed"].append(filename)
+
+    for filename, old in previous.items():
+        if filename not in files:
+            to_delete.extend(old["chunks"])
+            report["removed"].append(filename)
+
+    # Prima esecuzione con il manifest: eliminiamo i chunk con id casuali (e i duplicati)
+    # lasciati dalle indicizzazioni complete precedenti
+    if collection_name not in manifest and vectordb is not None:
+        known = {cid for f in files.values() for cid in f["chunks"]}
+        existing = vectordb._collection.get(include=[])["ids"]
+        to_delete.extend(cid for cid in existing if cid not in known)
+        # Chunk già presenti con lo stesso id non vanno riaggiunti
+        existing_ids = set(existing)
+        to_add = [c for c in to_add if c[0] not in existing_ids]
+
+    return files, to_add, sorted(set(to_delete)), report
+
+def print_plan(report, to_add, to_delete):
+    print(f"   invariati: {len(report['unchanged'])}, modificati/nuovi: {len(report['changed'])}, rimossi: {len(report['removed'])}")
+    print(f"   chunk da aggiungere: {len(to_add)}, chunk da eliminare: {len(to_delete)}")
+
+def ingest_collection(collection_name, filenames, hashes, manifest, parsed, embeddings, batch_size, dry_run):
+    print(f"\n Collezione '{collection_name}': {', '.join(filenames) or 'nessun file'}")
+
+    if dry_run:
+        # Nessun accesso a Chroma (crea collezioni e cartelle): piano calcolato solo dal manifest
+        files, to_add, to_delete, report = plan_collection(collection_name, filenames, hashes, manifest, parsed, None)
+        print_plan(report, to_add, to_delete)
+        if collection_name not in manifest:
+            print("   (prima indicizzazione con il manifest: i chunk già presenti in Chroma non sono conteggiati)")
+        return False
+
+    vectordb = None
+    if os.path.exists(CHROMA_DIR):
+        vectordb = Chroma(persist_directory=CHROMA_DIR, collection_name=collection_name, embedding_function=embeddings)
+
+    files, to_add, to_delete, report = plan_collection(collection_name, filenames, hashes, manifest, parsed, vectordb)
+    print_plan(report, to_add, to_delete)
+
+    if to_add or to_delete:
+        update_vectordb(collection_name, vectordb, embeddings, to_add, to_delete, batch_size)
+    elif vectordb is not None and collection_name not in router.collections():
+        # Collezione invariata ma senza centroide (es. indicizzata prima del router)
+        content = vectordb._collection.get(include=["embeddings"])
+        save_centroid(collection_name, compute_centroid(content["embeddings"]))
+
+    manifest_changed = manifest.get(collection_name, {}).get("files") != files
+    manifest[collection_name] = {"files": files}
+    return manifest_changed or bool(to_add or to_delete)
+
+def update_vectordb(collection_name, vectordb, embeddings, to_add, to_delete, batch_size):
+    if vectordb is None:
+        vectordb = Chroma(persist_directory=CHROMA_DIR, collection_name=collection_name, embedding_function=embeddings)
+
+    if to_delete:
+        vectordb._collection.delete(ids=to_delete)
+
+    # Embedding a blocchi: memoria limitata e avanzamento visibile
+    for start in range(0, len(to_add), batch_size):
+        batch = to_add[start:start + batch_size]
+        vectordb.add_texts(
+            texts=[text for _, text, _ in batch],
+            metadatas=[meta for _, _, meta in batch],
+            ids=[cid for cid, _, _ in batch],
+        )
+        print(f"   embedding {min(start + batch_size, len(to_add))}/{len(to_add)}")
+    vectordb.persist()
+
+    # Indice lessicale BM25 e centroide del router ricostruiti su tutti i chunk presenti
+    content = vectordb._collection.get(include=["documents", "embeddings"])
+    LexicalIndex.build(collection_name, content["ids"], content["documents"]).save()
+    save_centroid(collection_name, compute_centroid(content["embeddings"]))
+
+    # Le risposte in cache si riferiscono alla versione precedente della collezione
+    invalidate_collection(collection_name)
+    print(f"Collezione '{collection_name}' aggiornata ({len(content['ids'])} chunk totali)")
+
+def main(dry_run=False, workers=None, batch_size=64):
+    manifest = load_manifest()
+
+    # Raggruppa per collezione tutti i PDF presenti in data/docs
+    collections = discover_collections(DOCS_DIR)
+    # Collezioni indicizzate in passato i cui file sono stati tutti rimossi
+    for collection_name in manifest:
+        collections.setdefault(collection_name, [])
+
+    # Solo i PDF nuovi o modificati vengono riletti, in parallelo
+    hashes, to_parse = {}, []
+    for collection_name, filenames in collections.items():
+        previous = manifest.get(collection_name, {}).get("files", {})
+        for filename in filenames:
+            hashes[filename] = file_hash(os.path.join(DOCS_DIR, filename))
+            old = previous.get(filename)
+            if not old or old["sha256"] != hashes[filename]:
+                to_parse.append(filename)
+
+    parsed = {}
+    if to_parse:
+        print(f"Parsing di {len(to_parse)} PDF...")
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            paths = [os.path.join(DOCS_DIR, f) for f in to_parse]
+            for filename, chunks in zip(to_parse, pool.map(parse_pdf, paths)):
+                parsed[filename] = chunks
+
+    # Carica modello embeddings (i chunk invariati riusano i vettori in cache); non serve nel dry run
+    embeddings = None if dry_run else CachedEmbeddings(
+        HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL),
+        model_name=EMBEDDING_MODEL,
+        persist_path=EMBEDDINGS_CACHE_FILE,
+    )
+
+    changed = False
+    for collection_name, filenames in collections.items():
+        changed |= ingest_collection(collection_name, filenames, hashes, manifest, parsed, embeddings, batch_size, dry_run)
+
+    if dry_run:
+        print("\nDry run: nessuna modifica applicata.")
+        return
+
+    if changed:
+        save_manifest(manifest)
+    embeddings.save()
+
+    # Registro dei metadati (dimensione, pagine, hash, link) letto dalle azioni
+    filenames = [f for names in collections.values() for f in names]
+    save_registry(build_registry(filenames, hashes, load_registry()))
     print("\nIndicizzazione completata!")
 
 if __name__ == "__main__":
-    os.makedirs(DOCS_DIR, exist_ok=True)
-    os.makedirs(CHROMA_DIR, exist_ok=True)
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Indicizzazione incrementale dei documenti in Chroma")
+    parser.add_argument("--dry-run", action="store_true", help="mostra cosa cambierebbe senza modificare nulla")
+    parser.add_argument("--workers", type=int, default=None, help="processi per il parsing dei PDF")
+    parser.add_argument("--batch-size", type=int, default=64, help="chunk per ogni blocco di embedding")
+    args = parser.parse_args()
+
+    if not args.dry_run:
+        os.makedirs(DOCS_DIR, exist_ok=True)
+        os.makedirs(CHROMA_DIR, exist_ok=True)
+    main(dry_run=args.dry_run, workers=args.workers, batch_size=args.batch_size)
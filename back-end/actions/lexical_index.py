@@ -0,0 +1,154 @@
+import os
+import re
+import json
+import math
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import yaml # type: ignore
+
+# NB: questo modulo è importato anche da ingest.py (eseguito come script),
+# quindi non deve dipendere da altri moduli del package `actions`.
+
+# === CONFIGURAZIONI ===
+INDEX_DIR = os.path.join(os.path.dirname(__file__), "data/bm25")
+SYNONYMS_FILE = os.path.join(os.path.dirname(__file__), "data/synonyms.yml")
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+STOPWORDS = {
+    "a", "ad", "al", "alla", "alle", "allo", "ai", "agli", "che", "chi", "ci", "come", "con", "cosa",
+    "da", "dal", "dalla", "dalle", "dei", "del", "della", "delle", "dello", "di", "e", "ed", "gli",
+    "ha", "hanno", "ho", "i", "il", "in", "la", "le", "lo", "ma", "mi", "mia", "mie", "mio", "miei",
+    "ne", "nel", "nella", "nelle", "non", "o", "per", "quale", "quali", "quando", "se", "si", "sono",
+    "su", "sul", "sulla", "ti", "tra", "tu", "tua", "tuo", "un", "una", "uno",
+}
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def load_synonyms(path: str = SYNONYMS_FILE) -> Dict[str, str]:
+    """Mappa ogni sinonimo (anche di più parole) al termine principale del suo gruppo."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            groups = yaml.safe_load(f) or {}
+    except OSError:
+        return {}
+
+    mapping = {}
+    for canonical, variants in groups.items():
+        for variant in variants or []:
+            mapping[" ".join(_TOKEN_RE.findall(str(variant).lower()))] = str(canonical).lower()
+    return mapping
+
+
+def tokenize(text: str, synonyms: Dict[str, str]) -> List[str]:
+    """Minuscolo, rimozione stopword e riduzione dei sinonimi al termine principale."""
+    words = _TOKEN_RE.findall(text.lower())
+    phrases = sorted(synonyms, key=lambda p: -len(p.split()))
+    tokens = []
+    i = 0
+    while i < len(words):
+        for phrase in phrases:
+            size = len(phrase.split())
+            if " ".join(words[i:i + size]) == phrase:
+                tokens.append(synonyms[phrase])
+                i += size
+                break
+        else:
+            if words[i] not in STOPWORDS:
+                tokens.append(words[i])
+            i += 1
+    return tokens
+
+
+class LexicalIndex:
+    """
+    Indice invertito BM25 sui chunk di una collezione, con gli stessi id usati in Chroma.
+    Viene costruito da ingest.py e salvato in JSON accanto a chroma_db.
+    """
+
+    def __init__(self, collection: str, ids: List[str], postings: Dict[str, List[Tuple[int, int]]],
+                 doc_lengths: List[int], synonyms: Dict[str, str]):
+        self.collection = collection
+        self.ids = ids
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.synonyms = synonyms
+        self.avg_length = (sum(doc_lengths) / len(doc_lengths)) if doc_lengths else 0.0
+
+    @classmethod
+    def build(cls, collection: str, ids: List[str], texts: List[str],
+              synonyms: Optional[Dict[str, str]] = None) -> "LexicalIndex":
+        synonyms = load_synonyms() if synonyms is None else synonyms
+        postings = defaultdict(list)
+        doc_lengths = []
+        for doc_idx, text in enumerate(texts):
+            tokens = tokenize(text, synonyms)
+            doc_lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                postings[term].append((doc_idx, tf))
+        return cls(collection, list(ids), dict(postings), doc_lengths, synonyms)
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """Restituisce fino a `k` coppie (id del chunk, punteggio BM25) in ordine decrescente."""
+        n_docs = len(self.ids)
+        if not n_docs:
+            return []
+
+        scores = defaultdict(float)
+        for term in set(tokenize(query, self.synonyms)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_idx, tf in postings:
+                norm = 1 - BM25_B + BM25_B * self.doc_lengths[doc_idx] / (self.avg_length or 1)
+                scores[doc_idx] += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+
+        best = sorted(scores.items(), key=lambda item: -item[1])[:k]
+        return [(self.ids[doc_idx], score) for doc_idx, score in best]
+
+    # ---------------------------------------------------------
+    # Persistenza
+    # ---------------------------------------------------------
+    def save(self, index_dir: str = INDEX_DIR) -> None:
+        os.makedirs(index_dir, exist_ok=True)
+        path = os.path.join(index_dir, f"{self.collection}.json")
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({
+                "collection": self.collection,
+                "ids": self.ids,
+                "postings": self.postings,
+                "doc_lengths": self.doc_lengths,
+                "synonyms": self.synonyms,
+            }, f, ensure_ascii=False)
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, collection: str, index_dir: str = INDEX_DIR) -> Optional["LexicalIndex"]:
+        path = os.path.join(index_dir, f"{collection}.json")
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        postings = {term: [tuple(p) for p in plist] for term, plist in data["postings"].items()}
+        return cls(collection, data["ids"], postings, data["doc_lengths"], data.get("synonyms", {}))
+
+
+_indexes: Dict[str, Tuple[float, Optional[LexicalIndex]]] = {}
+
+
+def get_lexical_index(collection: str, index_dir: str = INDEX_DIR) -> Optional[LexicalIndex]:
+    """Indice della collezione, ricaricato solo quando ingest.py lo riscrive."""
+    path = os.path.join(index_dir, f"{collection}.json")
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    cached = _indexes.get(collection)
+    if cached is None or cached[0] != mtime:
+        _indexes[collection] = (mtime, LexicalIndex.load(collection, index_dir))
+    return _indexes[collection][1]
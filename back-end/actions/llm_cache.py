@@ -0,0 +1,203 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+from typing import Optional
+
+# NB: questo modulo si può eseguire come script (CLI di ispezione e pulizia),
+# quindi non deve dipendere da altri moduli del package `actions`.
+
+# === CONFIGURAZIONI ===
+# Impostare LLM_CACHE_FILE="" per disattivare la cache
+CACHE_FILE = os.getenv(
+    "LLM_CACHE_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data/cache/llm_cache.sqlite3")
+) or None
+MAX_BYTES = int(float(os.getenv("LLM_CACHE_MAX_MB", "50")) * 1024 * 1024)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    options TEXT NOT NULL,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_responses_model ON responses (model);
+CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used);
+"""
+
+
+def make_key(model: str, prompt: str, options: dict) -> tuple:
+    """(chiave, hash del prompt, opzioni serializzate) per una chiamata al modello."""
+    options_json = json.dumps(options, sort_keys=True)
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    key = hashlib.sha256(f"{model}\0{prompt_hash}\0{options_json}".encode("utf-8")).hexdigest()
+    return key, prompt_hash, options_json
+
+
+class LLMCache:
+    """
+    Cache persistente (SQLite) delle risposte del modello, valida perché tutte le
+    chiamate usano temperature 0. La chiave comprende il modello, quindi ogni
+    modello ha il proprio spazio e cambiarlo non restituisce risposte vecchie.
+    Oltre `max_bytes` vengono eliminate le risposte usate meno di recente.
+    """
+
+    def __init__(self, path: str, max_bytes: int = MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, model: str, prompt: str, options: dict) -> Optional[str]:
+        key, _, _ = make_key(model, prompt, options)
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+            return row[0]
+
+    def put(self, model: str, prompt: str, options: dict, response: str) -> None:
+        if not response:
+            return
+        key, prompt_hash, options_json = make_key(model, prompt, options)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, prompt_hash, options, response, size, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, model, prompt_hash, options_json, response, len(response.encode("utf-8")), now, now),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Elimina dalla meno usata fino a rientrare nel limite
+        excess = total - self.max_bytes
+        freed = 0
+        to_delete = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_used"):
+            to_delete.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", to_delete)
+
+    def purge(self, model: Optional[str] = None, older_than: Optional[float] = None) -> int:
+        """Elimina le risposte (di un modello e/o non usate da `older_than` secondi); restituisce quante."""
+        query, params = "DELETE FROM responses WHERE 1 = 1", []
+        if model:
+            query += " AND model = ?"
+            params.append(model)
+        if older_than is not None:
+            query += " AND last_used < ?"
+            params.append(time.time() - older_than)
+        with self._lock:
+            deleted = self._conn.execute(query, params).rowcount
+            self._conn.commit()
+            self._conn.execute("VACUUM")
+        return deleted
+
+    def models(self) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT model, COUNT(*), SUM(size), SUM(hits), MAX(last_used) FROM responses GROUP BY model ORDER BY model"
+            ).fetchall()
+        return [
+            {"model": m, "entries": n, "bytes": size, "hits": hits, "last_used": last} for m, n, size, hits, last in rows
+        ]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "models": self.models(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "max_bytes": self.max_bytes,
+        }
+
+
+_cache = None
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    """Cache condivisa nel processo, None se disattivata con LLM_CACHE_FILE=""."""
+    global _cache
+    if _cache is None and CACHE_FILE:
+        _cache = LLMCache(CACHE_FILE)
+    return _cache
+
+
+# ---------------------------------------------------------
+# CLI: python actions/llm_cache.py stats | list | purge
+# ---------------------------------------------------------
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Ispezione e pulizia della cache delle risposte LLM")
+    parser.add_argument("--file", default=CACHE_FILE, help="database SQLite della cache")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("stats", help="voci, dimensione e hit per modello")
+
+    list_cmd = commands.add_parser("list", help="ultime risposte salvate")
+    list_cmd.add_argument("--model", help="solo le risposte di questo modello")
+    list_cmd.add_argument("--limit", type=int, default=20)
+
+    purge_cmd = commands.add_parser("purge", help="elimina le risposte in cache")
+    purge_cmd.add_argument("--model", help="solo le risposte di questo modello")
+    purge_cmd.add_argument("--older-than-days", type=float, help="solo quelle non usate da N giorni")
+
+    args = parser.parse_args(argv)
+    if not args.file:
+        print("Cache disattivata (LLM_CACHE_FILE vuoto)")
+        return 1
+    cache = LLMCache(args.file)
+
+    if args.command == "stats":
+        for row in cache.models():
+            print(f"{row['model']}: {row['entries']} risposte, {row['bytes'] / 1024:.1f} KB, {row['hits']} hit")
+        print(f"Limite: {cache.max_bytes / (1024 * 1024):.1f} MB")
+
+    elif args.command == "list":
+        query, params = "SELECT model, prompt_hash, hits, last_used, response FROM responses", []
+        if args.model:
+            query += " WHERE model = ?"
+            params.append(args.model)
+        query += " ORDER BY last_used DESC LIMIT ?"
+        params.append(args.limit)
+        for model, prompt_hash, hits, last_used, response in cache._conn.execute(query, params):
+            when = time.strftime("%Y-%m-%d %H:%M", time.localtime(last_used))
+            preview = " ".join(response.split())[:80]
+            print(f"[{model}] {prompt_hash[:12]} hit={hits} {when}  {preview}")
+
+    elif args.command == "purge":
+        older_than = args.older_than_days * 86400 if args.older_than_days is not None else None
+        print(f"Eliminate {cache.purge(args.model, older_than)} risposte")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
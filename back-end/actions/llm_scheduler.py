@@ -0,0 +1,134 @@
+import os
+import time
+import heapq
+import asyncio
+import itertools
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+# === CONFIGURAZIONI ===
+# Generazioni contemporanee per backend (Ollama su CPU ne regge bene una alla volta)
+MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "1"))
+# Attesa massima stimata in coda prima di rinunciare (secondi)
+INTERACTIVE_WAIT_BUDGET = float(os.getenv("LLM_WAIT_BUDGET", "20"))
+BACKGROUND_WAIT_BUDGET = float(os.getenv("LLM_BACKGROUND_WAIT_BUDGET", "120"))
+# Durata stimata di una generazione finché non ci sono misure reali
+INITIAL_SERVICE_TIME = float(os.getenv("LLM_SERVICE_ESTIMATE", "8"))
+
+PRIORITY_INTERACTIVE = 0   # risposte attese dall'utente (RAG, domande sul contesto)
+PRIORITY_BACKGROUND = 10   # lavoro che può aspettare (estrazione del contesto)
+
+
+class SchedulerOverloaded(Exception):
+    """L'attesa stimata in coda supera il budget della richiesta."""
+
+    def __init__(self, expected_wait: float, budget: float):
+        super().__init__(f"attesa stimata {expected_wait:.1f}s oltre il budget di {budget:.1f}s")
+        self.expected_wait = expected_wait
+        self.budget = budget
+
+
+class _Backend:
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.active = 0
+        self.waiters = []  # heap di (priorità, progressivo, future)
+        self.service_time = INITIAL_SERVICE_TIME  # media mobile esponenziale (s)
+        self.wait_times = deque(maxlen=200)
+        self.served = 0
+        self.rejected = 0
+
+    def queued(self) -> int:
+        return sum(1 for _, _, f in self.waiters if not f.done())
+
+    def expected_wait(self, priority: int) -> float:
+        """Stima: richieste davanti (in esecuzione e in coda con priorità non inferiore) per durata media."""
+        ahead = self.active + sum(1 for p, _, f in self.waiters if p <= priority and not f.done())
+        turns = max(0, ahead - self.capacity + 1)
+        return turns * self.service_time / self.capacity
+
+
+class LLMScheduler:
+    """
+    Coda con priorità davanti a Ollama: limita le generazioni contemporanee
+    per backend, serve prima le richieste interattive e rifiuta subito quelle
+    che aspetterebbero più del loro budget, invece di accodarle per minuti.
+    """
+
+    def __init__(self, capacity: int = MAX_CONCURRENCY):
+        self.capacity = capacity
+        self._backends: Dict[str, _Backend] = {}
+        self._seq = itertools.count()
+
+    def _backend(self, name: str) -> _Backend:
+        if name not in self._backends:
+            self._backends[name] = _Backend(self.capacity)
+        return self._backends[name]
+
+    @asynccontextmanager
+    async def slot(self, backend: str, priority: int = PRIORITY_INTERACTIVE, budget: Optional[float] = None):
+        if budget is None:
+            budget = INTERACTIVE_WAIT_BUDGET if priority <= PRIORITY_INTERACTIVE else BACKGROUND_WAIT_BUDGET
+        state = self._backend(backend)
+
+        expected = state.expected_wait(priority)
+        if expected > budget:
+            state.rejected += 1
+            raise SchedulerOverloaded(expected, budget)
+
+        queued_at = time.perf_counter()
+        if state.active < state.capacity and not state.queued():
+            state.active += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(state.waiters, (priority, next(self._seq), future))
+            try:
+                await future
+            except asyncio.CancelledError:
+                # Slot già assegnato mentre il chiamante veniva annullato: va liberato
+                if future.done() and not future.cancelled():
+                    self._release(state)
+                raise
+        state.wait_times.append(time.perf_counter() - queued_at)
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            state.service_time = 0.8 * state.service_time + 0.2 * elapsed
+            state.served += 1
+            self._release(state)
+
+    def _release(self, state: _Backend) -> None:
+        state.active -= 1
+        while state.waiters:
+            _, _, future = heapq.heappop(state.waiters)
+            if not future.done():
+                state.active += 1
+                future.set_result(None)
+                return
+
+    def expected_wait(self, backend: str, priority: int = PRIORITY_INTERACTIVE) -> float:
+        """Attesa stimata in coda (s) per una nuova richiesta con questa priorità."""
+        return self._backend(backend).expected_wait(priority)
+
+    def stats(self) -> dict:
+        backends = {}
+        for name, state in self._backends.items():
+            waits = sorted(state.wait_times)
+            backends[name] = {
+                "active": state.active,
+                "queue_depth": state.queued(),
+                "capacity": state.capacity,
+                "served": state.served,
+                "rejected": state.rejected,
+                "service_ms": round(state.service_time * 1000, 1),
+                "wait_p50_ms": round(waits[len(waits) // 2] * 1000, 1) if waits else 0.0,
+                "wait_p95_ms": round(waits[int(len(waits) * 0.95)] * 1000, 1) if waits else 0.0,
+            }
+        return {"backends": backends}
+
+
+scheduler = LLMScheduler()
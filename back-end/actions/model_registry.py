@@ -0,0 +1,172 @@
+import os
+import time
+import logging
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+import yaml # type: ignore
+
+from . import debug_state
+from .llm_scheduler import scheduler, PRIORITY_INTERACTIVE
+from .ollama_client import generate, OllamaModelNotFound, DEFAULT_MODEL
+from .ollama_resolver import resolver
+
+# === CONFIGURAZIONI ===
+MODELS_FILE = os.path.join(os.path.dirname(__file__), "data/models.yml")
+DEFAULT_BUDGET = 20.0
+# Per quanto tempo (s) un modello non installato viene escluso dalla scelta
+MISSING_MODEL_TTL = 600
+
+TASK_RAG_ANSWER = "rag_answer"
+TASK_CONTEXT_QA = "context_qa"
+TASK_CONTEXT_EXTRACTION = "context_extraction"
+
+logger = logging.getLogger(__name__)
+
+
+class _TaskStats:
+    """Latenza e token di un (task, modello), per tarare la mappa in data/models.yml."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.cached = 0
+        self.latencies = deque(maxlen=200)
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.eval_seconds = 0.0
+
+    def as_dict(self) -> dict:
+        latencies = sorted(self.latencies)
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "cached": self.cached,
+            "latency_p50_ms": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else 0.0,
+            "latency_p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 1) if latencies else 0.0,
+            "avg_prompt_tokens": round(self.prompt_tokens / max(self.calls - self.cached, 1), 1),
+            "avg_output_tokens": round(self.output_tokens / max(self.calls - self.cached, 1), 1),
+            "tokens_per_s": round(self.output_tokens / self.eval_seconds, 2) if self.eval_seconds else 0.0,
+        }
+
+
+class ModelRegistry:
+    """
+    Mappa i task delle azioni sui modelli Ollama (data/models.yml) e sceglie il
+    modello a ogni chiamata: il più capace se la latenza stimata rientra nel
+    budget del task, altrimenti uno più leggero (coda lunga o budget stretto).
+    """
+
+    def __init__(self, path: str = MODELS_FILE):
+        self.path = path
+        self._mtime = None
+        self._config: dict = {}
+        # Durata media (s) delle generazioni per modello, misurata
+        self._service_time: Dict[str, float] = {}
+        self._missing: Dict[str, float] = {}
+        self._stats: Dict[str, Dict[str, _TaskStats]] = {}
+
+    def _refresh(self) -> None:
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = 0.0
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self._config = yaml.safe_load(f) or {}
+        except OSError:
+            self._config = {}
+        self._mtime = mtime
+
+    def task_config(self, task: str) -> dict:
+        self._refresh()
+        config = {"models": [DEFAULT_MODEL], "budget_s": DEFAULT_BUDGET}
+        config.update(self._config.get("default") or {})
+        config.update((self._config.get("tasks") or {}).get(task) or {})
+        return config
+
+    def choose(self, task: str, budget: Optional[float] = None, priority: int = PRIORITY_INTERACTIVE) -> str:
+        config = self.task_config(task)
+        budget = min(budget, config["budget_s"]) if budget is not None else config["budget_s"]
+        now = time.monotonic()
+        models = [m for m in config["models"] if self._missing.get(m, 0) <= now] or config["models"]
+
+        # Solo la stima dell'attesa: mai una risoluzione di rete dentro il turno
+        base_url = resolver.cached_url()
+        wait = scheduler.expected_wait(base_url, priority) if base_url else 0.0
+        for model in models:
+            # Senza misure il modello è considerato adatto: la prima chiamata lo misura
+            if wait + self._service_time.get(model, 0.0) <= budget:
+                return model
+        # Nessuno rientra: il più veloce misurato, o il più leggero della lista se mancano misure
+        if all(model in self._service_time for model in models):
+            return min(models, key=lambda model: self._service_time[model])
+        return models[-1]
+
+    def record(self, task: str, model: str, elapsed: float, usage: dict, ok: bool = True) -> None:
+        stats = self._stats.setdefault(task, {}).setdefault(model, _TaskStats())
+        stats.calls += 1
+        if not ok:
+            stats.errors += 1
+            return
+        if usage.get("cached"):
+            stats.cached += 1
+            return
+
+        stats.latencies.append(elapsed)
+        stats.prompt_tokens += usage.get("prompt_eval_count", 0)
+        stats.output_tokens += usage.get("eval_count", 0)
+        stats.eval_seconds += usage.get("eval_duration", 0) / 1e9
+        previous = self._service_time.get(model)
+        self._service_time[model] = elapsed if previous is None else 0.8 * previous + 0.2 * elapsed
+
+    def mark_missing(self, model: str) -> None:
+        self._missing[model] = time.monotonic() + MISSING_MODEL_TTL
+
+    def stats(self) -> dict:
+        return {task: {model: s.as_dict() for model, s in models.items()} for task, models in self._stats.items()}
+
+
+registry = ModelRegistry()
+
+
+async def generate_for_task(task: str, prompt: str, on_token: Optional[Callable[[str], None]] = None,
+                            priority: int = PRIORITY_INTERACTIVE, budget: Optional[float] = None,
+                            wait_budget: Optional[float] = None, system: Optional[str] = None) -> str:
+    """
+    Genera la risposta per un task con il modello scelto dal registro.
+    `budget` (s) restringe la latenza ammessa, ad es. il tempo che resta nel turno.
+    Un modello non installato viene escluso e si riprova con il successivo.
+    """
+    tried: List[str] = []
+    while True:
+        model = registry.choose(task, budget, priority)
+        if model in tried:
+            raise OllamaModelNotFound(f"nessun modello disponibile per il task {task}")
+        tried.append(model)
+
+        usage: dict = {}
+        started = time.perf_counter()
+        try:
+            text = await generate(prompt, model=model, on_token=on_token, priority=priority,
+                                  wait_budget=wait_budget, usage=usage, system=system)
+        except OllamaModelNotFound:
+            registry.mark_missing(model)
+            registry.record(task, model, time.perf_counter() - started, usage, ok=False)
+            continue
+        except Exception:
+            registry.record(task, model, time.perf_counter() - started, usage, ok=False)
+            raise
+
+        elapsed = time.perf_counter() - started
+        registry.record(task, model, elapsed, usage)
+        logger.info(
+            "LLM %s via %s: %.0f ms (caricamento %.0f ms), token prompt %s, token risposta %s%s",
+            task, model, elapsed * 1000, usage.get("load_duration", 0) / 1e6,
+            usage.get("prompt_eval_count", "-"), usage.get("eval_count", "-"),
+            " (cache)" if usage.get("cached") else "",
+        )
+        debug_state.publish("model_registry", registry.stats())
+        return text
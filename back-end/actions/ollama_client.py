@@ -0,0 +1,219 @@
+import os
+import json
+import asyncio
+import logging
+
+import httpx # type: ignore
+from typing import Callable, Dict, List, Optional, Tuple
+
+from . import debug_state, http_client
+from .llm_cache import get_llm_cache
+from .llm_scheduler import scheduler, SchedulerOverloaded, PRIORITY_INTERACTIVE
+from .ollama_resolver import resolver, get_ollama_url_async
+
+# === CONFIGURAZIONI ===
+DEFAULT_MODEL = "phi3:3.8b"
+# Per quanto Ollama tiene il modello in memoria dopo l'ultima richiesta (formato Ollama: "30m", "-1" = sempre)
+KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+logger = logging.getLogger(__name__)
+
+
+class OllamaError(Exception):
+    """Ollama non raggiungibile o risposta non valida."""
+
+
+class OllamaBusy(OllamaError):
+    """Coda di Ollama troppo lunga: l'attesa supererebbe il budget della richiesta."""
+
+
+class OllamaModelNotFound(OllamaError):
+    """Il backend risponde ma il modello richiesto non è installato."""
+
+
+# Campi della risposta finale di Ollama utili per le statistiche per modello
+USAGE_FIELDS = ("prompt_eval_count", "eval_count", "eval_duration", "prompt_eval_duration", "load_duration", "total_duration")
+
+
+class _Flight:
+    """Generazione in corso su Ollama, condivisa da tutte le richieste identiche."""
+
+    def __init__(self, streaming: bool):
+        self.future = asyncio.get_running_loop().create_future()
+        # Evita il warning "exception was never retrieved" se tutti i chiamanti sono stati annullati
+        self.future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.streaming = streaming
+        self.tokens: List[str] = []
+        self.usage: dict = {}
+        self.listeners: List[Callable[[str], None]] = []
+
+    def push(self, token: str) -> None:
+        self.tokens.append(token)
+        for listener in list(self.listeners):
+            listener(token)
+
+
+# Generazioni in corso per (modello, prompt, opzioni): con temperature 0 la risposta è la stessa
+_in_flight: Dict[Tuple[str, str, str], _Flight] = {}
+_stats = {"calls": 0, "upstream": 0, "coalesced": 0, "rejected": 0}
+
+
+def stats() -> dict:
+    return {
+        **_stats,
+        "in_flight": len(_in_flight),
+        "coalesced_rate": round(_stats["coalesced"] / _stats["calls"], 3) if _stats["calls"] else 0.0,
+    }
+
+
+async def generate(prompt: str, model: str = DEFAULT_MODEL,
+                   on_token: Optional[Callable[[str], None]] = None,
+                   options: Optional[dict] = None, cache: bool = True,
+                   priority: int = PRIORITY_INTERACTIVE, wait_budget: Optional[float] = None,
+                   usage: Optional[dict] = None, system: Optional[str] = None) -> str:
+    """
+    Genera una risposta con /api/generate sul backend scelto dal resolver.
+    Con `system` (istruzioni statiche) si usa /api/chat: il prefisso è identico a
+    ogni chiamata e Ollama può riusarne la valutazione invece di ricalcolarla.
+    Con `on_token` la risposta viene letta in streaming e ogni token viene
+    passato alla callback appena arriva; il valore restituito è sempre il testo completo.
+
+    Le risposte già generate vengono lette dalla cache su disco (llm_cache.py).
+    Le chiamate concorrenti con lo stesso (modello, prompt, opzioni) condividono
+    un'unica generazione: chi arriva dopo riceve i token già prodotti e poi quelli nuovi.
+    Le generazioni passano dallo scheduler (llm_scheduler.py) con la priorità
+    indicata; se l'attesa stimata supera `wait_budget` viene sollevato OllamaBusy.
+    Se passato, `usage` viene riempito con i contatori di token restituiti da Ollama.
+    """
+    options = {"temperature": 0, **(options or {})}
+    full_prompt = f"{system}\0{prompt}" if system else prompt
+    key = (model, full_prompt, json.dumps(options, sort_keys=True))
+
+    llm_cache = get_llm_cache() if cache else None
+    if llm_cache is not None:
+        cached = await asyncio.to_thread(llm_cache.get, model, full_prompt, options)
+        debug_state.publish("llm_cache", {"hits": llm_cache.hits, "misses": llm_cache.misses})
+        if cached is not None:
+            if usage is not None:
+                usage["cached"] = True
+            if on_token is not None:
+                on_token(cached)
+            return cached
+
+    _stats["calls"] += 1
+    flight = _in_flight.get(key)
+    if flight is None:
+        flight = _Flight(streaming=on_token is not None)
+        _in_flight[key] = flight
+        # Task separato: l'annullamento di un chiamante non interrompe la generazione degli altri
+        asyncio.create_task(_run_flight(key, flight, prompt, model, options, llm_cache, priority, wait_budget, system))
+    else:
+        _stats["coalesced"] += 1
+
+    if on_token is not None:
+        for token in flight.tokens:
+            on_token(token)
+        flight.listeners.append(on_token)
+
+    try:
+        text = await asyncio.shield(flight.future)
+    finally:
+        if on_token in flight.listeners:
+            flight.listeners.remove(on_token)
+
+    if usage is not None:
+        usage.update(flight.usage)
+    # Unito a una generazione non in streaming: il testo arriva tutto insieme
+    if on_token is not None and not flight.streaming and text:
+        on_token(text)
+    return text
+
+
+async def _run_flight(key, flight: _Flight, prompt: str, model: str, options: dict, llm_cache=None,
+                      priority: int = PRIORITY_INTERACTIVE, wait_budget: Optional[float] = None,
+                      system: Optional[str] = None) -> None:
+    try:
+        base_url = await get_ollama_url_async()
+        if not base_url:
+            raise OllamaError("nessun backend Ollama disponibile")
+
+        async with scheduler.slot(base_url, priority, wait_budget):
+            _stats["upstream"] += 1
+            text, flight.usage = await _generate_upstream(
+                base_url, prompt, model, flight.push if flight.streaming else None, options, system
+            )
+        flight.future.set_result(text)
+    except SchedulerOverloaded as e:
+        _stats["rejected"] += 1
+        flight.future.set_exception(OllamaBusy(str(e)))
+        return
+    except Exception as e:
+        flight.future.set_exception(e if isinstance(e, OllamaError) else OllamaError(str(e)))
+        return
+    finally:
+        _in_flight.pop(key, None)
+        debug_state.publish("llm_coalescing", stats())
+        debug_state.publish("llm_scheduler", scheduler.stats())
+
+    if llm_cache is not None:
+        try:
+            await asyncio.to_thread(llm_cache.put, model, key[1], options, text)
+        except Exception as e:
+            logger.warning("Salvataggio nella cache LLM fallito: %s", e)
+
+
+def _chunk_text(data: dict) -> str:
+    """Testo di una risposta (o di un chunk in streaming) di /api/generate o /api/chat."""
+    if "message" in data:
+        return (data.get("message") or {}).get("content", "")
+    return data.get("response", data.get("text", ""))
+
+
+async def _generate_upstream(base_url: str, prompt: str, model: str, on_token: Optional[Callable[[str], None]],
+                             options: dict, system: Optional[str] = None) -> Tuple[str, dict]:
+    payload = {
+        "model": model,
+        "stream": on_token is not None,
+        "options": options,
+        "keep_alive": KEEP_ALIVE,
+    }
+    if system:
+        endpoint = "/api/chat"
+        payload["messages"] = [{"role": "system", "content": system}, {"role": "user", "content": prompt}]
+    else:
+        endpoint = "/api/generate"
+        payload["prompt"] = prompt
+
+    try:
+        if on_token is None:
+            response = await http_client.post(f"{base_url}{endpoint}", service="ollama", json=payload)
+            response.raise_for_status()
+            data = response.json()
+            return _chunk_text(data), {k: data[k] for k in USAGE_FIELDS if k in data}
+
+        # Risposta in streaming: una riga JSON per ogni token
+        parts, usage = [], {}
+        async with http_client.stream("POST", f"{base_url}{endpoint}", service="ollama", json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                token = _chunk_text(chunk)
+                if token:
+                    parts.append(token)
+                    on_token(token)
+                if chunk.get("done"):
+                    usage = {k: chunk[k] for k in USAGE_FIELDS if k in chunk}
+                    break
+        return "".join(parts), usage
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 404:
+            # Il backend funziona: manca solo il modello (es. non ancora scaricato con `ollama pull`)
+            raise OllamaModelNotFound(f"modello {model} non disponibile su {base_url}") from e
+        resolver.mark_failed(base_url)
+        raise OllamaError(str(e)) from e
+    except Exception as e:
+        # Backend non raggiungibile: il resolver passa al prossimo candidato
+        resolver.mark_failed(base_url)
+        raise OllamaError(str(e)) from e
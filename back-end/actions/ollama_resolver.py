@@ -0,0 +1,234 @@
+import os
+import asyncio
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional
+
+import requests
+from dotenv import load_dotenv # type: ignore
+
+from . import debug_state
+
+load_dotenv()
+
+# === CONFIGURAZIONI ===
+GIST_URL = os.getenv(
+    "OLLAMA_GIST_URL",
+    "https://gist.githubusercontent.com/AndreaNapoli08/0b153d525eb3a45d37cafd65b32bca8c/raw/ollama_url.txt",
+)
+URL_TTL = float(os.getenv("OLLAMA_URL_TTL", "300"))
+PROBE_TIMEOUT = float(os.getenv("OLLAMA_PROBE_TIMEOUT", "3"))
+
+
+def _iso(ts: Optional[float]) -> Optional[str]:
+    return datetime.utcfromtimestamp(ts).isoformat() + "Z" if ts else None
+
+
+class OllamaResolver:
+    """
+    Risolve l'URL di Ollama una volta sola e lo tiene in cache con un TTL.
+
+    I candidati sono, in ordine: l'override statico (OLLAMA_URL), i backend
+    configurati (OLLAMA_BACKENDS, separati da virgola) e infine l'URL ngrok
+    pubblicato sul Gist. Ogni candidato viene verificato su /api/tags e viene
+    scelto il primo che risponde. Il refresh avviene in un thread in background,
+    avviato con start() all'avvio del server delle azioni, quindi le azioni
+    leggono sempre il valore in cache senza chiamate di rete. Un solo refresh
+    alla volta: chi arriva mentre un altro è in corso ne attende il risultato.
+    """
+
+    def __init__(self, static_url: Optional[str] = None, backends: Optional[List[str]] = None,
+                 gist_url: Optional[str] = GIST_URL, ttl: float = URL_TTL):
+        self.static_url = static_url.rstrip("/") if static_url else None
+        self.backends = [b.rstrip("/") for b in (backends or []) if b]
+        self.gist_url = gist_url
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refreshes = 0
+        self._wakeup = threading.Event()
+        self._thread = None
+
+        self.url = None
+        self.source = None
+        self.resolved_at = None
+        self.failures = 0
+        self.probes = []
+
+    @classmethod
+    def from_env(cls) -> "OllamaResolver":
+        backends = [b.strip() for b in os.getenv("OLLAMA_BACKENDS", "").split(",") if b.strip()]
+        return cls(static_url=os.getenv("OLLAMA_URL"), backends=backends)
+
+    # ---------------------------------------------------------
+    # API pubblica
+    # ---------------------------------------------------------
+    def start(self) -> None:
+        """Avvia il thread di refresh e la prima risoluzione, senza attenderla."""
+        self._ensure_refresher()
+        with self._lock:
+            if self.url is None:
+                self._wakeup.set()
+
+    def get_base_url(self) -> Optional[str]:
+        """
+        Restituisce l'URL in cache. Solo se non è ancora stato risolto attende
+        la prima risoluzione (bloccante: dal codice async usare get_base_url_async).
+        """
+        self._ensure_refresher()
+
+        with self._lock:
+            url, expired, refreshes = self.url, self._expired(), self._refreshes
+
+        if url is None:
+            return self._refresh_once(refreshes)
+        if expired:
+            self._wakeup.set()
+        return url
+
+    async def get_base_url_async(self) -> Optional[str]:
+        """Come get_base_url, ma l'eventuale prima risoluzione gira in un thread e non blocca l'event loop."""
+        with self._lock:
+            url = self.url
+        if url is not None:
+            return self.get_base_url()
+        return await asyncio.to_thread(self.get_base_url)
+
+    def cached_url(self) -> Optional[str]:
+        """URL in cache senza mai risolvere (None se non ancora disponibile)."""
+        with self._lock:
+            return self.url
+
+    def mark_failed(self, url: Optional[str]) -> None:
+        """Segnala che una chiamata verso `url` è fallita: forza un nuovo refresh in background."""
+        with self._lock:
+            if url and url == self.url:
+                self.resolved_at = None
+                self.failures += 1
+        self._wakeup.set()
+
+    def refresh(self) -> Optional[str]:
+        """Verifica i candidati e aggiorna l'URL in cache con il primo sano."""
+        with self._refresh_lock:
+            return self._refresh()
+
+    def _refresh_once(self, seen: int) -> Optional[str]:
+        """Refresh per chi non ha ancora un URL: se nel frattempo ne è terminato un altro si usa il suo esito."""
+        with self._refresh_lock:
+            with self._lock:
+                if self._refreshes != seen:
+                    return self.url
+            return self._refresh()
+
+    def _refresh(self) -> Optional[str]:
+        probes = []
+        chosen, source = None, None
+
+        for candidate, candidate_source in self._candidates():
+            probe = self._probe(candidate)
+            probe["source"] = candidate_source
+            probes.append(probe)
+            if probe["healthy"]:
+                chosen, source = candidate, candidate_source
+                break
+
+        with self._lock:
+            self.probes = probes
+            self._refreshes += 1
+            if chosen:
+                self.url, self.source = chosen, source
+                self.resolved_at = time.time()
+            # Se nessun backend risponde manteniamo l'ultimo URL noto
+
+        debug_state.publish("ollama", self.snapshot())
+        return chosen or self.url
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "url": self.url,
+                "source": self.source,
+                "resolved_at": _iso(self.resolved_at),
+                "expires_at": _iso(self.resolved_at + self.ttl) if self.resolved_at else None,
+                "ttl": self.ttl,
+                "failures": self.failures,
+                "probes": list(self.probes),
+            }
+
+    # ---------------------------------------------------------
+    # Interni
+    # ---------------------------------------------------------
+    def _expired(self) -> bool:
+        return self.resolved_at is None or time.time() - self.resolved_at > self.ttl
+
+    def _candidates(self):
+        seen = set()
+        if self.static_url:
+            seen.add(self.static_url)
+            yield self.static_url, "env"
+        for backend in self.backends:
+            if backend not in seen:
+                seen.add(backend)
+                yield backend, "config"
+        gist = self._read_gist()
+        if gist and gist not in seen:
+            yield gist, "gist"
+
+    def _read_gist(self) -> Optional[str]:
+        if not self.gist_url:
+            return None
+        try:
+            res = requests.get(self.gist_url, timeout=5)
+            url = res.text.strip()
+            if url.startswith("http"):
+                return url.rstrip("/")
+        except Exception:
+            pass
+        return None
+
+    def _probe(self, url: str) -> dict:
+        start = time.perf_counter()
+        try:
+            res = requests.get(f"{url}/api/tags", timeout=PROBE_TIMEOUT)
+            healthy = res.status_code == 200
+            error = None if healthy else f"HTTP {res.status_code}"
+        except Exception as e:
+            healthy, error = False, str(e)
+        return {
+            "url": url,
+            "healthy": healthy,
+            "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+            "error": error,
+        }
+
+    def _ensure_refresher(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._refresh_loop, name="ollama-resolver", daemon=True)
+                    self._thread.start()
+
+    def _refresh_loop(self):
+        while True:
+            self._wakeup.wait(timeout=self.ttl)
+            self._wakeup.clear()
+            try:
+                self.refresh()
+            except Exception:
+                pass
+
+
+# Istanza condivisa da tutte le azioni
+resolver = OllamaResolver.from_env()
+
+
+def get_ollama_url() -> Optional[str]:
+    """Recupera l'URL di Ollama dalla cache del resolver."""
+    return resolver.get_base_url()
+
+
+async def get_ollama_url_async() -> Optional[str]:
+    """Come get_ollama_url, per le coroutine: la prima risoluzione non blocca l'event loop."""
+    return await resolver.get_base_url_async()
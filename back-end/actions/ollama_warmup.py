@@ -0,0 +1,114 @@
+import os
+import time
+import logging
+import threading
+from typing import Dict, Optional
+
+import requests
+
+from . import debug_state
+from .ollama_client import KEEP_ALIVE
+from .ollama_resolver import get_ollama_url
+
+# === CONFIGURAZIONI ===
+WARMUP_ENABLED = os.getenv("OLLAMA_WARMUP", "1") != "0"
+WARMUP_TIMEOUT = float(os.getenv("OLLAMA_WARMUP_TIMEOUT", "300"))
+
+logger = logging.getLogger(__name__)
+
+# Istruzioni di sistema statiche per task, registrate dalle azioni all'import
+_prefixes: Dict[str, str] = {}
+_thread: Optional[threading.Thread] = None
+_report: dict = {"status": "pending"}
+
+
+def register_prefix(task: str, system: str) -> None:
+    _prefixes[task] = system
+
+
+def report() -> dict:
+    return dict(_report)
+
+
+def _post(base_url: str, endpoint: str, payload: dict) -> dict:
+    res = requests.post(f"{base_url}{endpoint}", json=payload, timeout=WARMUP_TIMEOUT)
+    res.raise_for_status()
+    return res.json()
+
+
+def warmup() -> dict:
+    """
+    Carica in memoria il modello principale di ogni task (con keep_alive, così
+    resta caricato tra un turno e l'altro) e fa valutare a Ollama le istruzioni
+    di sistema registrate, in modo che il primo turno non paghi il cold start.
+    Le richieste interattive sono riscaldate per ultime: Ollama riusa la cache
+    dell'ultimo prefisso valutato.
+    """
+    # Import qui: model_registry importa a sua volta i moduli che registrano i prefissi
+    from .model_registry import registry, TASK_CONTEXT_EXTRACTION
+
+    started = time.perf_counter()
+    base_url = get_ollama_url()
+    if not base_url:
+        return {"status": "skipped", "error": "nessun URL Ollama disponibile"}
+
+    tasks = sorted(_prefixes, key=lambda t: t != TASK_CONTEXT_EXTRACTION)
+    models, prefixes = {}, {}
+    for task in tasks:
+        model = registry.task_config(task)["models"][0]
+        if model not in models:
+            t0 = time.perf_counter()
+            try:
+                data = _post(base_url, "/api/generate", {"model": model, "keep_alive": KEEP_ALIVE})
+                models[model] = {
+                    "load_ms": round(data.get("load_duration", 0) / 1e6, 1),
+                    "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1),
+                }
+            except Exception as e:
+                models[model] = {"error": str(e)}
+                continue
+
+        t0 = time.perf_counter()
+        try:
+            data = _post(base_url, "/api/chat", {
+                "model": model,
+                "messages": [{"role": "system", "content": _prefixes[task]}],
+                "stream": False,
+                "keep_alive": KEEP_ALIVE,
+                "options": {"num_predict": 1},
+            })
+            prefixes[task] = {
+                "model": model,
+                "prompt_tokens": data.get("prompt_eval_count"),
+                "prompt_eval_ms": round(data.get("prompt_eval_duration", 0) / 1e6, 1),
+                "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1),
+            }
+        except Exception as e:
+            prefixes[task] = {"model": model, "error": str(e)}
+
+    return {
+        "status": "done",
+        "url": base_url,
+        "models": models,
+        "prefixes": prefixes,
+        "total_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def _run() -> None:
+    global _report
+    try:
+        _report = warmup()
+    except Exception as e:
+        _report = {"status": "error", "error": str(e)}
+    logger.info("Warmup Ollama: %s", _report)
+    debug_state.publish("ollama_warmup", _report)
+
+
+def start() -> None:
+    """Avvia il warmup in un thread in background (disattivabile con OLLAMA_WARMUP=0)."""
+    global _thread
+    if not WARMUP_ENABLED or _thread is not None:
+        return
+    _thread = threading.Thread(target=_run, name="ollama-warmup", daemon=True)
+    _thread.start()
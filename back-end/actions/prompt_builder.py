@@ -0,0 +1,135 @@
+import os
+import re
+import math
+import logging
+from typing import Callable, List, Optional
+
+import numpy as np # type: ignore
+
+from . import debug_state
+
+# === CONFIGURAZIONI ===
+# Budget (token stimati) dell'intero prompt: istruzioni + domanda + contesto
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "500"))
+CONTEXT_MIN_TOKENS = int(os.getenv("CONTEXT_MIN_TOKENS", "200"))
+# Lunghezza della risposta estrattiva usata quando l'LLM non risponde in tempo
+EXTRACTIVE_MAX_TOKENS = int(os.getenv("EXTRACTIVE_MAX_TOKENS", "60"))
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+_SENTENCE_RE = re.compile(r"(?<=[.!?;])\s+|\n+")
+
+
+def count_tokens(text: str) -> int:
+    """
+    Stima dei token del modello: il tokenizer di phi3 spezza le parole italiane
+    in pezzi di circa 4 caratteri e conta a parte la punteggiatura.
+    """
+    return sum(math.ceil(len(w) / 4) if w[0].isalnum() or w[0] == "_" else 1 for w in _WORD_RE.findall(text))
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in _SENTENCE_RE.split(text) if s and s.strip()]
+
+
+def rank_sentences(query_embedding, sentences: List[str],
+                   embed_documents: Callable[[List[str]], List[List[float]]]) -> List[int]:
+    """Indici delle frasi in ordine di similarità coseno decrescente con la domanda."""
+    vectors = np.asarray(embed_documents(sentences), dtype=np.float32)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(query_embedding, dtype=np.float32)
+    query = query / max(np.linalg.norm(query), 1e-12)
+    return [int(i) for i in np.argsort(-(vectors @ query))]
+
+
+def select_sentences(query_embedding, passages: List[List[str]], budget: int,
+                     embed_documents: Callable[[List[str]], List[List[float]]]) -> List[List[str]]:
+    """
+    Tiene le frasi più simili alla domanda finché rientrano nel budget, mantenendo
+    l'ordine originale all'interno di ogni passaggio. Le frasi ripetute (overlap
+    tra chunk consecutivi) vengono considerate una sola volta.
+    """
+    positions, sentences, seen = [], [], set()
+    for p, passage in enumerate(passages):
+        for s, sentence in enumerate(passage):
+            if sentence in seen:
+                continue
+            seen.add(sentence)
+            positions.append((p, s))
+            sentences.append(sentence)
+    if not sentences:
+        return [[] for _ in passages]
+
+    kept, used = [], 0
+    for i in rank_sentences(query_embedding, sentences, embed_documents):
+        size = count_tokens(sentences[i])
+        if used + size <= budget:
+            kept.append(int(i))
+            used += size
+
+    selected: List[List[str]] = [[] for _ in passages]
+    for i in sorted(kept, key=lambda i: positions[i]):
+        selected[positions[i][0]].append(sentences[i])
+    return selected
+
+
+def extract_sentences(query_embedding, passages: List[str],
+                      embed_documents: Callable[[List[str]], List[List[float]]],
+                      max_tokens: int = EXTRACTIVE_MAX_TOKENS) -> str:
+    """
+    Risposta estrattiva: le frasi più vicine alla domanda, prese in ordine di
+    rilevanza finché entrano in `max_tokens` e poi rimesse nell'ordine del testo.
+    """
+    sentences = list(dict.fromkeys(s for p in passages for s in split_sentences(p)))
+    if not sentences:
+        return ""
+
+    kept, used = [], 0
+    for i in rank_sentences(query_embedding, sentences, embed_documents):
+        size = count_tokens(sentences[i])
+        if used + size > max_tokens:
+            break
+        kept.append(i)
+        used += size
+
+    if not kept:
+        # Anche la frase migliore supera il budget: la tronchiamo
+        best = sentences[rank_sentences(query_embedding, sentences, embed_documents)[0]]
+        return best[:max_tokens * 4].rsplit(" ", 1)[0] + "..."
+    return " ".join(sentences[i] for i in sorted(kept))
+
+
+def build_prompt(template, question: str, passages: List[str], query_embedding=None,
+                 embed_documents: Optional[Callable[[List[str]], List[List[float]]]] = None,
+                 max_tokens: int = PROMPT_MAX_TOKENS, context_min_tokens: int = CONTEXT_MIN_TOKENS,
+                 separator: str = "\n\n", name: str = "rag", system: str = "") -> str:
+    """
+    Compone il prompt (`template` con {context} e {question}) restando nel budget
+    di token. Se i passaggi non ci stanno interi vengono compressi in modo
+    estrattivo tenendo le frasi più vicine alla domanda. Il contesto ha comunque
+    a disposizione almeno `context_min_tokens` token. Le istruzioni di sistema
+    (`system`), inviate a parte, contano comunque nel budget.
+    """
+    fixed_tokens = count_tokens(system) + count_tokens(template.format(context="", question=question))
+    budget = max(max_tokens - fixed_tokens, context_min_tokens)
+
+    original_tokens = sum(count_tokens(p) for p in passages)
+    compressed = original_tokens > budget and query_embedding is not None and embed_documents is not None
+    if compressed:
+        selected = select_sentences(query_embedding, [split_sentences(p) for p in passages], budget, embed_documents)
+        passages = [" ".join(s) for s in selected if s]
+
+    context = separator.join(passages)
+    prompt = template.format(context=context, question=question)
+
+    report = {
+        "prompt_tokens": count_tokens(system) + count_tokens(prompt),
+        "context_tokens_before": original_tokens,
+        "context_tokens_after": count_tokens(context),
+        "budget": budget,
+        "compressed": compressed,
+    }
+    logger.info("Prompt %s: %s", name, report)
+    debug_state.publish(f"prompt_{name}", report)
+    return prompt
@@ -0,0 +1,182 @@
+import os
+import time
+from typing import Dict, List, Optional
+
+import numpy as np # type: ignore
+import yaml # type: ignore
+from langchain.schema import Document # type: ignore
+
+from .lexical_index import get_lexical_index
+
+# === CONFIGURAZIONI ===
+SETTINGS_FILE = os.path.join(os.path.dirname(__file__), "data/retrieval.yml")
+TOP_K = 2             # documenti passati al prompt
+FETCH_K = 4           # candidati letti da Chroma
+LAMBDA_MULT = 0.5     # bilanciamento rilevanza/diversità dell'MMR
+MAX_DISTANCE = 1.1    # oltre questa distanza L2 un chunk non è considerato rilevante
+RRF_K = 60            # costante della Reciprocal Rank Fusion
+
+
+class Candidate:
+    """Chunk candidato con id Chroma, distanza dalla domanda ed embedding."""
+
+    def __init__(self, id: str, document: Document, distance: float, embedding: np.ndarray):
+        self.id = id
+        self.document = document
+        self.distance = distance
+        self.embedding = embedding
+
+
+class RetrievalResult:
+    """Esito della fase di retrieval: documenti scelti, distanze e tempi per fase (ms)."""
+
+    def __init__(self, documents: List[Document], distances: List[float], relevant: bool, timings: dict):
+        self.documents = documents
+        self.distances = distances
+        self.relevant = relevant
+        self.timings = timings
+
+
+_settings = None
+
+
+def collection_settings(collection: str) -> dict:
+    """Impostazioni di retrieval della collezione (data/retrieval.yml), con i default."""
+    global _settings
+    if _settings is None:
+        try:
+            with open(SETTINGS_FILE, encoding="utf-8") as f:
+                _settings = yaml.safe_load(f) or {}
+        except OSError:
+            _settings = {}
+
+    settings = {"mode": "dense", "k": TOP_K, "fetch_k": FETCH_K, "lambda_mult": LAMBDA_MULT}
+    settings.update(_settings.get("default") or {})
+    settings.update((_settings.get("collections") or {}).get(collection) or {})
+    return settings
+
+
+def _to_candidates(ids, texts, metadatas, distances, embeddings) -> List[Candidate]:
+    return [
+        Candidate(cid, Document(page_content=text, metadata=meta or {}), float(dist), np.asarray(emb, dtype=np.float32))
+        for cid, text, meta, dist, emb in zip(ids, texts, metadatas, distances, embeddings)
+    ]
+
+
+def fetch_candidates(vectordb, query_embedding, fetch_k: int = FETCH_K) -> List[Candidate]:
+    """
+    Una sola query a Chroma che restituisce testo, metadati, distanza ed embedding
+    dei `fetch_k` chunk più vicini, ordinati per distanza crescente.
+    """
+    res = vectordb._collection.query(
+        query_embeddings=[list(query_embedding)],
+        n_results=fetch_k,
+        include=["documents", "metadatas", "distances", "embeddings"],
+    )
+    return _to_candidates(res["ids"][0], res["documents"][0], res["metadatas"][0], res["distances"][0], res["embeddings"][0])
+
+
+def fetch_by_ids(vectordb, query_embedding, ids: List[str]) -> List[Candidate]:
+    """Legge da Chroma i chunk trovati solo dal BM25, calcolando la loro distanza L2 (al quadrato)."""
+    if not ids:
+        return []
+    res = vectordb._collection.get(ids=ids, include=["documents", "metadatas", "embeddings"])
+    query = np.asarray(query_embedding, dtype=np.float32)
+    distances = [float(np.sum((np.asarray(emb, dtype=np.float32) - query) ** 2)) for emb in res["embeddings"]]
+    return _to_candidates(res["ids"], res["documents"], res["metadatas"], distances, res["embeddings"])
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], rrf_k: int = RRF_K) -> List[str]:
+    """Fonde più classifiche di id: ogni id riceve la somma di 1 / (rrf_k + posizione)."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, cid in enumerate(ranking, start=1):
+            scores[cid] = scores.get(cid, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores, key=lambda cid: -scores[cid])
+
+
+def mmr_select(query_embedding, candidates: List[Candidate], k: int = TOP_K,
+               lambda_mult: float = LAMBDA_MULT) -> List[Candidate]:
+    """Maximal Marginal Relevance in memoria sui vettori già letti da Chroma."""
+    if not candidates:
+        return []
+
+    vectors = np.stack([c.embedding for c in candidates])
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(query_embedding, dtype=np.float32)
+    query = query / max(np.linalg.norm(query), 1e-12)
+
+    relevance = vectors @ query
+    selected = [int(np.argmax(relevance))]
+
+    while len(selected) < min(k, len(candidates)):
+        redundancy = (vectors @ vectors[selected].T).max(axis=1)
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        selected.append(int(np.argmax(scores)))
+
+    return [candidates[i] for i in selected]
+
+
+def retrieve(vectordb, query_embedding, k: int = TOP_K, fetch_k: int = FETCH_K,
+             lambda_mult: float = LAMBDA_MULT, max_distance: float = MAX_DISTANCE,
+             mode: str = "dense", query: Optional[str] = None, collection: Optional[str] = None) -> RetrievalResult:
+    """
+    Retrieval in un solo passaggio: lettura dei candidati, soglia di rilevanza
+    sui primi `k` e selezione MMR, senza ulteriori ricerche sul vector store.
+
+    Con mode="hybrid" i candidati vettoriali vengono fusi (RRF) con i risultati
+    BM25 dell'indice lessicale della collezione; se l'indice non esiste si
+    torna alla sola ricerca vettoriale.
+    """
+    timings = {}
+
+    start = time.perf_counter()
+    candidates = fetch_candidates(vectordb, query_embedding, fetch_k)
+    timings["search_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+    # Stessa regola di prima: almeno uno dei primi k vettoriali deve essere sotto la soglia
+    top = candidates[:k]
+    relevant = any(c.distance <= max_distance for c in top)
+    if not relevant:
+        return RetrievalResult([], [c.distance for c in top], False, timings)
+
+    index = get_lexical_index(collection) if mode == "hybrid" and collection and query else None
+    if index is not None:
+        start = time.perf_counter()
+        lexical_ids = [cid for cid, _ in index.search(query, fetch_k)]
+        by_id = {c.id: c for c in candidates}
+        by_id.update({c.id: c for c in fetch_by_ids(vectordb, query_embedding, [i for i in lexical_ids if i not in by_id])})
+        fused = reciprocal_rank_fusion([[c.id for c in candidates], lexical_ids])
+        candidates = [by_id[cid] for cid in fused if cid in by_id][:fetch_k]
+        timings["lexical_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+    start = time.perf_counter()
+    selected = mmr_select(query_embedding, candidates, k, lambda_mult)
+    timings["mmr_ms"] = round((time.perf_counter() - start) * 1000, 1)
+
+    return RetrievalResult(
+        [c.document for c in selected],
+        [c.distance for c in selected],
+        True,
+        timings,
+    )
+
+
+def merge_results(results: List[RetrievalResult], k: int = TOP_K) -> RetrievalResult:
+    """
+    Unisce i risultati di più collezioni interrogate in parallelo: restano i
+    `k` documenti più vicini tra le sole collezioni rilevanti. I tempi sono
+    quelli della collezione più lenta, dato che le ricerche sono concorrenti.
+    """
+    timings: Dict[str, float] = {}
+    for result in results:
+        for name, value in result.timings.items():
+            timings[name] = max(timings.get(name, 0.0), value)
+
+    pairs = [(dist, doc) for r in results if r.relevant for doc, dist in zip(r.documents, r.distances)]
+    if not pairs:
+        return RetrievalResult([], [d for r in results for d in r.distances], False, timings)
+
+    pairs.sort(key=lambda pair: pair[0])
+    return RetrievalResult([doc for _, doc in pairs[:k]], [dist for dist, _ in pairs[:k]], True, timings)
@@ -0,0 +1,243 @@
+import os
+import json
+import atexit
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np # type: ignore
+
+# NB: questo modulo è importato anche da ingest.py (eseguito come script),
+# quindi non deve dipendere da altri moduli del package `actions`.
+
+# === CONFIGURAZIONI ===
+CACHE_DIR = os.path.join(os.path.dirname(__file__), "data/cache/semantic")
+SIMILARITY_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_SIZE", "256"))
+TTL_SECONDS = float(os.getenv("SEMANTIC_CACHE_TTL", str(7 * 24 * 3600)))
+# Le nuove voci vengono scritte su disco in background, al massimo ogni SAVE_INTERVAL secondi
+SAVE_INTERVAL = float(os.getenv("SEMANTIC_CACHE_SAVE_INTERVAL", "5"))
+
+
+def _stamp_path(cache_dir: str, collection: str) -> str:
+    return os.path.join(cache_dir, f"{collection}.stamp")
+
+
+def _stamp_mtime(cache_dir: str, collection: str) -> float:
+    try:
+        return os.path.getmtime(_stamp_path(cache_dir, collection))
+    except OSError:
+        return 0.0
+
+
+class SemanticCache:
+    """
+    Cache delle risposte RAG di una collezione, indicizzata per embedding della domanda.
+
+    Una domanda nuova riusa la risposta salvata se la similarità coseno con una
+    domanda già vista supera la soglia. Le voci sono gestite LRU con scadenza
+    (TTL) e salvate su disco in JSON da un thread in background, così store()
+    non fa I/O nell'event loop delle azioni. Quando ingest.py ricostruisce la
+    collezione aggiorna il file `.stamp`, e la cache si svuota al primo accesso.
+    """
+
+    def __init__(self, collection: str, threshold: float = SIMILARITY_THRESHOLD,
+                 max_entries: int = MAX_ENTRIES, ttl: float = TTL_SECONDS, cache_dir: str = CACHE_DIR):
+        self.collection = collection
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self.path = os.path.join(cache_dir, f"{collection}.json")
+
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # una scrittura (o cancellazione) del file alla volta
+        self._dirty = False
+        self._flusher = None
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._matrix = None  # embedding normalizzati, ricostruiti solo quando cambiano le voci
+        self._keys: List[str] = []
+        self._stamp = 0.0
+        self.hits = 0
+        self.misses = 0
+
+        self._load()
+
+    # ---------------------------------------------------------
+    # API pubblica
+    # ---------------------------------------------------------
+    def lookup(self, embedding) -> Optional[dict]:
+        """Restituisce {"answer", "sources", "query", "similarity"} oppure None."""
+        with self._lock:
+            self._check_invalidation()
+            self._expire()
+
+            if not self._entries:
+                self.misses += 1
+                return None
+
+            query = self._normalize(embedding)
+            scores = self._get_matrix() @ query
+            best = int(np.argmax(scores))
+            similarity = float(scores[best])
+
+            if similarity < self.threshold:
+                self.misses += 1
+                return None
+
+            key = self._keys[best]
+            entry = self._entries[key]
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return {
+                "answer": entry["answer"],
+                "sources": entry["sources"],
+                "query": entry["query"],
+                "similarity": similarity,
+            }
+
+    def store(self, query: str, embedding, answer: str, sources: List[str]) -> None:
+        key = query.strip().lower()
+        with self._lock:
+            self._check_invalidation()
+            self._entries[key] = {
+                "query": query,
+                "embedding": [float(x) for x in self._normalize(embedding)],
+                "answer": answer,
+                "sources": list(sources),
+                "created_at": time.time(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+            self._dirty = True
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name=f"semantic-cache-{self.collection}",
+                                                 daemon=True)
+                self._flusher.start()
+
+    def flush(self) -> None:
+        """Scrive su disco le voci non ancora salvate."""
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                data = {"stamp": self._stamp, "entries": list(self._entries.values())}
+                self._dirty = False
+            self._save(data)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+            self._dirty = False
+        with self._save_lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "collection": self.collection,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "threshold": self.threshold,
+        }
+
+    # ---------------------------------------------------------
+    # Interni
+    # ---------------------------------------------------------
+    @staticmethod
+    def _normalize(embedding):
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def _get_matrix(self):
+        if self._matrix is None:
+            self._keys = list(self._entries.keys())
+            self._matrix = np.asarray([self._entries[k]["embedding"] for k in self._keys], dtype=np.float32)
+        return self._matrix
+
+    def _expire(self):
+        now = time.time()
+        expired = [k for k, e in self._entries.items() if now - e["created_at"] > self.ttl]
+        for k in expired:
+            del self._entries[k]
+        if expired:
+            self._matrix = None
+
+    def _check_invalidation(self):
+        stamp = _stamp_mtime(self.cache_dir, self.collection)
+        if stamp > self._stamp:
+            # La collezione è stata ricostruita dopo il caricamento della cache
+            self._stamp = stamp
+            self._entries.clear()
+            self._matrix = None
+
+    def _load(self):
+        self._stamp = _stamp_mtime(self.cache_dir, self.collection)
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        # Cache scritta prima dell'ultima indicizzazione: la scartiamo
+        if data.get("stamp", 0.0) < self._stamp:
+            return
+        for entry in data.get("entries", []):
+            self._entries[entry["query"].strip().lower()] = entry
+        self._expire()
+
+    def _save(self, data: dict):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(SAVE_INTERVAL)
+            try:
+                self.flush()
+            except OSError:
+                # Il salvataggio è solo un'ottimizzazione: si riprova al prossimo giro
+                pass
+
+
+_caches: Dict[str, SemanticCache] = {}
+
+
+def get_semantic_cache(collection: str) -> SemanticCache:
+    """Restituisce la cache (condivisa nel processo) della collezione."""
+    if collection not in _caches:
+        _caches[collection] = SemanticCache(collection)
+    return _caches[collection]
+
+
+@atexit.register
+def _flush_all() -> None:
+    # Voci arrivate dopo l'ultimo salvataggio in background
+    for cache in list(_caches.values()):
+        try:
+            cache.flush()
+        except OSError:
+            pass
+
+
+def invalidate_collection(collection: str, cache_dir: str = CACHE_DIR) -> None:
+    """Da chiamare dopo aver ricostruito una collezione: scarta le risposte in cache."""
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(_stamp_path(cache_dir, collection), "w", encoding="utf-8") as f:
+        f.write(str(time.time()))
+
+    cache_path = os.path.join(cache_dir, f"{collection}.json")
+    if os.path.exists(cache_path):
+        os.remove(cache_path)
@@ -0,0 +1,93 @@
+import os
+import time
+import asyncio
+
+from dotenv import load_dotenv # type: ignore
+
+from . import http_client
+
+load_dotenv()
+
+# === CONFIGURAZIONI ===
+# Endpoint di server.py che inoltra i token al frontend (es. http://localhost:8000/chat/stream)
+STREAM_API_URL = os.getenv("STREAM_API_URL")
+FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL", "0.15"))
+# Il sender termina da solo se l'azione esce senza chiudere lo stream
+SENDER_IDLE_TIMEOUT = 300
+
+
+class TokenStream:
+    """
+    Inoltra a server.py i token generati dall'LLM per il messaggio corrente.
+
+    È attivo solo se il frontend ha passato uno `stream_id` nei metadata del
+    messaggio; altrimenti tutte le chiamate sono no-op e la risposta arriva
+    solo tramite il dispatcher, come prima. Va creato dentro `run` (sull'event
+    loop delle azioni); `push` può essere chiamato anche da un altro thread.
+    """
+
+    def __init__(self, tracker):
+        metadata = tracker.latest_message.get("metadata") or {}
+        self.stream_id = metadata.get("stream_id")
+        self.session_id = metadata.get("session_id")
+        self.user_email = metadata.get("email")
+        self.enabled = bool(STREAM_API_URL and self.stream_id)
+
+        self._buffer = []
+        self._failed = False
+        self._last_flush = time.monotonic()
+        self._loop = asyncio.get_event_loop()
+        # Un solo sender per stream: i gruppi di token arrivano a server.py in ordine
+        self._queue = asyncio.Queue() if self.enabled else None
+        self._sender = self._loop.create_task(self._send_loop()) if self.enabled else None
+
+    def push(self, token: str) -> None:
+        if not self.enabled or not token:
+            return
+        self._buffer.append(token)
+        if time.monotonic() - self._last_flush >= FLUSH_INTERVAL:
+            self._enqueue({"tokens": "".join(self._buffer)})
+            self._buffer = []
+
+    async def close(self, final_text: str) -> None:
+        """Chiude lo stream inviando il messaggio completo, che server.py salva nella chat."""
+        if not self.enabled:
+            return
+        self.enabled = False
+        self._enqueue({
+            "tokens": "".join(self._buffer),
+            "done": True,
+            "text": final_text,
+            "session_id": self.session_id,
+            "user_email": self.user_email,
+        })
+        self._buffer = []
+        self._enqueue(None)
+        await self._sender
+
+    def _enqueue(self, payload) -> None:
+        self._last_flush = time.monotonic()
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self._queue.put_nowait(payload)
+        else:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, payload)
+
+    async def _send_loop(self):
+        while True:
+            try:
+                payload = await asyncio.wait_for(self._queue.get(), timeout=SENDER_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                return
+            if payload is None:
+                return
+            if self._failed:
+                continue
+            try:
+                await http_client.post(f"{STREAM_API_URL}/{self.stream_id}", service="stream", json=payload)
+            except Exception:
+                # Lo streaming è un miglioramento: se fallisce la risposta arriva comunque
+                self._failed = True
@@ -0,0 +1,345 @@
+import os
+import threading
+from datetime import date, datetime, time, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np # type: ignore
+
+# === CONFIGURAZIONI ===
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+# Fascia oraria in cui /rooms/freebusy riporta gli intervalli liberi
+DAY_START_HOUR = int(os.getenv("BOOKING_DAY_START", "8"))
+DAY_END_HOUR = int(os.getenv("BOOKING_DAY_END", "20"))
+# Giorni tenuti in memoria (i meno usati vengono scartati e ricaricati su richiesta)
+MAX_DAYS = int(os.getenv("AVAILABILITY_MAX_DAYS", "120"))
+
+SLOT = timedelta(minutes=SLOT_MINUTES)
+
+# fetch(inizio_giorno, fine_giorno, room_ids) -> prenotazioni (con room_id, start, end, id)
+Fetch = Callable[[datetime, datetime, list], Iterable]
+
+
+def day_bounds(day: date) -> Tuple[datetime, datetime]:
+    start = datetime.combine(day, time.min)
+    return start, start + timedelta(days=1)
+
+
+def days_between(start: datetime, end: datetime) -> List[date]:
+    days, day = [], start.date()
+    while datetime.combine(day, time.min) < end:
+        days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def aligned(start: datetime, end: datetime) -> bool:
+    """Intervallo con estremi multipli di 15 minuti: la bitmap lo rappresenta esattamente."""
+    return all(t.minute % SLOT_MINUTES == 0 and t.second == 0 and t.microsecond == 0 for t in (start, end))
+
+
+def slot_range(day: date, start: datetime, end: datetime) -> Tuple[int, int]:
+    """Slot [s, e) del giorno toccati dall'intervallo (arrotondati verso l'esterno)."""
+    day_start, _ = day_bounds(day)
+    s = int((start - day_start) // SLOT)
+    e = -int(-(end - day_start) // SLOT)
+    return max(0, s), min(SLOTS_PER_DAY, e)
+
+
+def floor_to_slot(t: datetime) -> datetime:
+    return t.replace(minute=t.minute - t.minute % SLOT_MINUTES, second=0, microsecond=0)
+
+
+def ceil_to_slot(t: datetime) -> datetime:
+    floor = floor_to_slot(t)
+    return floor if floor == t else floor + SLOT
+
+
+def opening_hours(range_start: datetime, range_end: datetime, day_start_hour: int = DAY_START_HOUR,
+                  day_end_hour: int = DAY_END_HOUR) -> List[Tuple[datetime, datetime]]:
+    """Fascia oraria prenotabile di ogni giorno dell'intervallo, ritagliata sull'intervallo."""
+    hours = []
+    for day in days_between(range_start, range_end):
+        day_start, _ = day_bounds(day)
+        opening = max(day_start + timedelta(hours=day_start_hour), range_start)
+        closing = min(day_start + timedelta(hours=day_end_hour), range_end)
+        if opening < closing:
+            hours.append((opening, closing))
+    return hours
+
+
+def free_gaps(bookings: list, hours: List[Tuple[datetime, datetime]]) -> List[Tuple[datetime, datetime]]:
+    """
+    Intervalli liberi di una sala dentro le fasce orarie `hours` (vedi opening_hours),
+    con una sola passata sulle prenotazioni ordinate per inizio.
+    """
+    gaps = []
+    i, n = 0, len(bookings)
+    for cursor, closing in hours:
+        # Prenotazioni già concluse prima dell'apertura: non servono più
+        while i < n and bookings[i].end <= cursor:
+            i += 1
+        j = i
+        while j < n and bookings[j].start < closing:
+            if bookings[j].start > cursor:
+                gaps.append((cursor, bookings[j].start))
+            if bookings[j].end > cursor:
+                cursor = bookings[j].end
+            j += 1
+        if cursor < closing:
+            gaps.append((cursor, closing))
+    return gaps
+
+
+def nearest_windows(rooms: list, bookings: list, requested_start: datetime, duration: timedelta,
+                    range_start: datetime, range_end: datetime, limit: int = 5,
+                    day_start_hour: int = DAY_START_HOUR, day_end_hour: int = DAY_END_HOUR) -> List[dict]:
+    """
+    Finestre libere di durata `duration` più vicine all'orario richiesto, su
+    tutte le sale. `bookings` è ordinato per (room_id, start): per ogni sala i
+    buchi tra le prenotazioni si trovano con una passata e da ogni buco si prende
+    l'inizio più vicino all'ora richiesta in quel giorno. Se va spostato viene
+    allineato a 15 minuti dentro il buco (verso l'alto dopo gap_start, verso il
+    basso prima di latest); se il buco è troppo stretto per allinearlo resta com'è.
+    Le finestre con lo stesso orario vengono unite, con l'elenco delle sale.
+    """
+    by_room: Dict = {room.id: [] for room in rooms}
+    for booking in bookings:
+        if booking.room_id in by_room:
+            by_room[booking.room_id].append(booking)
+
+    hours = opening_hours(range_start, range_end, day_start_hour, day_end_hour)
+    # Ora richiesta riportata su ogni giorno dell'intervallo
+    targets = {opening.date(): datetime.combine(opening.date(), requested_start.time()) for opening, _ in hours}
+
+    candidates: Dict[datetime, list] = {}
+    for room in rooms:
+        for gap_start, gap_end in free_gaps(by_room[room.id], hours):
+            latest = gap_end - duration
+            if latest < gap_start:
+                continue
+            target = targets[gap_start.date()]
+            if gap_start <= target <= latest:
+                start = target
+            elif target > latest:
+                start = floor_to_slot(latest)
+                start = start if start >= gap_start else latest
+            else:
+                start = ceil_to_slot(gap_start)
+                start = start if start <= latest else gap_start
+            candidates.setdefault(start, []).append(room)
+
+    nearest = sorted(candidates, key=lambda t: (abs(t - requested_start), t))[:limit]
+    return [{"start": t, "end": t + duration, "rooms": candidates[t]} for t in nearest]
+
+
+class _RoomDay:
+    """Occupazione di una sala in un giorno: bitmap degli slot e intervalli esatti."""
+
+    __slots__ = ("version", "bitmap", "intervals", "exact")
+
+    def __init__(self, version: int):
+        self.version = version
+        self.bitmap = np.zeros(SLOTS_PER_DAY, dtype=bool)
+        self.intervals: List[Tuple[datetime, datetime, str]] = []
+        self.exact = True  # tutte le prenotazioni allineate agli slot
+
+    def add(self, day: date, start: datetime, end: datetime, booking_id: str) -> None:
+        s, e = slot_range(day, start, end)
+        self.bitmap[s:e] = True
+        self.intervals.append((start, end, booking_id))
+        self.exact = self.exact and aligned(start, end)
+
+    def rebuild(self, day: date) -> None:
+        self.bitmap[:] = False
+        self.exact = True
+        for start, end, _ in self.intervals:
+            s, e = slot_range(day, start, end)
+            self.bitmap[s:e] = True
+            self.exact = self.exact and aligned(start, end)
+
+    def overlaps(self, start: datetime, end: datetime) -> bool:
+        return any(b_start < end and b_end > start for b_start, b_end, _ in self.intervals)
+
+
+class AvailabilityEngine:
+    """
+    Disponibilità delle sale in memoria: per ogni giorno e sala una bitmap di
+    slot da 15 minuti, caricata dal database la prima volta che serve.
+
+    Ogni voce ricorda la rooms.version con cui è stata caricata: se la versione
+    letta nella transazione è diversa (prenotazione fatta da un altro processo)
+    la voce viene ricaricata, quindi la bitmap è sempre coerente con il
+    controllo ottimistico di db/bookings.py. Gli slot occupati solo in parte
+    (orari non multipli di 15 minuti) vengono verificati sugli intervalli esatti.
+    Le query sul database girano fuori dal lock, che protegge solo le bitmap.
+    """
+
+    def __init__(self, max_days: int = MAX_DAYS):
+        self.max_days = max_days
+        self._lock = threading.Lock()
+        self._days: Dict[date, Dict] = {}  # giorno -> {room_id: _RoomDay}, in ordine d'uso
+        self._stats = {"checks": 0, "exact_checks": 0, "loads": 0, "updates": 0}
+
+    # ---------------------------------------------------------
+    # Caricamento
+    # ---------------------------------------------------------
+    def _stale(self, rooms: list, day: date) -> list:
+        """Sale senza voce aggiornata per il giorno (da chiamare con il lock)."""
+        entries = self._days.get(day, {})
+        return [room for room in rooms
+                if room.id not in entries or entries[room.id].version != room.version]
+
+    def _load(self, rooms: list, days: List[date], fetch: Fetch) -> Dict[date, Dict]:
+        """
+        Legge dal database le voci mancanti o con versione diversa. La query gira
+        senza lock: le altre richieste e gli aggiornamenti non la aspettano.
+        """
+        with self._lock:
+            stale = {day: self._stale(rooms, day) for day in days}
+        loaded: Dict[date, Dict] = {}
+        for day, stale_rooms in stale.items():
+            if not stale_rooms:
+                continue
+            entries = {room.id: _RoomDay(room.version) for room in stale_rooms}
+            day_start, day_end = day_bounds(day)
+            for booking in fetch(day_start, day_end, list(entries)):
+                if booking.room_id in entries:
+                    entries[booking.room_id].add(day, booking.start, booking.end, str(booking.id))
+            loaded[day] = entries
+        return loaded
+
+    def _install(self, rooms: list, day: date, loaded: Dict) -> Optional[Dict]:
+        """
+        Inserisce le voci lette da _load e restituisce quelle del giorno, o None se
+        qualche sala è ancora senza voce aggiornata (es. giorno scartato nel frattempo).
+        Da chiamare con il lock.
+        """
+        entries = self._days.pop(day, {})
+        self._days[day] = entries  # in fondo: usato più di recente
+        for room_id, entry in loaded.items():
+            current = entries.get(room_id)
+            # Una voce già allineata (caricata o aggiornata da un'altra richiesta) resta
+            if current is None or current.version != entry.version:
+                entries[room_id] = entry
+        if loaded:
+            self._stats["loads"] += 1
+
+        while len(self._days) > self.max_days:
+            self._days.pop(next(iter(self._days)))
+        if day not in self._days or self._stale(rooms, day):
+            return None
+        return entries
+
+    def _locked_entries(self, rooms: list, days: List[date], fetch: Fetch) -> Dict[date, Dict]:
+        """
+        Voci aggiornate dei giorni indicati. Ritorna con il lock acquisito: il
+        chiamante lo rilascia al termine dell'interrogazione.
+        """
+        while True:
+            loaded = self._load(rooms, days, fetch)
+            self._lock.acquire()
+            by_day = {day: self._install(rooms, day, loaded.get(day, {})) for day in days}
+            if all(entries is not None for entries in by_day.values()):
+                return by_day
+            # Voci cambiate tra la lettura e l'inserimento: si ricarica
+            self._lock.release()
+
+    # ---------------------------------------------------------
+    # Interrogazioni
+    # ---------------------------------------------------------
+    def free_rooms(self, rooms: list, start: datetime, end: datetime, fetch: Fetch) -> Set:
+        """Id delle sale senza prenotazioni sovrapposte a [start, end)."""
+        if not rooms:
+            return set()
+        days = days_between(start, end)
+        by_day = self._locked_entries(rooms, days, fetch)
+        try:
+            self._stats["checks"] += 1
+            ids = [room.id for room in rooms]
+            busy = np.zeros(len(ids), dtype=bool)
+            for day in days:
+                entries = by_day[day]
+                s, e = slot_range(day, start, end)
+                # Una riga per sala: una sola operazione su tutte le sale candidate
+                matrix = np.stack([entries[room_id].bitmap[s:e] for room_id in ids])
+                busy |= matrix.any(axis=1)
+
+            free = {room_id for room_id, b in zip(ids, busy) if not b}
+            # Slot occupati solo in parte (orari non allineati): verifica esatta sugli intervalli
+            request_aligned = aligned(start, end)
+            for room_id, b in zip(ids, busy):
+                if not b:
+                    continue
+                entries = [by_day[day][room_id] for day in days]
+                if request_aligned and all(entry.exact for entry in entries):
+                    continue
+                self._stats["exact_checks"] += 1
+                if not any(entry.overlaps(start, end) for entry in entries):
+                    free.add(room_id)
+            return free
+        finally:
+            self._lock.release()
+
+    def free_busy(self, rooms: list, day: date, fetch: Fetch,
+                  day_start_hour: int = DAY_START_HOUR, day_end_hour: int = DAY_END_HOUR) -> Dict:
+        """
+        Per ogni sala: intervalli occupati (esatti) e liberi nella fascia oraria,
+        questi ultimi ricavati dalla bitmap con granularità di 15 minuti.
+        """
+        entries = self._locked_entries(rooms, [day], fetch)[day]
+        try:
+            first = day_start_hour * 60 // SLOT_MINUTES
+            last = day_end_hour * 60 // SLOT_MINUTES
+            day_start, day_end = day_bounds(day)
+
+            result = {}
+            for room in rooms:
+                entry = entries[room.id]
+                window = ~entry.bitmap[first:last]
+                # Inizio/fine delle sequenze di slot liberi: differenze sulla bitmap estesa con zeri
+                edges = np.flatnonzero(np.diff(np.concatenate(([False], window, [False])).astype(np.int8)))
+                free = [
+                    (day_start + (first + int(s)) * SLOT, day_start + (first + int(e)) * SLOT)
+                    for s, e in zip(edges[::2], edges[1::2])
+                ]
+                busy = sorted((max(b_start, day_start), min(b_end, day_end)) for b_start, b_end, _ in entry.intervals)
+                result[room.id] = {"busy": busy, "free": free}
+            return result
+        finally:
+            self._lock.release()
+
+    # ---------------------------------------------------------
+    # Aggiornamenti dopo prenotazione / cancellazione
+    # ---------------------------------------------------------
+    def booked(self, booking, version: int) -> None:
+        self._apply(booking, version, add=True)
+
+    def cancelled(self, booking, version: int) -> None:
+        self._apply(booking, version, add=False)
+
+    def _apply(self, booking, version: int, add: bool) -> None:
+        with self._lock:
+            self._stats["updates"] += 1
+            for day in days_between(booking.start, booking.end):
+                entry = self._days.get(day, {}).get(booking.room_id)
+                if entry is None:
+                    continue
+                if entry.version != version - 1:
+                    # Voce non allineata (altri aggiornamenti nel frattempo): si ricarica alla prossima richiesta
+                    del self._days[day][booking.room_id]
+                    continue
+                if add:
+                    entry.add(day, booking.start, booking.end, str(booking.id))
+                else:
+                    entry.intervals = [i for i in entry.intervals if i[2] != str(booking.id)]
+                    entry.rebuild(day)
+                entry.version = version
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"days": len(self._days), **self._stats}
+
+
+# Istanza condivisa dagli endpoint del server
+availability = AvailabilityEngine()
@@ -0,0 +1,152 @@
+# back-end/db/bookings.py
+import os
+import time
+import random
+from datetime import datetime
+from typing import List, Optional, Set, Tuple
+
+from sqlmodel import Session, select # type: ignore
+from sqlalchemy import update # type: ignore
+from sqlalchemy.exc import OperationalError # type: ignore
+
+from db.models import Room, Booking
+from db.room_index import room_index
+
+# === CONFIGURAZIONI ===
+BOOKING_RETRIES = int(os.getenv("BOOKING_RETRIES", "10"))
+BOOKING_RETRY_BACKOFF = float(os.getenv("BOOKING_RETRY_BACKOFF", "0.02"))
+
+
+class RoomUnavailable(Exception):
+    """Nessuna sala con caratteristiche e capienza richieste è libera nell'intervallo."""
+
+
+class BookingConflict(Exception):
+    """Tentativi esauriti: prenotazioni concorrenti hanno continuato a modificare le sale scelte."""
+
+
+def find_candidates(session: Session, persons: int, features: List[str]) -> List[Room]:
+    """
+    Sale con capienza sufficiente e tutte le caratteristiche richieste (confronto
+    case-insensitive), in ordine best-fit: prima la più piccola che basta.
+    """
+    ids = room_index.candidates(session, persons, features)
+    if not ids:
+        return []
+    rooms = {room.id: room for room in session.exec(select(Room).where(Room.id.in_(ids))).all()}
+    # sale eliminate dopo la costruzione dell'indice vengono semplicemente saltate
+    return [rooms[room_id] for room_id in ids if room_id in rooms]
+
+
+def busy_rooms(session: Session, room_ids: list, start: datetime, end: datetime) -> Set:
+    """Sale con almeno una prenotazione sovrapposta a [start, end): una query sull'indice (room_id, start, end)."""
+    if not room_ids:
+        return set()
+    return set(session.exec(
+        select(Booking.room_id).where(
+            Booking.room_id.in_(room_ids),
+            Booking.start < end,
+            Booking.end > start
+        )
+    ).all())
+
+
+def bookings_in_range(session: Session, room_ids: list, start: datetime, end: datetime) -> List[Booking]:
+    """Prenotazioni delle sale che toccano [start, end), ordinate per (room_id, start) come l'indice."""
+    if not room_ids:
+        return []
+    return session.exec(
+        select(Booking).where(
+            Booking.room_id.in_(room_ids),
+            Booking.start < end,
+            Booking.end > start
+        ).order_by(Booking.room_id, Booking.start)
+    ).all()
+
+
+def fetch_bookings(session: Session):
+    """Caricatore per availability.AvailabilityEngine: prenotazioni delle sale che toccano [start, end)."""
+    def fetch(start: datetime, end: datetime, room_ids: list):
+        return session.exec(select(Booking).where(
+            Booking.room_id.in_(room_ids),
+            Booking.start < end,
+            Booking.end > start
+        )).all()
+    return fetch
+
+
+def create_booking(engine, start: datetime, end: datetime, email: str, persons: int,
+                   features: List[str], availability=None) -> Tuple[Room, Booking]:
+    """
+    Prenota la sala libera più piccola tra quelle adatte (best-fit), in
+    un'unica transazione e senza sovrascritture.
+
+    Controllo ottimistico: insieme alla prenotazione la transazione incrementa
+    rooms.version solo se è ancora quella letta. Se nel frattempo un'altra
+    prenotazione ha modificato la sala (0 righe aggiornate) o SQLite segnala il
+    database bloccato, la transazione viene annullata e il controllo ripetuto
+    da capo. Funziona uguale su Postgres e su SQLite.
+
+    Con `availability` (motore a bitmap in memoria) il controllo delle sale
+    libere avviene sulla bitmap, allineata alla versione letta nella transazione.
+    """
+    for attempt in range(BOOKING_RETRIES):
+        with Session(engine) as session:
+            try:
+                candidates = find_candidates(session, persons, features)
+                if availability is not None:
+                    free = availability.free_rooms(candidates, start, end, fetch_bookings(session))
+                else:
+                    busy = busy_rooms(session, [room.id for room in candidates], start, end)
+                    free = {room.id for room in candidates if room.id not in busy}
+                room = next((room for room in candidates if room.id in free), None)
+                if room is None:
+                    raise RoomUnavailable()
+
+                booking = Booking(room_id=room.id, start=start, end=end, user_email=email, persons=persons)
+                session.add(booking)
+                result = session.execute(
+                    update(Room)
+                    .where(Room.id == room.id, Room.version == room.version)
+                    .values(version=Room.version + 1)
+                    .execution_options(synchronize_session=False)
+                )
+                if result.rowcount == 1:
+                    session.commit()
+                    session.refresh(booking)
+                    session.refresh(room)
+                    if availability is not None:
+                        availability.booked(booking, room.version)
+                    return room, booking
+                session.rollback()
+            except OperationalError:
+                # SQLite: un'altra transazione sta scrivendo (database is locked)
+                session.rollback()
+
+        # Attesa crescente con jitter per non ripetere in sincrono con le altre richieste
+        time.sleep(BOOKING_RETRY_BACKOFF * (attempt + 1) * random.uniform(0.5, 1.5))
+
+    raise BookingConflict(f"prenotazione non riuscita dopo {BOOKING_RETRIES} tentativi")
+
+
+def delete_booking(engine, booking_id, availability=None) -> Optional[Tuple[Room, Booking]]:
+    """Elimina la prenotazione e incrementa rooms.version (le bitmap in memoria degli altri processi si riallineano)."""
+    with Session(engine) as session:
+        booking = session.get(Booking, booking_id)
+        if not booking:
+            return None
+        # copia staccata dalla sessione, ancora leggibile dopo il commit
+        deleted = Booking(id=booking.id, room_id=booking.room_id, start=booking.start, end=booking.end,
+                          user_email=booking.user_email, persons=booking.persons)
+        session.delete(booking)
+        session.execute(
+            update(Room)
+            .where(Room.id == deleted.room_id)
+            .values(version=Room.version + 1)
+            .execution_options(synchronize_session=False)
+        )
+        session.commit()
+        room = session.get(Room, deleted.room_id)
+        if availability is not None:
+            availability.cancelled(deleted, room.version)
+        return room, deleted
@@ -1,8 +1,10 @@
 import json
-from sqlmodel import Session # type: ignore
+import uuid
+from datetime import datetime
+from sqlmodel import SQLModel, Session, select # type: ignore
 from sqlalchemy import text # type: ignore
 from db.db import engine
-from db.models import User, Room, Document
+from db.models import User, Room, Booking, Document
 import os
 
 def import_users():
@@ -32,6 +34,7 @@ def import_rooms():
         rooms = json.load(f)
 
     with Session(engine) as session:
+        session.exec(text("DELETE FROM bookings"))
         session.exec(text("DELETE FROM rooms"))
         session.commit()
         for name, r in rooms.items():
@@ -40,12 +43,58 @@ def import_rooms():
                 numero=r["numero"],
                 capienza=r["capienza"],
                 caratteristiche=r["caratteristiche"],
-                prenotazioni=r.get("prenotazioni", [])
+                prenotazioni=[]
             )
             session.add(room)
+            for p in r.get("prenotazioni", []):
+                session.add(booking_from_json(room.id, p))
         session.commit()
     print("✅ Stanze importate con successo!")
 
+def booking_from_json(room_id, p: dict) -> Booking:
+    return Booking(
+        id=uuid.UUID(p["id"]) if p.get("id") else uuid.uuid4(),
+        room_id=room_id,
+        start=datetime.strptime(p["start"], "%Y-%m-%d %H:%M"),
+        end=datetime.strptime(p["end"], "%Y-%m-%d %H:%M"),
+        user_email=p["user"],
+        persons=int(p.get("persons") or 0)
+    )
+
+def migrate_room_version():
+    # Colonna per il controllo ottimistico della concorrenza sulle prenotazioni
+    with Session(engine) as session:
+        session.exec(text("ALTER TABLE rooms ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 0"))
+        session.commit()
+    print("✅ Tabella stanze aggiornata!")
+
+def migrate_chat_stream_key():
+    # Chiave unica delle risposte in streaming (evita il doppio salvataggio server/frontend)
+    with Session(engine) as session:
+        session.exec(text("ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS stream_key VARCHAR"))
+        session.exec(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_chat_messages_stream_key ON chat_messages (stream_key)"))
+        session.commit()
+    print("✅ Tabella messaggi aggiornata!")
+
+def migrate_bookings():
+    # Copia le prenotazioni dall'array JSONB rooms.prenotazioni nella tabella bookings.
+    # Idempotente (stessi id); la colonna JSONB resta come storico e non viene più scritta.
+    SQLModel.metadata.create_all(engine, tables=[Booking.__table__])
+
+    with Session(engine) as session:
+        existing = set(session.exec(select(Booking.id)).all())
+        moved = 0
+        for room in session.exec(select(Room)).all():
+            for p in room.prenotazioni or []:
+                booking = booking_from_json(room.id, p)
+                if booking.id in existing:
+                    continue
+                session.add(booking)
+                existing.add(booking.id)
+                moved += 1
+        session.commit()
+    print(f"✅ {moved} prenotazioni migrate nella tabella bookings!")
+
 def import_documents():
     DOCUMENTS_FILE = os.path.join(os.path.dirname(__file__), "json/documents.json")
     with open(DOCUMENTS_FILE, encoding="utf-8") as f:
@@ -65,6 +114,35 @@ def import_documents():
         session.commit()
     print("✅ Documenti importati con successo!")
 
+def migrate_documents():
+    # Colonne aggiunte per il registro dei metadati dei PDF
+    with Session(engine) as session:
+        session.exec(text("ALTER TABLE documents ADD COLUMN IF NOT EXISTS size_bytes INTEGER"))
+        session.exec(text("ALTER TABLE documents ADD COLUMN IF NOT EXISTS pages INTEGER"))
+        session.exec(text("ALTER TABLE documents ADD COLUMN IF NOT EXISTS sha256 VARCHAR"))
+        session.exec(text("ALTER TABLE documents ADD COLUMN IF NOT EXISTS download_url VARCHAR"))
+        session.commit()
+    print("✅ Tabella documenti aggiornata!")
+
+def sync_document_metadata():
+    # Copia nel database il registro scritto da actions/ingest.py
+    REGISTRY_FILE = os.path.join(os.path.dirname(__file__), "../actions/data/documents.json")
+    with open(REGISTRY_FILE, encoding="utf-8") as f:
+        registry = json.load(f)
+
+    with Session(engine) as session:
+        for document in session.exec(select(Document)).all():
+            info = registry.get(document.filename)
+            if not info:
+                continue
+            document.size_bytes = info["size_bytes"]
+            document.pages = info["pages"]
+            document.sha256 = info["sha256"]
+            document.download_url = info["download_url"]
+            session.add(document)
+        session.commit()
+    print("✅ Metadati dei documenti sincronizzati!")
+
 def clear_chat():
     with Session(engine) as session:
         session.exec(text("DELETE FROM chat_messages"))
@@ -75,5 +153,10 @@ def clear_chat():
 if __name__ == "__main__":
     # import_users()
     # import_rooms()
+    # migrate_bookings()
+    # migrate_room_version()
+    # migrate_chat_stream_key()
     # import_documents()
+    # migrate_documents()
+    # sync_document_metadata()
     clear_chat()
\ No newline at end of file
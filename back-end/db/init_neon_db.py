@@ -1,6 +1,6 @@
 # back-end/db/init_db.py
 from sqlmodel import SQLModel, create_engine, Session
-from models import User, Room, Document, ChatSession, ChatMessage
+from models import User, Room, Booking, Document, ChatSession, ChatMessage
 from datetime import datetime
 import uuid
 import os
@@ -212,9 +212,18 @@ with Session(engine) as session:
             numero=info["numero"],
             capienza=info["capienza"],
             caratteristiche=info["caratteristiche"],
-            prenotazioni=info["prenotazioni"]
+            prenotazioni=[]
         )
         rooms.append(room)
+        for p in info["prenotazioni"]:
+            rooms.append(Booking(
+                id=uuid.UUID(p["id"]),
+                room_id=room.id,
+                start=datetime.strptime(p["start"], "%Y-%m-%d %H:%M"),
+                end=datetime.strptime(p["end"], "%Y-%m-%d %H:%M"),
+                user_email=p["user"],
+                persons=int(p["persons"])
+            ))
     session.add_all(rooms)
 
     # 3️⃣ documenti
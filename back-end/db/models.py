@@ -1,6 +1,10 @@
 # back-end/db/models.py
 from sqlmodel import SQLModel, Field, Column, JSON # type: ignore
+from sqlalchemy import Index # type: ignore
 from sqlalchemy.dialects.postgresql import JSONB # type: ignore
+
+# JSONB su Postgres, JSON sugli altri database (SQLite dei test)
+JSONType = JSON().with_variant(JSONB(), "postgresql")
 from typing import Optional, Dict, Any
 from datetime import datetime
 import uuid
@@ -22,8 +26,24 @@ class Room(SQLModel, table=True):
     name: str
     numero: int
     capienza: int
-    caratteristiche: list[str] = Field(sa_column=Column(JSONB))
-    prenotazioni: list[dict] = Field(default_factory=list, sa_column=Column(JSONB))
+    caratteristiche: list[str] = Field(sa_column=Column(JSONType))
+    # storico in JSONB, sostituito dalla tabella bookings (vedi migrate_bookings)
+    prenotazioni: list[dict] = Field(default_factory=list, sa_column=Column(JSONType))
+    # incrementata a ogni prenotazione: controllo ottimistico della concorrenza (db/bookings.py)
+    version: int = Field(default=0)
+
+class Booking(SQLModel, table=True):
+    __tablename__ = "bookings"
+    # sovrapposizioni: room_id = ? AND start < fine_richiesta AND "end" > inizio_richiesto
+    __table_args__ = (Index("ix_bookings_room_interval", "room_id", "start", "end"),)
+
+    id: Optional[uuid.UUID] = Field(default_factory=uuid.uuid4, primary_key=True)
+    room_id: uuid.UUID = Field(foreign_key="rooms.id")
+    start: datetime
+    end: datetime
+    user_email: str = Field(index=True)
+    persons: int
+    created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class Document(SQLModel, table=True):
     __tablename__ = "documents"
@@ -33,6 +53,11 @@ class Document(SQLModel, table=True):
     description: Optional[str] = None
     filename: str  # nome file salvato sul server
     uploaded_at: datetime = Field(default_factory=datetime.utcnow)
+    # metadati calcolati da actions/ingest.py (vedi sync_document_metadata)
+    size_bytes: Optional[int] = None
+    pages: Optional[int] = None
+    sha256: Optional[str] = None
+    download_url: Optional[str] = None
 
 class ChatSession(SQLModel, table=True):
     __tablename__ = "chat_sessions"
@@ -52,5 +77,8 @@ class ChatMessage(SQLModel, table=True):
     session_id: Optional[uuid.UUID] = Field(foreign_key="chat_sessions.id")
     sender: str
     type: str = Field(default="text")
-    content: Dict[str, Any] = Field(sa_column=Column(JSONB))
-    timestamp: datetime = Field(default_factory=datetime.utcnow)
\ No newline at end of file
+    content: Dict[str, Any] = Field(sa_column=Column(JSONType))
+    timestamp: datetime = Field(default_factory=datetime.utcnow)
+    # Risposta in streaming: stream_id + hash del testo. Unico, così la stessa risposta
+    # salvata sia da /chat/stream che dal frontend viene scritta una volta sola
+    stream_key: Optional[str] = Field(default=None, unique=True, index=True)
\ No newline at end of file
@@ -0,0 +1,84 @@
+# back-end/db/room_index.py
+import os
+import time
+import bisect
+import threading
+from typing import Dict, List, Set
+
+from sqlmodel import Session, select # type: ignore
+from sqlalchemy import event # type: ignore
+
+from db.models import Room
+
+# === CONFIGURAZIONI ===
+# Dopo quanti secondi l'indice viene ricostruito (sale modificate da altri processi, es. db/import_json.py)
+ROOM_INDEX_TTL = float(os.getenv("ROOM_INDEX_TTL", "300"))
+
+
+class RoomIndex:
+    """
+    Indice delle sale costruito una volta dal database: caratteristica
+    (minuscola) -> insieme di sale e sale ordinate per capienza crescente.
+    Le sale adatte a una richiesta si ottengono con una ricerca binaria sulla
+    capienza e un'intersezione di insiemi, già in ordine best-fit (la sala più
+    piccola che basta per prima).
+    """
+
+    def __init__(self, ttl: float = ROOM_INDEX_TTL):
+        self.ttl = ttl
+        self._lock = threading.RLock()  # invalidate può arrivare da un flush durante _build
+        self._built_at = None
+        self._features: Dict[str, Set] = {}
+        self._capacities: List[int] = []
+        self._by_capacity: List = []  # id delle sale, stesso ordine di _capacities
+        self._stats = {"builds": 0, "lookups": 0}
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._built_at = None
+
+    def _build(self, session: Session) -> None:
+        rooms = session.exec(select(Room)).all()
+        features: Dict[str, Set] = {}
+        for room in rooms:
+            for feature in room.caratteristiche or []:
+                features.setdefault(feature.lower(), set()).add(room.id)
+        ordered = sorted(rooms, key=lambda r: (r.capienza, r.numero))
+
+        self._features = features
+        self._capacities = [room.capienza for room in ordered]
+        self._by_capacity = [room.id for room in ordered]
+        self._built_at = time.monotonic()
+        self._stats["builds"] += 1
+
+    def candidates(self, session: Session, persons: int, features: List[str]) -> List:
+        """Id delle sale con capienza >= persons e tutte le caratteristiche, dalla più piccola."""
+        with self._lock:
+            if self._built_at is None or time.monotonic() - self._built_at > self.ttl:
+                self._build(session)
+            self._stats["lookups"] += 1
+
+            start = bisect.bisect_left(self._capacities, persons)
+            ids = self._by_capacity[start:]
+            if not features:
+                return list(ids)
+            sets = sorted((self._features.get(f.lower(), set()) for f in features), key=len)
+            matching = set.intersection(*sets)
+            return [room_id for room_id in ids if room_id in matching]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"rooms": len(self._by_capacity), "features": len(self._features), **self._stats}
+
+
+# Istanza condivisa da server.py e db/bookings.py
+room_index = RoomIndex()
+
+
+# Sale inserite, modificate o eliminate tramite ORM in questo processo: indice da ricostruire.
+# Gli incrementi di rooms.version (UPDATE diretti) non toccano capienza e caratteristiche.
+@event.listens_for(Room, "after_insert")
+@event.listens_for(Room, "after_update")
+@event.listens_for(Room, "after_delete")
+def _invalidate_room_index(mapper, connection, target):
+    room_index.invalidate()
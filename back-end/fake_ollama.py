@@ -0,0 +1,341 @@
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import httpx # type: ignore
+import yaml # type: ignore
+from dotenv import load_dotenv # type: ignore
+from fastapi import FastAPI, Request # type: ignore
+from fastapi.responses import JSONResponse, StreamingResponse # type: ignore
+
+load_dotenv()
+
+# Sostituto locale di Ollama (/api/tags, /api/generate, /api/chat, anche in streaming)
+# per misurare latenza, cache e code delle azioni senza GPU né ngrok.
+# Avvio:  python fake_ollama.py --profile cpu --port 11434
+# Azioni: OLLAMA_URL=http://localhost:11434 rasa run actions
+
+# === CONFIGURAZIONI ===
+PROFILE = os.getenv("FAKE_OLLAMA_PROFILE", "cpu")
+# canned: risposte predefinite | record: inoltra a FAKE_OLLAMA_UPSTREAM e registra | replay: rigioca le registrazioni
+MODE = os.getenv("FAKE_OLLAMA_MODE", "canned")
+UPSTREAM_URL = os.getenv("FAKE_OLLAMA_UPSTREAM", "")
+RESPONSES_FILE = os.getenv("FAKE_OLLAMA_RESPONSES", os.path.join(os.path.dirname(__file__), "test/fake_ollama_responses.yml"))
+RECORDINGS_FILE = os.getenv("FAKE_OLLAMA_RECORDINGS", os.path.join(os.path.dirname(__file__), "test/fake_ollama_recordings.jsonl"))
+MODELS = [m.strip() for m in os.getenv("FAKE_OLLAMA_MODELS", "phi3:3.8b,qwen2.5:1.5b,qwen2.5:0.5b").split(",") if m.strip()]
+# Richieste elaborate in parallelo (come OLLAMA_NUM_PARALLEL)
+PARALLEL = int(os.getenv("FAKE_OLLAMA_PARALLEL", "1"))
+SEED = os.getenv("FAKE_OLLAMA_SEED")
+
+# Profili di latenza: caricamento del modello, velocità di valutazione del prompt
+# e di generazione (token/s), ritardo di rete e variabilità relativa
+PROFILES = {
+    "instant": {"load_ms": 0, "prompt_tps": 1e9, "tps": 1e9, "network_ms": 0, "jitter": 0.0},
+    "gpu": {"load_ms": 2500, "prompt_tps": 1500, "tps": 60, "network_ms": 5, "jitter": 0.1},
+    "cpu": {"load_ms": 8000, "prompt_tps": 120, "tps": 8, "network_ms": 5, "jitter": 0.15},
+    "ngrok": {"load_ms": 8000, "prompt_tps": 120, "tps": 8, "network_ms": 150, "jitter": 0.3},
+}
+DEFAULT_KEEP_ALIVE = 300  # secondi, come il default di Ollama
+
+_WORD_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+def count_tokens(text: str) -> int:
+    return len(_WORD_RE.findall(text or ""))
+
+
+def parse_keep_alive(value) -> float:
+    """Durata keep_alive di Ollama ("30m", "1h", 300, 0, -1) in secondi."""
+    if value is None:
+        return DEFAULT_KEEP_ALIVE
+    if isinstance(value, (int, float)):
+        return float("inf") if value < 0 else float(value)
+    match = re.fullmatch(r"(-?\d+(?:\.\d+)?)([smh]?)", str(value).strip())
+    if not match:
+        return DEFAULT_KEEP_ALIVE
+    seconds = float(match.group(1)) * {"": 1, "s": 1, "m": 60, "h": 3600}[match.group(2)]
+    return float("inf") if seconds < 0 else seconds
+
+
+def request_key(endpoint: str, body: dict) -> str:
+    """Chiave di registrazione: endpoint, modello e testo della richiesta."""
+    payload = {"endpoint": endpoint, "model": body.get("model"), "prompt": body.get("prompt"),
+               "messages": body.get("messages"), "options": body.get("options") or {}}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def prompt_text(body: dict) -> str:
+    if "messages" in body:
+        return "\n".join(m.get("content", "") for m in body.get("messages") or [])
+    return body.get("prompt") or ""
+
+
+class CannedResponses:
+    """Risposte predefinite: la prima regola (regex) che trova il prompt, altrimenti il default."""
+
+    def __init__(self, path: str = RESPONSES_FILE):
+        self.rules = []
+        self.default = "Non è specificato nel documento."
+        try:
+            with open(path, encoding="utf-8") as f:
+                config = yaml.safe_load(f) or {}
+        except OSError:
+            config = {}
+        for rule in config.get("rules") or []:
+            self.rules.append((re.compile(rule["match"], re.IGNORECASE | re.DOTALL), rule["response"]))
+        self.default = config.get("default", self.default)
+
+    def answer(self, body: dict) -> str:
+        # Solo l'ultimo messaggio: le istruzioni di sistema sono uguali per tutte le domande
+        messages = body.get("messages") or []
+        text = messages[-1].get("content", "") if messages else body.get("prompt") or ""
+        for pattern, response in self.rules:
+            if pattern.search(text):
+                return response
+        return self.default
+
+
+class Recordings:
+    """Coppie richiesta/risposta registrate da un Ollama vero (una riga JSON per richiesta)."""
+
+    def __init__(self, path: str = RECORDINGS_FILE):
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+        try:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry["key"]] = entry
+        except OSError:
+            pass
+
+    def get(self, key: str) -> Optional[dict]:
+        return self.entries.get(key)
+
+    def add(self, key: str, endpoint: str, body: dict, text: str, usage: dict) -> None:
+        entry = {"key": key, "endpoint": endpoint, "model": body.get("model"), "text": text, "usage": usage,
+                 "recorded_at": datetime.utcnow().isoformat() + "Z"}
+        self.entries[key] = entry
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+class FakeOllama:
+    """
+    Simula i tempi di Ollama: caricamento del modello (scaricato allo scadere del
+    keep_alive), valutazione del prompt (il prefisso uguale alla richiesta
+    precedente sullo stesso modello non viene rivalutato, come la cache KV di
+    Ollama), generazione a token/s costanti e una coda con PARALLEL posti.
+    """
+
+    def __init__(self, profile: str = PROFILE, mode: str = MODE, models: List[str] = MODELS, parallel: int = PARALLEL):
+        if profile not in PROFILES:
+            raise ValueError(f"profilo sconosciuto: {profile} (disponibili: {', '.join(PROFILES)})")
+        self.profile_name = profile
+        self.profile = PROFILES[profile]
+        self.mode = mode
+        self.models = models
+        self.canned = CannedResponses()
+        self.recordings = Recordings()
+        self.random = random.Random(SEED)
+        self.semaphore = asyncio.Semaphore(parallel)
+        self._loaded: Dict[str, float] = {}     # modello -> scadenza (monotonic)
+        self._last_prompt: Dict[str, str] = {}  # modello -> ultimo prompt valutato
+        self.stats = {"requests": 0, "loads": 0, "replayed": 0, "recorded": 0, "canned": 0}
+
+    def _scale(self, seconds: float) -> float:
+        jitter = self.profile["jitter"]
+        return max(0.0, seconds * (1 + self.random.uniform(-jitter, jitter))) if jitter else seconds
+
+    def _load(self, model: str, keep_alive) -> float:
+        """Secondi di caricamento (0 se il modello è già in memoria) e nuova scadenza."""
+        now = time.monotonic()
+        loaded = self._loaded.get(model, 0) > now
+        self._loaded[model] = now + parse_keep_alive(keep_alive)
+        if loaded:
+            return 0.0
+        self.stats["loads"] += 1
+        self._last_prompt.pop(model, None)
+        return self._scale(self.profile["load_ms"] / 1000)
+
+    def _prompt_tokens(self, model: str, prompt: str) -> int:
+        """Token da valutare: solo quelli dopo il prefisso comune con il prompt precedente."""
+        previous = self._last_prompt.get(model, "")
+        common = len(os.path.commonprefix([previous, prompt]))
+        self._last_prompt[model] = prompt
+        return count_tokens(prompt[common:])
+
+    async def _response(self, endpoint: str, body: dict) -> dict:
+        """Testo e statistiche della risposta secondo la modalità (canned, record, replay)."""
+        key = request_key(endpoint, body)
+        if self.mode in ("replay", "record"):
+            entry = self.recordings.get(key)
+            if entry:
+                self.stats["replayed"] += 1
+                return {"text": entry["text"], "usage": entry.get("usage") or {}}
+        if self.mode == "record" and UPSTREAM_URL:
+            upstream = dict(body, stream=False)
+            async with httpx.AsyncClient(timeout=600) as client:
+                res = await client.post(f"{UPSTREAM_URL.rstrip('/')}{endpoint}", json=upstream)
+                res.raise_for_status()
+                data = res.json()
+            text = (data.get("message") or {}).get("content", "") if "message" in data else data.get("response", "")
+            usage = {k: data[k] for k in ("prompt_eval_count", "eval_count", "prompt_eval_duration", "eval_duration")
+                     if k in data}
+            self.recordings.add(key, endpoint, body, text, usage)
+            self.stats["recorded"] += 1
+            return {"text": text, "usage": usage, "live": True}
+        self.stats["canned"] += 1
+        return {"text": self.canned.answer(body), "usage": {}}
+
+    def _chunk(self, endpoint: str, model: str, text: str, done: bool) -> dict:
+        chunk = {"model": model, "created_at": datetime.utcnow().isoformat() + "Z", "done": done}
+        if endpoint == "/api/chat":
+            chunk["message"] = {"role": "assistant", "content": text}
+        else:
+            chunk["response"] = text
+        return chunk
+
+    async def handle(self, endpoint: str, body: dict):
+        model = body.get("model")
+        if model not in self.models:
+            return JSONResponse({"error": f"model '{model}' not found"}, status_code=404)
+        self.stats["requests"] += 1
+        keep_alive = body.get("keep_alive")
+        prompt = prompt_text(body)
+
+        # Solo caricamento/scaricamento (richiesta senza prompt, come fa Ollama)
+        if not prompt and endpoint == "/api/generate":
+            if parse_keep_alive(keep_alive) == 0:
+                self._loaded.pop(model, None)
+                self._last_prompt.pop(model, None)
+                return {"model": model, "response": "", "done": True, "done_reason": "unload"}
+            async with self.semaphore:
+                load = self._load(model, keep_alive)
+                await asyncio.sleep(load)
+            return {"model": model, "response": "", "done": True, "load_duration": int(load * 1e9)}
+
+        await asyncio.sleep(self._scale(self.profile["network_ms"] / 1000))
+        await self.semaphore.acquire()
+        started = time.perf_counter()
+        try:
+            load = self._load(model, keep_alive)
+            await asyncio.sleep(load)
+            prompt_tokens = self._prompt_tokens(model, prompt)
+            prompt_eval = self._scale(prompt_tokens / self.profile["prompt_tps"])
+            await asyncio.sleep(prompt_eval)
+            response = await self._response(endpoint, body)
+        except Exception:
+            self.semaphore.release()
+            raise
+
+        text = response["text"]
+        max_tokens = (body.get("options") or {}).get("num_predict")
+        tokens = re.findall(r"\S+\s*", text)
+        if max_tokens is not None and max_tokens >= 0:
+            tokens = tokens[:max_tokens]
+        per_token = 0.0 if response.get("live") else 1 / self.profile["tps"]
+
+        def final(eval_seconds: float) -> dict:
+            if parse_keep_alive(keep_alive) == 0:
+                self._loaded.pop(model, None)
+            return {
+                "total_duration": int((time.perf_counter() - started) * 1e9),
+                "load_duration": int(load * 1e9),
+                "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": int(prompt_eval * 1e9),
+                "eval_count": len(tokens),
+                "eval_duration": int(eval_seconds * 1e9),
+            }
+
+        if not body.get("stream", True):
+            try:
+                eval_seconds = self._scale(per_token * len(tokens))
+                await asyncio.sleep(eval_seconds)
+            finally:
+                self.semaphore.release()
+            return dict(self._chunk(endpoint, model, "".join(tokens), True), **final(eval_seconds))
+
+        async def stream():
+            eval_started = time.perf_counter()
+            try:
+                for token in tokens:
+                    await asyncio.sleep(self._scale(per_token))
+                    yield json.dumps(self._chunk(endpoint, model, token, False), ensure_ascii=False) + "\n"
+                last = dict(self._chunk(endpoint, model, "", True), **final(time.perf_counter() - eval_started))
+                yield json.dumps(last, ensure_ascii=False) + "\n"
+            finally:
+                self.semaphore.release()
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        return {
+            "profile": self.profile_name,
+            "mode": self.mode,
+            "loaded": [m for m, expires in self._loaded.items() if expires > now],
+            **self.stats,
+        }
+
+
+app = FastAPI(title="Fake Ollama", version="1.0.0")
+ollama = FakeOllama()
+
+
+@app.get("/")
+def root():
+    return "Ollama is running"
+
+
+@app.get("/api/tags")
+def tags():
+    return {"models": [{"name": m, "model": m, "size": 0, "details": {}} for m in ollama.models]}
+
+
+@app.get("/api/ps")
+def ps():
+    return {"models": [{"name": m, "model": m} for m in ollama.snapshot()["loaded"]]}
+
+
+@app.post("/api/generate")
+async def api_generate(request: Request):
+    return await ollama.handle("/api/generate", await request.json())
+
+
+@app.post("/api/chat")
+async def api_chat(request: Request):
+    return await ollama.handle("/api/chat", await request.json())
+
+
+@app.get("/fake/stats")
+def fake_stats():
+    return ollama.snapshot()
+
+
+def main():
+    global ollama
+    parser = argparse.ArgumentParser(description="Sostituto locale di Ollama per benchmark e CI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--profile", default=PROFILE, choices=sorted(PROFILES))
+    parser.add_argument("--mode", default=MODE, choices=["canned", "record", "replay"])
+    parser.add_argument("--parallel", type=int, default=PARALLEL)
+    args = parser.parse_args()
+
+    import uvicorn # type: ignore
+    ollama = FakeOllama(profile=args.profile, mode=args.mode, parallel=args.parallel)
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
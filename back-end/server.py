@@ -1,19 +1,24 @@
 from fastapi import FastAPI, HTTPException, Depends, Query, Body # type: ignore
-from fastapi.responses import FileResponse # type: ignore
+from fastapi.responses import FileResponse, StreamingResponse # type: ignore
+from fastapi.concurrency import run_in_threadpool # type: ignore
 from fastapi.middleware.cors import CORSMiddleware # type: ignore
 from pydantic import BaseModel, EmailStr
 from typing import List
 import uuid
 
-import os, json, uuid
-from utils import load_users, hash_password, check_password, load_rooms, save_rooms, parse_datetime, send_gmail_email, get_user_by_email
+import os, json, uuid, hashlib
+from utils import load_users, hash_password, check_password, parse_datetime, send_gmail_email, get_user_by_email
 from datetime import datetime, timedelta
 
 # import per il database
 from sqlmodel import Session, select # type: ignore
 from db.db import engine
-from db.models import User, Room, Document, ChatSession, ChatMessage
+from db.models import User, Room, Booking, Document, ChatSession, ChatMessage
+from db.bookings import create_booking, delete_booking, find_candidates, fetch_bookings, bookings_in_range, RoomUnavailable, BookingConflict
+from availability import availability, nearest_windows
 from sqlalchemy import desc #type: ignore
+from sqlalchemy.exc import IntegrityError #type: ignore
+from stream_hub import hub
 
 # toglie i warning 
 import warnings
@@ -46,7 +51,11 @@ def list_documents():
                 "id": d.id,
                 "title": d.title,
                 "description": d.description,
-                "filename": d.filename
+                "filename": d.filename,
+                "size_bytes": d.size_bytes,
+                "pages": d.pages,
+                "sha256": d.sha256,
+                "download_url": d.download_url
             } for d in docs
         ]
     
@@ -162,7 +171,14 @@ def update_password(data: CredentialRequest):
 @app.get("/rooms")
 def get_rooms():
     """Restituisce la lista di tutte le sale con le rispettive caratteristiche"""
-    rooms = load_rooms()
+    with Session(engine) as session:
+        rooms = session.exec(select(Room)).all()
+        bookings = session.exec(select(Booking).order_by(Booking.start)).all()
+
+    prenotazioni = {}
+    for b in bookings:
+        prenotazioni.setdefault(b.room_id, []).append(booking_to_dict(b))
+
     rooms_list = [
         {
             "id": u.id,
@@ -170,10 +186,20 @@ def get_rooms():
             "numero": u.numero,
             "capienza": u.capienza,
             "caratteristiche": u.caratteristiche,
-            "prenotazioni": u.prenotazioni
+            "prenotazioni": prenotazioni.get(u.id, [])
         } for u in rooms
     ]
     return rooms_list
+
+def booking_to_dict(booking: Booking) -> dict:
+    """Prenotazione nel formato dello storico JSONB (stringhe "%Y-%m-%d %H:%M")"""
+    return {
+        "id": str(booking.id),
+        "user": booking.user_email,
+        "start": booking.start.strftime("%Y-%m-%d %H:%M"),
+        "end": booking.end.strftime("%Y-%m-%d %H:%M"),
+        "persons": booking.persons
+    }
         
 class BookRoomRequest(BaseModel):
     appointment_date: str
@@ -203,48 +229,21 @@ def book_room(data: BookRoomRequest):
 
     requested_end = requested_start + timedelta(hours=float(appointment_duration))
 
-    # Carica sale
-    rooms = load_rooms()
-    room_features = [f.lower() for f in room_features]
-    available_room = None
-
-    def is_available(room, start, end):
-        for booking in room.prenotazioni:
-            booking_start = datetime.strptime(booking["start"], "%Y-%m-%d %H:%M")
-            booking_end = datetime.strptime(booking["end"], "%Y-%m-%d %H:%M")
-            if not (end <= booking_start or start >= booking_end):
-                return False
-        return True
-
-    for room in rooms:
-        features = [f.lower() for f in room.caratteristiche]
-        if all(feature in features for feature in room_features):
-            # Controlla disponibilità oraria
-            if is_available(room, requested_start, requested_end):
-                # Controlla capienza
-                try:
-                    persone = int(person_picker)
-                except (ValueError, TypeError):
-                    raise HTTPException(status_code=400, detail="Numero partecipanti non valido")
-                
-                if persone <= room.capienza:
-                    available_room = room
-                    break
-
-    if not available_room:
-        raise HTTPException(status_code=404, detail="Nessuna sala disponibile con le caratteristiche richieste in questo orario.")
+    try:
+        persone = int(person_picker)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Numero partecipanti non valido")
 
-    prenotazioni = available_room.prenotazioni or []
-    booking_id = str(uuid.uuid4())
-    prenotazioni.append({
-        "id": booking_id,    
-        "user": email,
-        "start": requested_start.strftime("%Y-%m-%d %H:%M"),
-        "end": requested_end.strftime("%Y-%m-%d %H:%M"),
-        "persons": person_picker
-    })
-    available_room.prenotazioni = prenotazioni
-    save_rooms(available_room)
+    # Controllo disponibilità e inserimento in un'unica transazione (vedi db/bookings.py)
+    try:
+        available_room, booking = create_booking(
+            engine, requested_start, requested_end, email, persone, room_features, availability
+        )
+    except RoomUnavailable:
+        raise HTTPException(status_code=404, detail="Nessuna sala disponibile con le caratteristiche richieste in questo orario.")
+    except BookingConflict:
+        raise HTTPException(status_code=409, detail="Troppe prenotazioni contemporanee, riprova tra qualche istante.")
+    booking_id = str(booking.id)
 
     response = {
         "message": "Prenotazione effettuata con successo",
@@ -276,25 +275,85 @@ def book_room(data: BookRoomRequest):
 
     return response
 
+@app.get("/rooms/freebusy")
+def get_free_busy(date: str, room_features: List[str] = Query(default=[]), persons: int = 0):
+    """Intervalli occupati e liberi di ogni sala in un giorno (YYYY-MM-DD), dalle bitmap in memoria"""
+    try:
+        day = datetime.strptime(date, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Data non valida, formato atteso YYYY-MM-DD")
+
+    with Session(engine) as session:
+        rooms = find_candidates(session, persons, room_features)
+        free_busy = availability.free_busy(rooms, day, fetch_bookings(session))
+
+    return [
+        {
+            "id": room.id,
+            "name": room.name,
+            "numero": room.numero,
+            "capienza": room.capienza,
+            "occupato": [{"inizio": s.strftime("%H:%M"), "fine": e.strftime("%H:%M")} for s, e in free_busy[room.id]["busy"]],
+            "libero": [{"inizio": s.strftime("%H:%M"), "fine": e.strftime("%H:%M")} for s, e in free_busy[room.id]["free"]]
+        } for room in rooms
+    ]
+
+@app.get("/rooms/availability")
+def get_availability(
+    date: str,
+    duration: float,
+    hour: str = "09:00",
+    persons: int = 1,
+    room_features: List[str] = Query(default=[]),
+    days: int = 7,
+    limit: int = 5
+):
+    """Finestre libere più vicine alla data/ora richiesta, su tutte le sale adatte, nei prossimi `days` giorni"""
+    try:
+        requested_start = parse_datetime(date, hour)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Data/ora non valida: {e}")
+    if duration <= 0:
+        raise HTTPException(status_code=400, detail="Durata non valida")
+
+    range_start = max(datetime.combine(requested_start.date(), datetime.min.time()), datetime.now())
+    range_end = datetime.combine(requested_start.date(), datetime.min.time()) + timedelta(days=days)
+
+    with Session(engine) as session:
+        rooms = find_candidates(session, persons, room_features)
+        bookings = bookings_in_range(session, [room.id for room in rooms], range_start, range_end)
+
+    windows = nearest_windows(rooms, bookings, requested_start, timedelta(hours=duration), range_start, range_end, limit)
+    return [
+        {
+            "data": w["start"].strftime("%Y-%m-%d"),
+            "inizio": w["start"].strftime("%H:%M"),
+            "fine": w["end"].strftime("%H:%M"),
+            "sale": [{"name": r.name, "numero": r.numero, "capienza": r.capienza} for r in w["rooms"]]
+        } for w in windows
+    ]
+
 @app.get("/rooms/reservations/{email}")
 def get_user_reservations(email: str):
     """Restituisce tutte le prenotazioni associate a un utente (tramite email)"""
     
-    rooms = load_rooms()
-    prenotazioni_utente = []
-
-    # Cicla tra tutte le sale e le loro prenotazioni
-    for room in rooms:
-        for prenotazione in room.prenotazioni or []:
-            if prenotazione["user"] == email:
-                prenotazioni_utente.append({
-                    "id": prenotazione["id"],
-                    "sala": room.name,
-                    "numero": room.numero,
-                    "inizio": prenotazione["start"],
-                    "fine": prenotazione["end"],
-                    "persone": prenotazione["persons"]
-                })
+    with Session(engine) as session:
+        rows = session.exec(
+            select(Booking, Room).join(Room, Booking.room_id == Room.id)
+            .where(Booking.user_email == email)
+            .order_by(Booking.start)
+        ).all()
+
+    prenotazioni_utente = [
+        {
+            "id": str(booking.id),
+            "sala": room.name,
+            "numero": room.numero,
+            "inizio": booking.start.strftime("%Y-%m-%d %H:%M"),
+            "fine": booking.end.strftime("%Y-%m-%d %H:%M"),
+            "persone": booking.persons
+        } for booking, room in rows
+    ]
 
     if not prenotazioni_utente:
         raise HTTPException(status_code=404, detail="Nessuna prenotazione trovata per questo utente.")
@@ -305,20 +364,17 @@ def get_user_reservations(email: str):
 def delete_reservation(reservation_id: str):
     """Elimina una prenotazione tramite il suo ID"""
     
-    rooms = load_rooms()
-    found = False
-
-    for room in rooms:
-        prenotazioni = room.prenotazioni or []
-        for p in prenotazioni:
-            if p["id"] == reservation_id:
-                prenotazioni.remove(p)
-                found = True
-                save_rooms(room)
-                return {"message": f"Prenotazione per {room.name} (n.{room.numero}) eliminata con successo"}
-
-    if not found:
+    try:
+        booking_uuid = uuid.UUID(reservation_id)
+    except ValueError:
         raise HTTPException(status_code=404, detail="Nessuna prenotazione trovata con l'ID fornito.")
+
+    deleted = delete_booking(engine, booking_uuid, availability)
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Nessuna prenotazione trovata con l'ID fornito.")
+
+    room, _ = deleted
+    return {"message": f"Prenotazione per {room.name} (n.{room.numero}) eliminata con successo"}
     
 # ============================================================
 #                     ENDPOINT CHAT
@@ -334,6 +390,8 @@ def save_message(session_id: str, payload: dict):
     """
     Salva un messaggio nella sessione specificata.
     Se session_id == "" viene creata una nuova sessione.
+    Con `stream_id` (risposte a un messaggio inviato in streaming) il salvataggio è
+    idempotente: la stessa risposta può arrivare sia da /chat/stream che dal frontend.
     """
     user_email = payload.get("user_email")
     sender = payload.get("sender")
@@ -343,6 +401,11 @@ def save_message(session_id: str, payload: dict):
     if not user_email or not sender or content is None:
         raise HTTPException(status_code=400, detail="Dati mancanti nel payload")
 
+    stream_key = None
+    if payload.get("stream_id"):
+        text_hash = hashlib.sha256((content.get("text") or "").encode("utf-8")).hexdigest()[:16]
+        stream_key = f"{payload['stream_id']}:{text_hash}"
+
     with Session(engine) as session:
         # -------------------------
         # 1️⃣ SE session_id È VUOTO → CREA UNA SESSIONE NUOVA
@@ -382,11 +445,20 @@ def save_message(session_id: str, payload: dict):
             sender=sender,
             type=type_,
             content=content,
-            timestamp=datetime.utcnow()
+            timestamp=datetime.utcnow(),
+            stream_key=stream_key
         )
 
-        session.add(chat_message)
-        session.commit()
+        if stream_key and session.exec(select(ChatMessage.id).where(ChatMessage.stream_key == stream_key)).first():
+            # Già salvato dall'altro percorso
+            session.commit()
+        else:
+            session.add(chat_message)
+            try:
+                session.commit()
+            except IntegrityError:
+                # Salvataggio concorrente con lo stesso stream_key: il messaggio c'è già
+                session.rollback()
 
         return {
             "message": "Messaggio salvato con successo",
@@ -508,3 +580,74 @@ def delete_session(session_id: str):
         session.commit()
 
         return {"message": "Sessione eliminata con successo", "session_id": str(session_id)}
+
+# ============================================================
+#                     ENDPOINT STREAMING
+# ============================================================
+
+@app.get("/chat/stream/{stream_id}")
+async def stream_tokens(stream_id: str):
+    """
+    Stream SSE dei token generati per un messaggio.
+    Il frontend sceglie lo stream_id e lo passa a Rasa nei metadata del messaggio.
+    """
+    return StreamingResponse(
+        hub.subscribe(stream_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/chat/stream/{stream_id}")
+async def push_stream_tokens(stream_id: str, payload: dict = Body(...)):
+    """
+    Riceve dal server delle azioni un gruppo di token o la chiusura dello stream.
+    Alla chiusura il messaggio finale viene salvato come ChatMessage (se la sessione è nota
+    e il testo non è vuoto: nei casi di errore o sovraccarico la risposta arriva da Rasa).
+    """
+    tokens = payload.get("tokens") or ""
+    events = [{"type": "token", "text": tokens}] if tokens else []
+
+    if payload.get("done"):
+        final_text = payload.get("text") or ""
+        persisted = False
+        if final_text and payload.get("session_id") and payload.get("user_email"):
+            try:
+                await run_in_threadpool(save_message, payload["session_id"], {
+                    "user_email": payload["user_email"],
+                    "stream_id": stream_id,
+                    "sender": "bot",
+                    "type": "text",
+                    "content": {"text": final_text, "buttons": [], "image": "", "custom": {}, "attachment": None},
+                })
+                persisted = True
+            except Exception as e:
+                print("Errore nel salvataggio del messaggio in streaming:", e)
+        events.append({"type": "done", "text": final_text, "persisted": persisted})
+
+    await hub.push(stream_id, events)
+    return {"message": "Token ricevuti"}
+
+# ============================================================
+#                     ENDPOINT DEBUG
+# ============================================================
+
+# Ultimo stato pubblicato dal server delle azioni (resolver Ollama, cache, code...)
+DEBUG_SNAPSHOTS = {}
+
+@app.get("/debug")
+def list_debug_snapshots():
+    """Elenca i componenti che hanno pubblicato il proprio stato"""
+    return {name: snap.get("received_at") for name, snap in DEBUG_SNAPSHOTS.items()}
+
+@app.get("/debug/{name}")
+def get_debug_snapshot(name: str):
+    """Restituisce l'ultimo stato pubblicato da un componente (es. /debug/ollama)"""
+    if name not in DEBUG_SNAPSHOTS:
+        raise HTTPException(status_code=404, detail="Nessuno stato disponibile per questo componente")
+    return DEBUG_SNAPSHOTS[name]
+
+@app.post("/debug/{name}")
+def publish_debug_snapshot(name: str, payload: dict = Body(...)):
+    """Riceve lo stato di un componente dal server delle azioni"""
+    DEBUG_SNAPSHOTS[name] = {**payload, "received_at": datetime.utcnow().isoformat() + "Z"}
+    return {"message": "Stato aggiornato"}
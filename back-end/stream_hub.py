@@ -0,0 +1,82 @@
+import asyncio
+import json
+import time
+from typing import Dict, List
+
+# Secondi dopo i quali uno stream concluso (o abbandonato) viene eliminato
+DONE_RETENTION = 60
+IDLE_TIMEOUT = 300
+# Intervallo dei commenti keep-alive inviati al browser mentre si attende
+HEARTBEAT_INTERVAL = 15
+
+
+class _Stream:
+    def __init__(self):
+        self.events: List[dict] = []
+        self.done = False
+        self.updated_at = time.time()
+        self.condition = asyncio.Condition()
+
+
+class StreamHub:
+    """
+    Smista i token generati dal server delle azioni verso i client SSE.
+
+    Le azioni inviano i token a gruppi con `push`; il frontend legge lo stesso
+    stream_id con `subscribe`, che restituisce anche gli eventi arrivati prima
+    della sottoscrizione. Tutto gira sull'event loop di FastAPI.
+    """
+
+    def __init__(self):
+        self._streams: Dict[str, _Stream] = {}
+
+    def _get(self, stream_id: str) -> _Stream:
+        self._gc()
+        if stream_id not in self._streams:
+            self._streams[stream_id] = _Stream()
+        return self._streams[stream_id]
+
+    def _gc(self):
+        now = time.time()
+        expired = [
+            sid for sid, s in self._streams.items()
+            if now - s.updated_at > (DONE_RETENTION if s.done else IDLE_TIMEOUT)
+        ]
+        for sid in expired:
+            del self._streams[sid]
+
+    async def push(self, stream_id: str, events: List[dict]) -> None:
+        stream = self._get(stream_id)
+        async with stream.condition:
+            stream.events.extend(events)
+            stream.done = stream.done or any(e.get("type") == "done" for e in events)
+            stream.updated_at = time.time()
+            stream.condition.notify_all()
+
+    async def subscribe(self, stream_id: str):
+        """Generatore di eventi in formato text/event-stream."""
+        stream = self._get(stream_id)
+        index = 0
+
+        while True:
+            async with stream.condition:
+                if index >= len(stream.events) and not stream.done:
+                    try:
+                        await asyncio.wait_for(stream.condition.wait(), timeout=HEARTBEAT_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+                pending = stream.events[index:]
+                index += len(pending)
+                finished = stream.done and index >= len(stream.events)
+
+            if not pending and not finished:
+                yield ": keep-alive\n\n"
+            for event in pending:
+                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+            if finished:
+                return
+            if time.time() - stream.updated_at > IDLE_TIMEOUT:
+                return
+
+
+hub = StreamHub()
@@ -0,0 +1,132 @@
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from availability import AvailabilityEngine, nearest_windows # noqa: E402
+
+# ------------------------------------------------------------
+#  Microbenchmark: controllo disponibilità di tutte le sale con il
+#  vecchio ciclo (strptime su ogni prenotazione JSONB) contro le
+#  bitmap a slot di 15 minuti di availability.py, più la ricerca
+#  delle finestre libere di /rooms/availability su una settimana
+# ------------------------------------------------------------
+
+
+def make_data(rooms, days, per_day, seed):
+    rnd = random.Random(seed)
+    base = datetime(2025, 1, 6)
+    room_objs = [SimpleNamespace(id=i, version=0, prenotazioni=[]) for i in range(rooms)]
+    bookings = []
+    for room in room_objs:
+        for d in range(days):
+            for _ in range(per_day):
+                start = base + timedelta(days=d, hours=rnd.randint(8, 18), minutes=rnd.choice([0, 15, 30, 45]))
+                end = start + timedelta(minutes=rnd.choice([30, 60, 90, 120]))
+                booking = SimpleNamespace(id=len(bookings), room_id=room.id, start=start, end=end)
+                bookings.append(booking)
+                room.prenotazioni.append({"start": start.strftime("%Y-%m-%d %H:%M"), "end": end.strftime("%Y-%m-%d %H:%M")})
+    queries = []
+    for _ in range(500):
+        start = base + timedelta(days=rnd.randrange(days), hours=rnd.randint(8, 18), minutes=rnd.choice([0, 15, 30, 45]))
+        queries.append((start, start + timedelta(minutes=rnd.choice([30, 60, 90]))))
+    return room_objs, bookings, queries
+
+
+def old_is_available(room, start, end):
+    # Ciclo di server.book_room prima della tabella bookings
+    for booking in room.prenotazioni:
+        booking_start = datetime.strptime(booking["start"], "%Y-%m-%d %H:%M")
+        booking_end = datetime.strptime(booking["end"], "%Y-%m-%d %H:%M")
+        if not (end <= booking_start or start >= booking_end):
+            return False
+    return True
+
+
+def bench(fn, queries, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        results = [fn(start, end) for start, end in queries]
+        timings.append((time.perf_counter() - started) / len(queries))
+    return statistics.median(timings), results
+
+
+def check_misaligned_windows():
+    """Buchi che finiscono fuori dalla griglia dei 15 minuti: la finestra valida non deve sparire."""
+    room = SimpleNamespace(id=0)
+    day = datetime(2025, 1, 6)
+    requested = day.replace(hour=9, minute=30)
+    errors = []
+    for minute, expected in ((0, day.replace(hour=9)), (7, day.replace(hour=9))):
+        # Prenotazione dalle 10:MM: il buco 8:00-10:MM contiene un'ora che inizia alle 9:00
+        booking = SimpleNamespace(id=1, room_id=0, start=day.replace(hour=10, minute=minute), end=day.replace(hour=12))
+        windows = nearest_windows([room], [booking], requested, timedelta(hours=1), day, day + timedelta(days=1), limit=1)
+        if not windows or windows[0]["start"] != expected:
+            errors.append(f"prenotazione dalle 10:{minute:02d}: attesa {expected:%H:%M}, ottenuto {windows}")
+    # Nessuno slot allineato tra 9:07 e 9:10 (ultimo inizio utile): si usa l'ultimo inizio esatto
+    booking = SimpleNamespace(id=1, room_id=0, start=day.replace(hour=8), end=day.replace(hour=9, minute=7))
+    after = SimpleNamespace(id=2, room_id=0, start=day.replace(hour=10, minute=10), end=day.replace(hour=20))
+    windows = nearest_windows([room], [booking, after], day.replace(hour=11), timedelta(hours=1), day, day + timedelta(days=1), limit=1)
+    if not windows or windows[0]["start"] != day.replace(hour=9, minute=10):
+        errors.append(f"buco 9:07-10:10: attesa 09:10, ottenuto {windows}")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bitmap di disponibilità vs ciclo sulle prenotazioni")
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--per-day", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--building", type=int, default=200, help="sale per il test delle finestre libere")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rooms, bookings, queries = make_data(args.rooms, args.days, args.per_day, args.seed)
+
+    def fetch(start, end, room_ids):
+        ids = set(room_ids)
+        return [b for b in bookings if b.room_id in ids and b.start < end and b.end > start]
+
+    engine = AvailabilityEngine(max_days=args.days + 1)
+    # Carica tutti i giorni interrogati: il benchmark misura il controllo, non il caricamento
+    started = time.perf_counter()
+    for start, end in queries:
+        engine.free_rooms(rooms, start, end, fetch)
+    load_time = time.perf_counter() - started
+
+    old_time, old_results = bench(lambda s, e: {r.id for r in rooms if old_is_available(r, s, e)}, queries, args.repeat)
+    new_time, new_results = bench(lambda s, e: engine.free_rooms(rooms, s, e, fetch), queries, args.repeat)
+
+    # /rooms/availability: un edificio intero (--building sale) per una settimana
+    building, week_bookings, _ = make_data(args.building, 7, args.per_day, args.seed)
+    week_bookings.sort(key=lambda b: (b.room_id, b.start))
+    base = datetime(2025, 1, 6)
+    windows_time, _ = bench(
+        lambda s, e: nearest_windows(building, week_bookings, s, e - s, base, base + timedelta(days=7)),
+        queries[:50], args.repeat
+    )
+
+    mismatches = sum(1 for a, b in zip(old_results, new_results) if a != b)
+    window_errors = check_misaligned_windows()
+    print(f"{args.rooms} sale, {len(bookings)} prenotazioni, {len(queries)} richieste")
+    print(f"ciclo con strptime: {old_time * 1e6:10.1f} µs per richiesta")
+    print(f"bitmap:             {new_time * 1e6:10.1f} µs per richiesta  ({old_time / new_time:.0f}x)")
+    print(f"caricamento iniziale delle bitmap: {load_time * 1000:.0f} ms")
+    print(f"finestre libere ({args.building} sale, {len(week_bookings)} prenotazioni, 7 giorni): "
+          f"{windows_time * 1000:.1f} ms per richiesta")
+    print(f"risultati diversi: {mismatches}")
+    print(f"statistiche: {engine.stats()}")
+    for error in window_errors:
+        print(f"❌ finestre libere non allineate: {error}")
+    sys.exit(1 if mismatches or window_errors else 0)
+
+
+if __name__ == "__main__":
+    main()
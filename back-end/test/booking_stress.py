@@ -0,0 +1,156 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+# ------------------------------------------------------------
+#  Stress test delle prenotazioni concorrenti: molte richieste
+#  in parallelo sullo stesso orario non devono mai produrre
+#  prenotazioni sovrapposte nella stessa sala.
+#
+#  Direttamente su database (default SQLite usa e getta):
+#      python test/booking_stress.py --workers 50 --requests 200
+#  Su Postgres:
+#      python test/booking_stress.py --db postgresql+psycopg2://...
+#  Tramite API (server.py avviato):
+#      python test/booking_stress.py --url http://localhost:8000
+# ------------------------------------------------------------
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+ROOMS_FILE = os.path.join(BACKEND_DIR, "db/json/rooms.json")
+
+
+def setup_database(db_url):
+    # db.db legge DATABASE_URL all'import
+    os.environ["DATABASE_URL"] = db_url
+    sys.path.insert(0, BACKEND_DIR)
+    from sqlmodel import SQLModel, Session # type: ignore
+    from sqlalchemy import text # type: ignore
+    from db.db import engine
+    from db.models import Room, Booking
+
+    SQLModel.metadata.create_all(engine, tables=[Room.__table__, Booking.__table__])
+    with open(ROOMS_FILE, encoding="utf-8") as f:
+        rooms = json.load(f)
+    with Session(engine) as session:
+        session.exec(text("DELETE FROM bookings"))
+        session.exec(text("DELETE FROM rooms"))
+        for name, r in rooms.items():
+            session.add(Room(name=name, numero=r["numero"], capienza=r["capienza"],
+                             caratteristiche=r["caratteristiche"], prenotazioni=[]))
+        session.commit()
+    return engine
+
+
+def book_direct(engine, start, end, email, persons, features):
+    from db.bookings import create_booking, RoomUnavailable, BookingConflict
+    try:
+        room, _ = create_booking(engine, start, end, email, persons, features)
+        return "ok", room.name
+    except RoomUnavailable:
+        return "unavailable", None
+    except BookingConflict:
+        return "conflict", None
+
+
+def book_api(url, start, end, email, persons, features):
+    res = requests.post(f"{url}/rooms/book", json={
+        "appointment_date": start.strftime("%Y-%m-%d"),
+        "appointment_hour": start.strftime("%H:%M"),
+        "appointment_duration": (end - start).total_seconds() / 3600,
+        "person_picker": persons,
+        "room_features": features,
+        "email": email,
+    }, timeout=120)
+    if res.status_code == 200:
+        return "ok", res.json()["room_name"]
+    return {404: "unavailable", 409: "conflict"}.get(res.status_code, f"http_{res.status_code}"), None
+
+
+def find_overlaps(bookings):
+    """Coppie di prenotazioni sovrapposte nella stessa sala: (sala, inizio, fine, email)."""
+    overlaps = []
+    by_room = {}
+    for b in bookings:
+        by_room.setdefault(b[0], []).append(b)
+    for room, items in by_room.items():
+        items.sort(key=lambda b: b[1])
+        for prev, cur in zip(items, items[1:]):
+            if cur[1] < prev[2]:
+                overlaps.append((prev, cur))
+    return overlaps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress test delle prenotazioni concorrenti")
+    parser.add_argument("--db", default="sqlite:///booking_stress.sqlite3")
+    parser.add_argument("--url", help="URL del server FastAPI: usa /rooms/book invece del database")
+    parser.add_argument("--workers", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--slots", type=int, default=2, help="orari distinti contesi dalle richieste")
+    parser.add_argument("--features", default="Monitor")
+    args = parser.parse_args()
+
+    features = [f.strip() for f in args.features.split(",") if f.strip()]
+    day = (datetime.now() + timedelta(days=7)).replace(hour=9, minute=0, second=0, microsecond=0)
+    slots = [(day + timedelta(hours=2 * i), day + timedelta(hours=2 * i + 1)) for i in range(args.slots)]
+
+    if args.url:
+        book = lambda start, end, email: book_api(args.url, start, end, email, 2, features)
+    else:
+        engine = setup_database(args.db)
+        book = lambda start, end, email: book_direct(engine, start, end, email, 2, features)
+
+    # Tutti i thread partono insieme per massimizzare la contesa
+    barrier = threading.Barrier(min(args.workers, args.requests))
+
+    def worker(i):
+        start, end = slots[i % len(slots)]
+        try:
+            barrier.wait(timeout=10)
+        except threading.BrokenBarrierError:
+            pass
+        return book(start, end, f"stress{i}@example.com")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        results = list(pool.map(worker, range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    outcomes = Counter(status for status, _ in results)
+    print(f"{args.requests} richieste, {args.workers} thread, {elapsed:.2f}s")
+    for status, count in sorted(outcomes.items()):
+        print(f"  {status:<12} {count}")
+
+    if args.url:
+        res = requests.get(f"{args.url}/rooms", timeout=30).json()
+        bookings = [
+            (room["name"], datetime.strptime(p["start"], "%Y-%m-%d %H:%M"), datetime.strptime(p["end"], "%Y-%m-%d %H:%M"), p["user"])
+            for room in res for p in room["prenotazioni"] if p["user"].startswith("stress")
+        ]
+    else:
+        from sqlmodel import Session, select # type: ignore
+        from db.models import Room, Booking
+        with Session(engine) as session:
+            rows = session.exec(select(Booking, Room).where(Booking.room_id == Room.id)).all()
+            bookings = [(room.name, b.start, b.end, b.user_email) for b, room in rows]
+
+    overlaps = find_overlaps(bookings)
+    print(f"Prenotazioni salvate: {len(bookings)} (riuscite secondo le risposte: {outcomes['ok']})")
+    # Via API il database può contenere prenotazioni di esecuzioni precedenti: si controllano solo le sovrapposizioni
+    if overlaps or (not args.url and len(bookings) != outcomes["ok"]):
+        print(f"❌ {len(overlaps)} sovrapposizioni trovate")
+        for prev, cur in overlaps[:10]:
+            print(f"   {prev} <-> {cur}")
+        sys.exit(1)
+    print("✅ Nessuna sovrapposizione")
+
+
+if __name__ == "__main__":
+    main()
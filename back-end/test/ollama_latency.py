@@ -0,0 +1,103 @@
+import os
+import argparse
+import statistics
+import time
+
+import requests
+
+# ------------------------------------------------------------
+#  Misura della latenza di Ollama: avvio a freddo vs modello caldo,
+#  prompt completo su /api/generate vs prefisso di sistema su /api/chat
+# ------------------------------------------------------------
+OLLAMA_URL = "http://localhost:11434"
+
+# Lo stesso prefisso di sistema inviato da ActionAnswerFromChroma
+SYSTEM_PROMPT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../actions/data/prompts/rag_system.txt")
+with open(SYSTEM_PROMPT_FILE, encoding="utf-8") as f:
+    SYSTEM_PROMPT = f.read().strip()
+
+QUESTIONS = [
+    "Chi deve approvare le ferie?",
+    "Quanti giorni di smart working sono previsti?",
+    "Come si richiede un permesso?",
+    "Qual è l'orario di lavoro?",
+]
+
+
+def post(url, endpoint, payload):
+    start = time.perf_counter()
+    res = requests.post(f"{url}{endpoint}", json=payload, timeout=600)
+    res.raise_for_status()
+    data = res.json()
+    return {
+        "wall_ms": (time.perf_counter() - start) * 1000,
+        "load_ms": data.get("load_duration", 0) / 1e6,
+        "prompt_tokens": data.get("prompt_eval_count", 0),
+        "prompt_eval_ms": data.get("prompt_eval_duration", 0) / 1e6,
+    }
+
+
+def ask_generate(url, model, question, keep_alive):
+    prompt = f"{SYSTEM_PROMPT}\n\nDomanda:\n{question}\n\nRisposta concisa in italiano:"
+    return post(url, "/api/generate", {
+        "model": model, "prompt": prompt, "stream": False, "keep_alive": keep_alive,
+        "options": {"num_predict": 32},
+    })
+
+
+def ask_chat(url, model, question, keep_alive):
+    return post(url, "/api/chat", {
+        "model": model, "stream": False, "keep_alive": keep_alive,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": f"Domanda:\n{question}\n\nRisposta concisa in italiano:"},
+        ],
+        "options": {"num_predict": 32},
+    })
+
+
+def unload(url, model):
+    # keep_alive 0 scarica subito il modello dalla memoria
+    requests.post(f"{url}/api/generate", json={"model": model, "keep_alive": 0}, timeout=60)
+
+
+def summary(name, runs):
+    print(f"{name:<28} wall {statistics.median(r['wall_ms'] for r in runs):8.0f} ms | "
+          f"load {statistics.median(r['load_ms'] for r in runs):7.0f} ms | "
+          f"prompt {statistics.median(r['prompt_tokens'] for r in runs):5.0f} tok in "
+          f"{statistics.median(r['prompt_eval_ms'] for r in runs):6.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latenza di Ollama a freddo e a caldo")
+    parser.add_argument("--url", default=OLLAMA_URL)
+    parser.add_argument("--model", default="phi3:3.8b")
+    parser.add_argument("--keep-alive", default="30m")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    # Primo turno senza warmup: il modello va caricato a ogni richiesta
+    cold = []
+    for i in range(args.runs):
+        unload(args.url, args.model)
+        cold.append(ask_generate(args.url, args.model, QUESTIONS[i % len(QUESTIONS)], 0))
+
+    # Dopo il warmup: modello già in memoria e prefisso di sistema già valutato
+    unload(args.url, args.model)
+    start = time.perf_counter()
+    requests.post(f"{args.url}/api/generate", json={"model": args.model, "keep_alive": args.keep_alive}, timeout=600)
+    ask_chat(args.url, args.model, QUESTIONS[0], args.keep_alive)
+    warmup_ms = (time.perf_counter() - start) * 1000
+
+    warm_generate = [ask_generate(args.url, args.model, q, args.keep_alive) for q in QUESTIONS[:args.runs]]
+    warm_chat = [ask_chat(args.url, args.model, q, args.keep_alive) for q in QUESTIONS[:args.runs]]
+
+    print(f"Modello: {args.model} su {args.url}")
+    print(f"Warmup all'avvio: {warmup_ms:.0f} ms")
+    summary("freddo /api/generate", cold)
+    summary("caldo /api/generate", warm_generate)
+    summary("caldo /api/chat (system)", warm_chat)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 import { ComponentFixture, TestBed, fakeAsync, tick, waitForAsync } from '@angular/core/testing';
 import { provideHttpClientTesting } from '@angular/common/http/testing';
 import { AuthService } from '../services/auth.service';
-import { of } from 'rxjs';
+import { EMPTY, of } from 'rxjs';
 import { ChatService } from '../services/chat.service';
 
 import { Home } from './home.component';
@@ -19,7 +19,8 @@ describe('HomeComponent', () => {
     };
 
     const chatStub: Partial<ChatService> = {
-      sendMessage: (_text: string, _email: string) => of([])
+      sendMessage: (_text: string, _email: string) => of([]),
+      streamTokens: (_streamId: string) => EMPTY
     };
 
     await TestBed.configureTestingModule({
@@ -5,7 +5,7 @@ import { ChatBubble } from '../chat-bubble/chat-bubble.component';
 import { AuthService } from '../services/auth.service';
 import { Message } from '../interfaces/message';
 import { take } from 'rxjs/internal/operators/take';
-import { ChatService } from '../services/chat.service';
+import { ChatService, StreamEvent } from '../services/chat.service';
 import { Sidebar } from '../sidebar/sidebar.component';
 
 @Component({
@@ -189,7 +189,11 @@ export class Home implements AfterViewChecked {
       this.closeChatSession();
     }
 
-    this.saveMessageToBackend(message);
+    // I messaggi arrivati in streaming sono già stati salvati da server.py; se l'evento
+    // 'done' arriva dopo la risposta di Rasa lo stream_id evita il doppio salvataggio
+    if (!message.persisted) {
+      this.saveMessageToBackend(message);
+    }
 
     const isBot = message.role === 'bot';
     const isHumanOperatorTrigger = isBot && message.text?.toLowerCase().includes('operatore umano');
@@ -255,6 +259,7 @@ export class Home implements AfterViewChecked {
         body: JSON.stringify({
           user_email: this.email,
           sender: message.role,
+          stream_id: message.streamId || null,
           type: this.getMessageType(message),
           content: {
             text: message.text || '',
@@ -314,19 +319,58 @@ export class Home implements AfterViewChecked {
     this.auth.getCurrentUser().pipe(take(1)).subscribe((user) => {
       if (!user) return;
 
-      this.chatService.sendMessage(text, user.email).pipe(take(1)).subscribe((res) => {
+      // Stream dei token: la risposta compare mentre viene generata
+      const streamId = crypto.randomUUID();
+      let streamed: StreamEvent | null = null;
+      const stream = this.chatService.streamTokens(streamId).subscribe((event) => {
+        if (event.type === 'done') {
+          streamed = event;
+          return;
+        }
+        this.appendStreamToken(event.text);
+      });
+
+      const metadata = { stream_id: streamId, session_id: this.current_session || null };
+      this.chatService.sendMessage(text, user.email, metadata).pipe(take(1)).subscribe((res) => {
+        stream.unsubscribe();
+        this.removeStreamingMessage();
+
         res.forEach((r) => {
           const msg = this.createMessage(r.text, 'bot');
           msg.buttons = r.buttons || [];
           msg.custom = r.custom || {};
           msg.image = r.image || '';
           msg.attachment = r.attachment;
+          msg.persisted = !!streamed?.persisted && streamed.text === r.text;
+          msg.streamId = streamId;
           this.handleMessage(msg);
         });
       });
     });
   }
 
+  /* -------------------------------------------------------- */
+  /*  STREAMING                                               */
+  /* -------------------------------------------------------- */
+
+  appendStreamToken(token: string) {
+    const last = this.messages[this.messages.length - 1];
+
+    if (last?.streaming) {
+      last.text = (last.text || '') + token;
+    } else {
+      this.resetLongWait();
+      const msg = this.createMessage(token, 'bot');
+      msg.streaming = true;
+      this.messages.push(msg);
+    }
+    this.shouldScroll = true;
+  }
+
+  removeStreamingMessage() {
+    this.messages = this.messages.filter((m) => !m.streaming);
+  }
+
   /* -------------------------------------------------------- */
   /*  QUICK ACTIONS (COMPATTATE)                              */
   /* -------------------------------------------------------- */
@@ -8,4 +8,7 @@ export interface Message {
   time: string;
   elapsedSeconds?: number | null;
   disabled?: boolean;
+  streaming?: boolean;
+  persisted?: boolean;
+  streamId?: string;
 }
\ No newline at end of file
@@ -13,6 +13,12 @@ interface RasaResponse {
   confidence?: number;
 }
 
+export interface StreamEvent {
+  type: 'token' | 'done';
+  text: string;
+  persisted?: boolean;
+}
+
 @Injectable({
   providedIn: 'root'
 })
@@ -21,6 +27,8 @@ export class ChatService {
   private RASA_WEBHOOK_URL = 'http://localhost:5005/webhooks/rest/webhook';
   private RASA_PARSE_URL = 'http://localhost:5005/model/parse'; //senza questo non possiamo sapere intent e confidence
 
+  private API_URL = 'https://enterprise-chatbot.onrender.com';
+
   private GIST_RASA_URL =
     "https://gist.githubusercontent.com/AndreaNapoli08/0b153d525eb3a45d37cafd65b32bca8c/raw/rasa_base_url.txt";
 
@@ -36,7 +44,30 @@ export class ChatService {
     );
   }
 
-  sendMessage(message: string, email: string): Observable<RasaResponse[]> {
+  // 🔧 Riceve via SSE i token della risposta mentre l'LLM la sta generando
+  streamTokens(streamId: string): Observable<StreamEvent> {
+    return new Observable<StreamEvent>(subscriber => {
+      const source = new EventSource(`${this.API_URL}/chat/stream/${streamId}`);
+
+      source.onmessage = (event) => {
+        const data: StreamEvent = JSON.parse(event.data);
+        subscriber.next(data);
+        if (data.type === 'done') {
+          source.close();
+          subscriber.complete();
+        }
+      };
+      source.onerror = () => {
+        // Lo streaming è opzionale: la risposta completa arriva comunque dal webhook
+        source.close();
+        subscriber.complete();
+      };
+
+      return () => source.close();
+    });
+  }
+
+  sendMessage(message: string, email: string, metadata: Record<string, any> = {}): Observable<RasaResponse[]> {
     return this.loadRasaBaseUrl().pipe(
       switchMap(baseUrl => {
         if (!baseUrl) {
@@ -54,7 +85,7 @@ export class ChatService {
             // 2️⃣ Manda il messaggio
             return this.http.post<RasaResponse[]>(webhookUrl, {
               message: message,
-              metadata: { email }
+              metadata: { ...metadata, email }
             }).pipe(
               // 3️⃣ Aggiunge intent e confidence ad ogni risposta bot
               map(responses =>